@@ -9,6 +9,7 @@ import logging
 import shlex
 
 from behave.model import FileLocation
+from behave.runner_util import parse_shard
 from behave.reporter.junit import JUnitReporter
 from behave.reporter.summary import SummaryReporter
 from behave.tag_expression import TagExpression
@@ -72,8 +73,17 @@ options = [
      dict(metavar="NUMBER", dest='proc_count',
           help="""Use multiple pids to do the work faster.
 		Not all options work properly under parallel mode. See README.md 
+		Use 'auto' to adapt the number of pids to CPUs, memory, load
+		and remaining jobs while running.
 		""")),
 
+    (('--threads',),
+     dict(metavar="NUMBER", dest='thread_count', type=int,
+          help="""Run the jobs in worker threads of one process instead of
+                  worker processes (for suites whose steps mostly wait
+                  for I/O). Each thread has its own context and capture.
+                  Hooks and steps must be thread-safe.""")),
+
     (('--parallel-element',),
      dict(metavar="STRING", dest='parallel_element',
           help="""If you used the --processes option, then this will control how the tests get parallelized.
@@ -81,6 +91,62 @@ options = [
 		info on how this works.
 		""")),
 
+    (('--max-chunk-size',),
+     dict(metavar="NUMBER", dest='max_chunk_size', type=int,
+          help="""Maximal number of jobs that a worker gets at once
+                  (default: 10). Short jobs are batched to save
+                  round-trips, chunks shrink towards the end of the run.
+                  Use 1 to hand out one job at a time.""")),
+
+    (('--affinity',),
+     dict(metavar="GROUPING", dest='affinity',
+          help="""Keep the scenarios of a group on the same worker, so it
+                  can reuse its feature setup (before_feature runs once
+                  per group in a worker). GROUPING is "feature" or
+                  "tag:PREFIX" (group by the first tag that starts with
+                  PREFIX, otherwise by feature). A worker whose group is
+                  done takes a new group or helps with the biggest
+                  one.""")),
+
+    (('--shard',),
+     dict(metavar="INDEX/COUNT", dest='shard',
+          help="""Run only one part of the selected scenarios, to split a
+                  run over COUNT machines (like: --shard=2/4). The parts
+                  are balanced by the number of scenarios, or by the
+                  durations in --shard-durations. Can be combined with
+                  --processes.""")),
+
+    (('--shard-durations',),
+     dict(metavar="PATH", dest='shard_durations',
+          help="""Timing database (see --timing-db) that all shards share,
+                  like a CI artifact of a previous run. The shards are
+                  balanced by its durations. Each shard must use the same
+                  file, otherwise the shards may overlap.""")),
+
+    (('--timing-db',),
+     dict(metavar="PATH", dest='timing_db',
+          help="""Database file with the durations of previous runs.
+                  Parallel runs use it to start the longest jobs first.
+                  Use an empty PATH to disable it.""")),
+
+    (('--coordinator',),
+     dict(metavar="HOST:PORT", dest='coordinator',
+          help="""Serve the jobs of a parallel run to agents (on other
+                  machines) that connect to this address, and report
+                  their results. See README.md""")),
+
+    (('--agent-wait',),
+     dict(metavar="SECONDS", dest='agent_wait', type=float,
+          help="""How long the coordinator waits for agents to (re)connect
+                  when all agents are gone and jobs are left (default: 60).
+                  Then the jobs that are left are reported as not run.""")),
+
+    (('--agent',),
+     dict(metavar="HOST:PORT", dest='agent',
+          help="""Run the jobs that the coordinator at this address serves.
+                  Use the same sources and arguments as the coordinator.
+                  --processes is the number of jobs run in parallel.""")),
+
     (('-e', '--exclude'),
      dict(metavar="PATTERN", dest='exclude_re',
           help="""Don't run feature files matching regular expression
@@ -107,6 +173,11 @@ options = [
           default='reports',
           help="""Directory in which to store JUnit reports.""")),
 
+    (('--junit-merged',),
+     dict(metavar='FILENAME', dest='junit_merged',
+          help="""Also write all JUnit testsuites into this file
+                  (as one <testsuites> document).""")),
+
     ((),  # -- CONFIGFILE only
      dict(dest='default_format',
           help="Specify default formatter (default: pretty).")),
@@ -271,6 +342,58 @@ options = [
      dict(action='store_true',
           help='Stop running tests at the first failure.')),
 
+    (('--scenario-timeout',),
+     dict(metavar="SECONDS", dest='scenario_timeout', type=float,
+          help="""Parallel runs: Kill (and restart) a worker whose scenario
+                  runs longer, the scenario fails. Use a tag like
+                  @timeout:120 to override it for a feature/scenario.""")),
+
+    (('--step-timeout',),
+     dict(metavar="SECONDS", dest='step_timeout', type=float,
+          help="""Parallel runs: Kill (and restart) a worker whose step
+                  runs longer, its scenario fails.""")),
+
+    (('--retry',),
+     dict(metavar="NUMBER", dest='retry', type=int,
+          help="""Parallel runs: Run a failed job up to NUMBER times again
+                  (in the same worker). A feature or scenario tag like
+                  @retry:2 overrides it. Jobs that pass after a retry are
+                  reported as flaky.""")),
+
+    (('--max-jobs-per-worker',),
+     dict(metavar="NUMBER", dest='max_jobs_per_worker', type=int,
+          help="""Parallel runs: Retire a worker after it has run NUMBER
+                  jobs, a fresh worker takes its place (against memory
+                  leaks in long runs).""")),
+
+    (('--max-worker-rss',),
+     dict(metavar="MEGABYTES", dest='max_worker_rss', type=int,
+          help="""Parallel runs: Retire a worker process after a job if
+                  its resident memory exceeds MEGABYTES, a fresh worker
+                  takes its place (requires /proc, ignored for
+                  --threads).""")),
+
+    (('--fork-server',),
+     dict(action='store_true', dest='fork_server',
+          help="""Parallel runs (--processes): Fork the workers from a
+                  template process that loaded the step definitions (and
+                  --preload modules) before the before_all hook ran.
+                  Workers start faster and don't inherit the state of
+                  before_all, use the before_worker hook instead.""")),
+
+    (('--preload',),
+     dict(metavar="MODULES", dest='preload',
+          help="""Parallel runs: Import these modules (comma-separated,
+                  like: lxml,myapp.models) once before the workers are
+                  forked, so workers start with warm imports.""")),
+
+    (('--max-failures',),
+     dict(metavar="NUMBER", dest='max_failures', type=int,
+          help="""Stop running tests after NUMBER failed scenarios.
+                  In parallel runs, no worker starts another job after
+                  the limit is reached (--stop means: --max-failures 1).
+                  """)),
+
     # -- DISABLE-UNUSED-OPTION: Not used anywhere.
     # (('-S', '--strict'),
     # dict(action='store_true',
@@ -451,6 +574,9 @@ class Configuration(object):
         logging_level=logging.INFO,
         summary=True,
         junit=False,
+        timing_db='.behave_timings.db',
+        max_chunk_size=10,
+        agent_wait=60.0,
         # -- SPECIAL:
         default_format="pretty",   # -- Used when no formatters are configured.
     )
@@ -524,6 +650,27 @@ class Configuration(object):
             # -- SELECT: Scenario-by-name, build regular expression.
             self.name_re = self.build_name_re(self.name)
 
+        if self.shard:
+            try:
+                self.shard = parse_shard(self.shard)
+            except ValueError, e:
+                parser.error("shard: %s" % e)
+        self.check_number('max_failures', int, minimum=0)
+        self.check_number('thread_count', int, minimum=1, option='--threads')
+        if self.proc_count is not None and self.proc_count != 'auto':
+            if not str(self.proc_count).strip().isdigit():
+                parser.error("--processes: must be a number or 'auto', not %s"
+                             % self.proc_count)
+            self.check_number('proc_count', int, minimum=1,
+                              option='--processes')
+        self.check_number('max_chunk_size', int, minimum=1)
+        self.check_number('agent_wait', float, minimum=0)
+        self.check_number('retry', int, minimum=0)
+        self.check_number('max_jobs_per_worker', int, minimum=1)
+        self.check_number('max_worker_rss', int, minimum=1)
+        self.check_number('scenario_timeout', float, minimum=0)
+        self.check_number('step_timeout', float, minimum=0)
+
         if self.junit:
             # Buffer the output (it will be put into Junit report)
             self.stdout_capture = True
@@ -537,6 +684,29 @@ class Configuration(object):
         if unknown_formats:
             parser.error("format=%s is unknown" % ", ".join(unknown_formats))
 
+    def check_number(self, name, convert, minimum=None, option=None):
+        """
+        Convert a numeric option (that may be given as text in a configuration
+        file) and check its minimum, exit with a usage error otherwise.
+
+        :param name:    Name of the option (attribute).
+        :param convert: Type to convert to (like: int, float).
+        :param minimum: Smallest valid value (if any).
+        :param option:  Option name for errors (default: derived from name).
+        """
+        value = getattr(self, name)
+        if value is None:
+            return
+        option = option or "--" + name.replace('_', '-')
+        try:
+            value = convert(value)
+        except (TypeError, ValueError):
+            parser.error("%s: invalid number: %s" % (option, value))
+        if minimum is not None and value < minimum:
+            parser.error("%s: must be at least %s, not %s" % \
+                         (option, minimum, value))
+        setattr(self, name, value)
+
     def collect_unknown_formats(self):
         unknown_formats = []
         if self.format:
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+Provides distributed test runs: A coordinator serves the jobs of a test run
+to agent processes on other machines over TCP.
+
+.. code-block:: sh
+
+    # -- COORDINATOR: Parses the features, serves jobs, reports results.
+    behave-parallel --coordinator 0.0.0.0:7777 --parallel-element scenario
+    # -- AGENT (on each CI box, same checkout and same arguments):
+    behave-parallel --agent coordinator.example.com:7777 --processes 4
+
+The coordinator is used by the parent process like a local worker pool
+(see :class:`behave.parallel.ProcessWorkerPool`). Each agent connection is
+one worker that speaks the same message protocol, encoded as JSON objects
+(one per line). The first message of the coordinator is a greeting with
+the worker_id, the parallel element and the keys of all jobs. The agent
+uses the keys to find the jobs in the features it has parsed itself,
+so its job indexes are the same as the coordinator's job indexes.
+
+.. note::
+
+    The protocol has no authentication. Use it in trusted networks only.
+"""
+
+from __future__ import with_statement
+import Queue
+import select
+import socket
+import threading
+import time
+
+try:
+    import json
+except ImportError:
+    # -- PYTHON 2.5 backward compatible: Use simplejson module.
+    import simplejson as json
+
+
+def parse_address(text):
+    """
+    Parse a network address in "HOST:PORT" notation.
+
+    :param text: Address to parse (an empty HOST means all interfaces).
+    :return: Tuple (host, port).
+    :raises: ValueError, if the address is invalid.
+    """
+    host, sep, port = text.rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError("Invalid address (expected HOST:PORT): %s" % text)
+    return (host, int(port))
+
+
+class MessageConnection(object):
+    """
+    Sends/receives JSON messages (one per line) over a TCP socket.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.stream = sock.makefile("rb")
+
+    def send(self, message):
+        self.sock.sendall(json.dumps(message) + "\n")
+
+    def receive(self):
+        """
+        :return: Next message.
+        :raises: EOFError, if the connection is closed.
+        """
+        line = self.stream.readline()
+        if not line:
+            raise EOFError("Connection closed")
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.stream.close()
+        self.sock.close()
+
+
+class AgentChannel(object):
+    """
+    Agent-side end of the connection to the coordinator.
+    Provides the same interface as :class:`behave.parallel.WorkerChannel`.
+    """
+    connect_timeout = 30.0  # Seconds, agents may start before coordinator.
+
+    cancel_marker = "cancel"
+
+    def __init__(self, connection, hello):
+        self.connection = connection
+        self.hello = hello
+        self.worker_id = hello["worker_id"]
+        self.is_cancelled = False
+
+    @classmethod
+    def connect(cls, address, ticket=None):
+        """
+        Connect to the coordinator (and wait for its greeting).
+
+        :param address: Address of the coordinator ("HOST:PORT").
+        :param ticket:  Ticket to show first (if the coordinator needs one).
+        """
+        host, port = parse_address(address)
+        deadline = time.time() + cls.connect_timeout
+        while 1:
+            try:
+                sock = socket.create_connection((host or "localhost", port))
+                break
+            except socket.error:
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.5)
+        connection = MessageConnection(sock)
+        if ticket is not None:
+            connection.send(["ticket", ticket])
+        return cls(connection, connection.receive())
+
+    def send(self, kind, data=None):
+        self.connection.send([kind, data])
+
+    def receive(self):
+        """
+        Wait for the next job from the coordinator.
+
+        :return: Next job, or None if the agent worker should stop.
+        """
+        try:
+            message = self.connection.receive()
+            while message == self.cancel_marker:
+                self.is_cancelled = True
+                message = self.connection.receive()
+            return message
+        except (EOFError, socket.error):
+            # -- COORDINATOR IS GONE: Stop, too.
+            return None
+
+    def cancelled(self):
+        """
+        Indicates if the coordinator cancelled the run (skip remaining jobs).
+        While a worker runs its jobs, the cancel marker is the only message
+        that the coordinator may send.
+        """
+        if not self.is_cancelled:
+            readable, _, _ = select.select([self.connection.sock], [], [], 0)
+            if readable:
+                try:
+                    message = self.connection.receive()
+                except (EOFError, ValueError, socket.error):
+                    message = self.cancel_marker
+                self.is_cancelled = (message == self.cancel_marker)
+        return self.is_cancelled
+
+    def close(self):
+        self.connection.close()
+
+
+class AgentHandle(object):
+    """
+    Coordinator-side bookkeeping data of one agent connection (worker).
+    """
+    def __init__(self, worker_id, connection, peer):
+        self.worker_id = worker_id
+        self.connection = connection
+        self.peer = peer
+        self.done = False
+
+
+class CoordinatorPool(object):
+    """
+    Worker pool whose workers are remote agents (connected over TCP).
+    Agents may connect at any time until the pool is closed.
+
+    .. code-block:: python
+
+        pool = CoordinatorPool("0.0.0.0:7777", hello)
+        pool.start()
+        for worker_id, kind, data in pool.messages():
+            if kind in ("ready", "result"):
+                pool.dispatch(worker_id, next_job)  # or: pool.stop(worker_id)
+            if no_more_jobs_and_none_running:
+                pool.close()
+        pool.join()
+
+    :param address: Address to listen on ("HOST:PORT", PORT=0: any port).
+    :param hello:   Greeting for each agent (dict, worker_id is added).
+    """
+    poll_timeout = 1.0
+    backlog = 64
+    report_idle = False
+
+    def __init__(self, address, hello):
+        self.address = parse_address(address)
+        self.hello = hello
+        self.message_queue = Queue.Queue()
+        self.workers = {}
+        self.next_worker_id = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def active_workers(self):
+        return [worker for worker in self.workers.values() if not worker.done]
+
+    def start(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.address)
+        self.server.listen(self.backlog)
+        self.address = self.server.getsockname()
+        thread = threading.Thread(target=self.accept_agents)
+        thread.daemon = True
+        thread.start()
+
+    def accept_agents(self):
+        while not self.closed:
+            try:
+                sock, peer = self.server.accept()
+            except socket.error:
+                break   # -- SERVER SOCKET CLOSED.
+            thread = threading.Thread(target=self.serve_agent,
+                                      args=(MessageConnection(sock), peer))
+            thread.daemon = True
+            thread.start()
+
+    def admit(self, connection):
+        """
+        Decide if a new agent connection is accepted.
+
+        :return: Worker id of the agent, or None to reject the connection.
+        """
+        with self.lock:
+            worker_id = self.next_worker_id
+            self.next_worker_id += 1
+        return worker_id
+
+    def serve_agent(self, connection, peer):
+        worker_id = self.admit(connection)
+        with self.lock:
+            if worker_id is None or self.closed:
+                connection.close()
+                return
+            worker = AgentHandle(worker_id, connection, peer)
+            self.workers[worker_id] = worker
+        hello = dict(self.hello, worker_id=worker_id)
+        try:
+            connection.send(hello)
+        except socket.error:
+            pass    # -- Detected by reading messages.
+        self.read_messages(worker)
+
+    def read_messages(self, worker):
+        try:
+            while 1:
+                kind, data = worker.connection.receive()
+                self.message_queue.put((worker, kind, data))
+                if kind == "done":
+                    return
+        except (EOFError, ValueError, socket.error):
+            pass
+        self.message_queue.put((worker, "died", None))
+
+    def dispatch(self, worker_id, job):
+        try:
+            self.workers[worker_id].connection.send(job)
+        except socket.error:
+            pass    # -- AGENT IS GONE: Reported as "died" message.
+
+    def stop(self, worker_id):
+        self.dispatch(worker_id, None)
+
+    def restart(self, worker_id):
+        """
+        Drop the connection to a (stuck) agent worker. Remote processes
+        cannot be restarted from here, but other agents take over its jobs.
+        """
+        worker = self.workers[worker_id]
+        worker.done = True
+        worker.connection.close()
+
+    def replace(self, worker_id):
+        """
+        Nothing to do for an agent worker that retired (worker recycling):
+        The agent starts a fresh worker that connects again. If no agent
+        connects (--agent-wait), the runner closes the pool.
+        """
+        pass
+
+    def cancel(self):
+        """Tell all agents to skip the jobs they still have."""
+        for worker in self.active_workers:
+            self.dispatch(worker.worker_id, AgentChannel.cancel_marker)
+
+    def close(self):
+        """Stop accepting agents (when no jobs are left)."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        try:
+            self.server.close()
+        except socket.error:
+            pass
+
+    def messages(self):
+        """
+        Iterates over the messages from the agents until the pool is closed
+        and all agents are done. An agent that disconnects without saying
+        goodbye is reported as ``(worker_id, "died", None)`` message.
+        """
+        while not (self.closed and not self.active_workers):
+            try:
+                message = self.message_queue.get(True, self.poll_timeout)
+            except Queue.Empty:
+                if self.report_idle:
+                    yield (None, "idle", None)
+                continue
+            worker, kind, data = message
+            if worker.done:
+                continue
+            if kind in ("done", "died"):
+                worker.done = True
+            yield (worker.worker_id, kind, data)
+
+    def terminate(self):
+        self.close()
+        for worker in self.active_workers:
+            worker.connection.close()
+            worker.done = True
+
+    def join(self):
+        self.close()
+        for worker in self.workers.values():
+            worker.connection.close()
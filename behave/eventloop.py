@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Provides support for asynchronous step functions (and hooks): If a step
+function returns a coroutine (or future), it is run to completion on an
+event loop of the runner before the step is finished.
+
+.. code-block:: python
+
+    # -- PYTHON 3.5 (and newer):
+    @when(u'I ask the service for its status')
+    async def step_ask_for_status(context):
+        context.response = await context.client.get("/status")
+
+    # -- PYTHON 2 (with trollius) and PYTHON 3.4:
+    @when(u'I ask the service for its status')
+    @asyncio.coroutine
+    def step_ask_for_status(context):
+        context.response = yield From(context.client.get("/status"))
+
+Requires the :mod:`asyncio` module (or its backport :mod:`trollius`).
+
+Worker threads (--threads) share one event loop that runs in a background
+thread. Therefore, the coroutines of the scenarios that the threads run
+are in flight on the same event loop at the same time (and may share its
+resources, like connection pools).
+
+Scope:
+
+* Supported: coroutine step functions and hooks, run on the event loop
+  of the process (or the shared event loop of the worker threads).
+* Not supported: a runner mode that runs scenarios concurrently as tasks
+  on one event loop (each with its own context and capture). Scenarios
+  are run synchronously, each scenario in flight needs a worker thread
+  (or process) of its own, so --threads N limits the concurrency.
+  Such a mode needs a coroutine version of the whole model run
+  (Feature/Scenario/Step.run) that can be written once for Python 2
+  (trollius: ``yield From(...)``) and Python 3 (asyncio: ``yield from``),
+  which this code base (Python 2, converted with 2to3) cannot provide.
+"""
+
+import threading
+
+asyncio = None
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        pass
+
+
+def is_awaitable(value):
+    """
+    Indicates if a value (returned by a step function) must be awaited.
+    """
+    if asyncio is None:
+        return False
+    return asyncio.iscoroutine(value) or isinstance(value, asyncio.Future)
+
+
+def new_event_loop():
+    """
+    Create a new event loop and make it the event loop of this thread
+    (coroutines that don't pass a loop use the event loop of the thread).
+    """
+    assert asyncio, "REQUIRES: asyncio module (or trollius)"
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+class EventLoopThread(object):
+    """
+    Event loop that runs in a background thread. Other threads use
+    :meth:`run_until_complete` to run a coroutine on this loop and wait
+    for its result (like the run_until_complete method of an event loop).
+    """
+    def __init__(self):
+        assert asyncio, "REQUIRES: asyncio module (or trollius)"
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, name="EVENTLOOP")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run_until_complete(self, awaitable):
+        """
+        Run a coroutine (or future) on the event loop and wait until it is
+        finished (in the calling thread).
+
+        :return: Result of the coroutine.
+        :raises: Exception of the coroutine, if it failed.
+        """
+        done = threading.Event()
+        started = []
+        failed = []
+
+        def start():
+            try:
+                future = asyncio.ensure_future(awaitable, loop=self.loop)
+            except Exception, e:
+                # -- NOT STARTED: Raise it in the caller (instead of hanging).
+                failed.append(e)
+                done.set()
+                return
+            future.add_done_callback(lambda future: done.set())
+            started.append(future)
+        self.loop.call_soon_threadsafe(start)
+        done.wait()
+        if failed:
+            raise failed[0]
+        return started[0].result()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
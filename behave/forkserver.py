@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Provides a fork server for parallel runs (--processes N --fork-server).
+
+Without a fork server, each worker process is forked from the parent after
+the before_all hook ran, so it inherits all threads, sockets and other state
+of the parent (which is fragile). With a fork server, a template process is
+forked from the parent before the before_all hook runs. The template has
+the hooks and step definitions (loaded by the parent), imports the modules
+to preload (--preload) and parses the features itself. Then it forks the
+workers on demand: at start-up, to replace recycled or stuck workers and
+to add workers (--processes auto). A worker starts within milliseconds,
+because everything is imported already.
+
+.. code-block:: sh
+
+    behave-parallel --processes 8 --fork-server --preload lxml,myapp.models
+
+The workers talk to the parent like the agents of a distributed run
+(see :mod:`behave.distributed`) over a local TCP connection: the parent
+sends the keys of all jobs, the worker finds the jobs in the features that
+the template parsed. Each forked worker gets a random ticket (that is only
+valid once) and must show it first, other connections are rejected.
+
+.. note::
+
+    The workers don't inherit the state of the before_all hook
+    (like attributes of the context). Use the before_worker hook to
+    set up the resources of each worker.
+"""
+
+from __future__ import with_statement
+import binascii
+import os
+import Queue
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from behave.distributed import CoordinatorPool
+from behave.parallel import freeze_heap, process_rss, unfreeze_heap
+
+multiprocessing = None
+try:
+    import multiprocessing
+except ImportError, e:
+    pass
+
+
+def import_modules(names):
+    """
+    Import modules (to preload them), like: "lxml,myapp.models".
+
+    :param names: Module names (list, or string with comma-separated names).
+    :return: List of (name, error) tuples for the modules that failed.
+    """
+    if isinstance(names, basestring):
+        names = names.split(",")
+    failures = []
+    for name in names:
+        name = name.strip()
+        if not name:
+            continue
+        try:
+            __import__(name)
+        except ImportError, e:
+            failures.append((name, e))
+    return failures
+
+
+def serve(prepare, worker, connection, parent_connection):
+    """
+    Main function of the template process: Prepare the template and fork
+    a worker for each request of the parent, until it sends None.
+
+    :param prepare: Function that prepares the template.
+    :param worker:  Function(address, ticket) that runs a forked worker,
+                    it returns the exit code of the worker.
+    """
+    parent_connection.close()
+    # -- CTRL-C: Stops the workers, the template is stopped by the parent.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    prepare()
+    children = set()
+    while 1:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break   # -- PARENT IS GONE.
+        if request is None:
+            break
+        address, ticket = request
+        reap(children)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # -- COPY-ON-WRITE: Workers share the memory of the template,
+        #    their heap stays frozen.
+        freeze_heap()
+        pid = os.fork()
+        if pid == 0:
+            # -- FORKED WORKER:
+            connection.close()
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            exitcode = 1
+            try:
+                exitcode = worker(address, ticket)
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exitcode)
+        unfreeze_heap()
+        children.add(pid)
+        connection.send(pid)
+    # -- WAIT: For the workers, they stop when the parent is done.
+    for pid in children:
+        try:
+            os.waitpid(pid, 0)
+        except OSError:
+            pass
+
+
+def reap(children):
+    """Collect the exit status of the workers that exited (no zombies)."""
+    for pid in list(children):
+        try:
+            finished, _ = os.waitpid(pid, os.WNOHANG)
+        except OSError:
+            finished = pid
+        if finished:
+            children.remove(pid)
+
+
+class ForkServer(object):
+    """
+    Parent-side handle of the template process.
+
+    .. code-block:: python
+
+        fork_server = ForkServer(prepare_template, run_worker)
+        fork_server.start()     # -- BEFORE: Threads or sockets are opened.
+        pid = fork_server.fork("127.0.0.1:4711", ticket)
+        fork_server.stop()
+
+    :param prepare: Function that prepares the template (in the template).
+    :param worker:  Function(address, ticket) that runs a forked worker.
+    """
+    stop_timeout = 10.0
+
+    def __init__(self, prepare, worker):
+        assert multiprocessing, "REQUIRES: multiprocessing module"
+        self.prepare = prepare
+        self.worker = worker
+        self.process = None
+        self.connection = None
+
+    def start(self):
+        self.connection, template_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve,
+            args=(self.prepare, self.worker, template_connection,
+                  self.connection))
+        self.process.start()
+        template_connection.close()
+
+    def fork(self, address, ticket):
+        """
+        Let the template fork a new worker.
+
+        :param address: Address ("HOST:PORT") the worker connects to.
+        :param ticket:  Ticket the worker shows when it connects.
+        :return: Process id of the new worker.
+        """
+        self.connection.send((address, ticket))
+        return self.connection.recv()
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (IOError, OSError):
+            pass
+        self.process.join(self.stop_timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.connection.close()
+
+
+class ForkServerPool(CoordinatorPool):
+    """
+    Pool of worker processes that are forked by a fork server.
+    Provides the same interface as :class:`behave.parallel.ProcessWorkerPool`.
+
+    Each forked worker connects to the pool (like an agent), shows its
+    ticket and tells its process id. The ticket is random and only valid
+    once, connections without a valid ticket are rejected. A restarted or
+    replaced worker keeps its worker id (like with a ProcessWorkerPool).
+
+    :param fork_server: Fork server (started) to use.
+    :param size:  Number of workers to start with.
+    :param hello: Greeting for each worker (see :class:`CoordinatorPool`).
+    """
+    connect_timeout = 60.0
+    ticket_timeout = 10.0   # -- Seconds a new connection may take to show it.
+
+    def __init__(self, fork_server, size, hello):
+        CoordinatorPool.__init__(self, "127.0.0.1:0", hello)
+        self.fork_server = fork_server
+        self.size = size
+        self.pids = {}
+        self.starting = {}  # -- Deadline and ticket (by pid) until connected.
+        self.tickets = {}   # -- Worker id (by ticket) of the forked workers.
+        self.closing = False
+
+    def start(self):
+        CoordinatorPool.start(self)
+        for _ in range(self.size):
+            self.add_worker()
+
+    def add_worker(self, worker_id=None):
+        """
+        Fork one more worker (or a fresh worker for a worker id).
+
+        :return: Worker id of the new worker.
+        """
+        if self.closed:
+            return None
+        with self.lock:
+            if worker_id is None:
+                worker_id = self.next_worker_id
+                self.next_worker_id += 1
+            ticket = binascii.hexlify(os.urandom(16))
+            self.tickets[ticket] = worker_id
+        host, port = self.address[:2]
+        pid = self.fork_server.fork("{0}:{1}".format(host, port), ticket)
+        self.starting[pid] = (time.time() + self.connect_timeout, ticket)
+        return worker_id
+
+    def admit(self, connection):
+        """
+        Accept only forked workers that show a valid ticket (once).
+
+        :return: Worker id of the forked worker, or None.
+        """
+        try:
+            connection.sock.settimeout(self.ticket_timeout)
+            kind, ticket = connection.receive()
+            connection.sock.settimeout(None)
+        except (EOFError, ValueError, TypeError, socket.error):
+            return None
+        if kind != "ticket" or not isinstance(ticket, basestring):
+            return None
+        with self.lock:
+            return self.tickets.pop(ticket, None)
+
+    def replace(self, worker_id):
+        """Fork a fresh worker in place of a worker that retired."""
+        self.pids.pop(worker_id, None)
+        self.add_worker(worker_id)
+
+    def restart(self, worker_id):
+        """Kill a (stuck) worker and fork a fresh worker instead."""
+        self.kill(self.pids.pop(worker_id, None))
+        CoordinatorPool.restart(self, worker_id)
+        self.add_worker(worker_id)
+
+    def kill(self, pid):
+        if pid:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def worker_rss(self):
+        """
+        :return: Memory (RSS in bytes) of the active workers that is known.
+        """
+        memory = [process_rss(self.pids[worker.worker_id])
+                  for worker in self.active_workers
+                  if worker.worker_id in self.pids]
+        return [rss for rss in memory if rss is not None]
+
+    def close(self):
+        """
+        Stop accepting workers (when no jobs are left), as soon as the
+        workers that are still starting have connected (to stop them).
+        """
+        self.closing = True
+        if not self.starting:
+            CoordinatorPool.close(self)
+
+    def started(self, pid):
+        self.starting.pop(pid, None)
+        if self.closing and not self.starting:
+            CoordinatorPool.close(self)
+
+    def messages(self):
+        """
+        Iterates over the messages from the workers until all workers
+        (and the workers that are still starting) are done.
+        """
+        while self.active_workers or self.starting:
+            try:
+                message = self.message_queue.get(True, self.poll_timeout)
+            except Queue.Empty:
+                now = time.time()
+                for pid, (deadline, ticket) in self.starting.items():
+                    if deadline <= now:
+                        # -- LOST: Forked worker did not connect.
+                        self.kill(pid)
+                        with self.lock:
+                            self.tickets.pop(ticket, None)
+                        self.started(pid)
+                if self.report_idle:
+                    yield (None, "idle", None)
+                continue
+            worker, kind, data = message
+            if worker.done:
+                continue
+            if kind == "pid":
+                self.pids[worker.worker_id] = data
+                self.started(data)
+                continue
+            if kind in ("done", "died"):
+                worker.done = True
+            yield (worker.worker_id, kind, data)
+
+    def terminate(self):
+        for pid in self.starting.keys() + self.pids.values():
+            self.kill(pid)
+        self.starting.clear()
+        CoordinatorPool.terminate(self)
+
+    def join(self):
+        for pid in self.starting:
+            self.kill(pid)
+        self.starting.clear()
+        CoordinatorPool.join(self)
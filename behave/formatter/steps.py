@@ -42,6 +42,7 @@ class AbstractStepsFormatter(Formatter):
             for step_definition in step_definitions:
                 step_definition.step_type = step_type
             self.step_registry.steps[step_type] = step_definitions
+        self.step_registry.steps_changed()
 
     # -- FORMATTER API:
     def feature(self, feature):
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Provides compact job records: A worker sends a structured record of the
+results of a job (feature or scenario) to the parent process, instead of
+a pre-rendered report. The parent applies the record to its own model
+objects (parsed from the same feature files) and renders reports from them.
+
+A job record is a dict (that can be pickled and encoded as JSON) with:
+
+* ``worker``:     Worker number (that ran the job).
+* ``start``, ``end``: Start and end time of the job (as time.time()).
+* ``scenarios``:  One entry per scenario of the job (in walk order) with its
+  status code, the status codes of its steps (background steps included)
+  and its captured output.
+* ``events``:     Formatter events of the job, scenarios and steps are
+  referenced by their index (step results carry duration and error).
+
+Large texts (captured output, error messages) are passed out-of-band:
+They are written to temp files (see :class:`OutputStore`), the record
+only refers to them.
+"""
+
+from __future__ import with_statement
+import codecs
+import os
+import tempfile
+
+from behave.model import Argument, FileLocation, Match, NoMatch
+
+
+STATUS_CODES = {
+    'passed': 'p', 'failed': 'f', 'skipped': 's',
+    'undefined': 'u', 'untested': 'n',
+}
+STATUSES = dict((code, status) for status, code in STATUS_CODES.items())
+
+
+def job_scenarios(job):
+    """
+    Provides the scenarios of a job (in walk order), as referenced by the
+    scenario indexes of a job record.
+    """
+    if job.type == 'feature':
+        return job.walk_scenarios()
+    return [job]
+
+
+class RecordedException(Exception):
+    """
+    Stands in for the exception of a failed step (raised in a worker).
+
+    .. attribute:: type_name
+
+       Class name of the original exception.
+
+    .. attribute:: is_assertion
+
+       Indicates if the original exception was an AssertionError.
+    """
+    def __init__(self, type_name, message, is_assertion=False):
+        Exception.__init__(self, message)
+        self.type_name = type_name
+        self.is_assertion = is_assertion
+
+
+class RecordedAssertionError(RecordedException, AssertionError):
+    """
+    Stands in for the AssertionError of a failed step (raised in a worker),
+    so that formatters tell failures from errors like in a serial run.
+    """
+
+
+def make_exception(type_name, message, is_assertion=False):
+    """
+    :return: Stand-in for an exception (described by a worker).
+    """
+    if is_assertion:
+        return RecordedAssertionError(type_name, message, is_assertion)
+    return RecordedException(type_name, message, is_assertion)
+
+
+def describe_exception(exception):
+    """
+    :return: Exception as (type_name, message, is_assertion) list, or None.
+    """
+    if exception is None:
+        return None
+    message = u""
+    if exception.args:
+        message = exception.args[0]
+        if not isinstance(message, basestring):
+            message = repr(message)
+    return [exception.__class__.__name__, message,
+            isinstance(exception, AssertionError)]
+
+
+class OutputStore(object):
+    """
+    Passes large texts out-of-band: A text above the size limit is written
+    to a temp file in a directory that worker and parent share, the record
+    contains a reference to the file (as dict) instead of the text.
+    Without directory (agents, threads), all texts are passed inline.
+
+    :param directory: Directory for the text files (or None).
+    """
+    limit = 4096
+
+    def __init__(self, directory=None):
+        self.directory = directory
+
+    def put(self, text):
+        """
+        :return: Text itself (if small) or reference to the text file.
+        """
+        if isinstance(text, str):
+            # -- CAPTURED OUTPUT: Records contain unicode text only.
+            text = codecs.decode(text, 'utf-8', 'replace')
+        if not self.directory or not text or len(text) < self.limit:
+            return text
+        text = text.encode('utf-8')
+        fd, filename = tempfile.mkstemp(dir=self.directory, suffix='.txt')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(text)
+        return {'file': filename}
+
+    def get(self, value):
+        """
+        :return: Text of a value (returned by :meth:`put`).
+        """
+        if not isinstance(value, dict):
+            return value
+        with open(value['file'], 'rb') as f:
+            return codecs.decode(f.read(), 'utf-8', 'replace')
+
+
+class JobRecorder(object):
+    """
+    Formatter that records the formatter events of a job (in the worker).
+
+    .. code-block:: python
+
+        recorder = JobRecorder(job, output_store)
+        runner.formatters = [recorder]
+        job.run(runner)
+        record = recorder.make_record(worker_id, start_time, end_time)
+    """
+
+    def __init__(self, job, output_store):
+        self.job = job
+        self.output_store = output_store
+        self.scenarios = list(job_scenarios(job))
+        self.steps = []
+        self.events = []
+
+    def scenario_index(self, scenario):
+        for index, other in enumerate(self.scenarios):
+            if other is scenario:
+                return index
+        return None
+
+    def step_index(self, step):
+        for index, other in enumerate(self.steps):
+            if other is step:
+                return index
+        return None
+
+    # -- IMPLEMENT-INTERFACE FOR: Formatter
+    def uri(self, uri):
+        pass
+
+    def feature(self, feature):
+        self.events.append(['feature'])
+
+    def background(self, background):
+        self.events.append(['background'])
+
+    def scenario(self, scenario):
+        self.steps = list(scenario.all_steps)
+        self.events.append(['scenario', self.scenario_index(scenario)])
+
+    def step(self, step):
+        self.events.append(['step', self.step_index(step)])
+
+    def match(self, match):
+        if match.location is None:
+            self.events.append(['match'])
+            return
+        arguments = []
+        for argument in match.arguments or []:
+            value = argument.value
+            if not isinstance(value, (basestring, int, long, float, bool)):
+                value = argument.original
+            arguments.append([argument.start, argument.end,
+                              argument.original, value, argument.name])
+        self.events.append(['match', [match.location.filename,
+                                      match.location.line], arguments])
+
+    def result(self, step):
+        self.events.append(['result', self.step_index(step), step.status,
+                            step.duration,
+                            self.output_store.put(step.error_message),
+                            describe_exception(step.exception)])
+
+    def eof(self):
+        self.events.append(['eof'])
+
+    def close(self):
+        pass
+
+    def make_record(self, worker_id, start_time, end_time):
+        """
+        :return: Job record, or None if the job reported nothing.
+        """
+        if not self.events:
+            return None
+        put = self.output_store.put
+        scenarios = []
+        for scenario in self.scenarios:
+            step_codes = "".join(STATUS_CODES[step.status]
+                                 for step in scenario.all_steps)
+            scenarios.append([STATUS_CODES[scenario.status], step_codes,
+                              scenario.was_dry_run, put(scenario.stdout),
+                              put(scenario.stderr)])
+        return dict(worker=worker_id, start=start_time, end=end_time,
+                    scenarios=scenarios, events=self.events)
+
+
+def apply_record(job, record, output_store):
+    """
+    Apply a job record to the model objects of the job (in the parent):
+    Sets status, duration and error of each step (and status/output of
+    each scenario), so that reports can be rendered from them.
+    """
+    scenarios = list(job_scenarios(job))
+    for scenario, data in zip(scenarios, record['scenarios']):
+        status_code, step_codes, was_dry_run, stdout, stderr = data
+        for step, code in zip(scenario.all_steps, step_codes):
+            step.status = STATUSES[code]
+            step.duration = 0.0
+            step.error_message = None
+            step.exception = None
+        scenario.was_dry_run = was_dry_run
+        scenario.stdout = output_store.get(stdout)
+        scenario.stderr = output_store.get(stderr)
+        scenario._cached_status = STATUSES[status_code]
+
+    steps = []
+    for event in record['events']:
+        if event[0] == 'scenario':
+            steps = list(scenarios[event[1]].all_steps)
+        elif event[0] == 'result':
+            index, status, duration, error_message, exception = event[1:]
+            step = steps[index]
+            step.duration = duration
+            step.error_message = output_store.get(error_message)
+            if exception:
+                step.exception = make_exception(*exception)
+
+    # -- RECOMPUTE: Status of feature and scenario outlines.
+    job._cached_status = None
+    if job.type == 'feature':
+        for scenario in job.walk_scenarios(with_outlines=True):
+            if scenario.type == 'scenario_outline':
+                scenario._cached_status = None
+
+
+def replay_record(job, record, formatters):
+    """
+    Replay the formatter events of a job record (applied before) to
+    formatters (in the parent).
+    """
+    scenarios = list(job_scenarios(job))
+    steps = []
+    for event in record['events']:
+        kind = event[0]
+        if kind == 'feature':
+            arguments = (job.feature if job.type != 'feature' else job,)
+        elif kind == 'background':
+            feature = job.feature if job.type != 'feature' else job
+            arguments = (feature.background,)
+        elif kind == 'scenario':
+            scenario = scenarios[event[1]]
+            steps = list(scenario.all_steps)
+            arguments = (scenario,)
+        elif kind in ('step', 'result'):
+            arguments = (steps[event[1]],)
+        elif kind == 'match':
+            arguments = (make_match(event),)
+        else:
+            arguments = ()
+        for formatter in formatters:
+            getattr(formatter, kind)(*arguments)
+
+
+def make_match(event):
+    if len(event) == 1:
+        return NoMatch()
+    (filename, line), arguments = event[1:]
+    match = Match(None, [Argument(*argument) for argument in arguments])
+    match.location = FileLocation(filename, line)
+    return match
@@ -1,5 +1,6 @@
 import logging
 import functools
+import threading
 from logging.handlers import BufferingHandler
 import re
 
@@ -172,6 +173,31 @@ class LoggingCapture(BufferingHandler):
             root_logger.setLevel(self.old_level)
             self.old_level = None
 
+
+class ThreadLocalCapture(LoggingCapture):
+    '''Pass logging events to the LoggingCapture of the current thread.
+
+    Used when scenarios run in worker threads (--threads): This handler is
+    installed once (with :meth:`~LoggingCapture.inveigle`), and each thread
+    redirects the events of its own scenario to its own LoggingCapture.
+    Events of other threads (outside of scenarios) are ignored.
+    '''
+    def __init__(self, config, level=None):
+        LoggingCapture.__init__(self, config, level)
+        self.local = threading.local()
+
+    def redirect(self, capture):
+        self.local.capture = capture
+
+    def restore(self):
+        self.local.capture = None
+
+    def handle(self, record):
+        capture = getattr(self.local, 'capture', None)
+        if capture is not None:
+            return capture.handle(record)
+        return 0
+
 # pre-1.2 backwards compatibility
 MemoryHandler = LoggingCapture
 
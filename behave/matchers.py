@@ -60,6 +60,15 @@ class Matcher(object):
             return None
         return model.Match(self.func, result)
 
+    def literal_prefix(self):
+        '''
+        Provide the literal text that each matching step name starts with
+        (used to index the step definitions, see :class:`StepRegistry`).
+
+        :return: Literal prefix of the pattern, or u"" if unknown.
+        '''
+        return u""
+
     def __repr__(self):
         return u"<%s: %r>" % (self.__class__.__name__, self.string)
 
@@ -71,6 +80,10 @@ class ParseMatcher(Matcher):
         super(ParseMatcher, self).__init__(func, string, step_type)
         self.parser = parse.compile(self.string, self.custom_types)
 
+    def literal_prefix(self):
+        # -- UNTIL: First field, like "{name}" (or escaped brace "{{").
+        return self.string.split("{", 1)[0]
+
     def check_match(self, step):
         result = self.parser.parse(step)
         if not result:
@@ -105,6 +118,23 @@ class RegexMatcher(Matcher):
         super(RegexMatcher, self).__init__(func, string, step_type)
         self.regex = re.compile(self.string)
 
+    def literal_prefix(self):
+        pattern = self.string
+        if self.regex.flags & re.VERBOSE or has_alternatives(pattern):
+            return u""
+        if pattern.startswith("^"):
+            pattern = pattern[1:]
+        end = 0
+        for char in pattern:
+            if char in "?*{":
+                # -- QUANTIFIER: Previous character is optional.
+                end = max(end - 1, 0)
+                break
+            elif char in ".^$+[]|()\\":
+                break
+            end += 1
+        return pattern[:end]
+
     def check_match(self, step):
         m = self.regex.match(step)
         if not m:
@@ -121,6 +151,31 @@ class RegexMatcher(Matcher):
         return args
 
 
+def has_alternatives(pattern):
+    '''
+    Indicates if a regular expression has alternatives on its top level
+    (like "a|b", but not "(a|b)").
+    '''
+    depth = 0
+    in_class = escaped = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif in_class:
+            in_class = (char != "]")
+        elif char == "[":
+            in_class = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return True
+    return False
+
+
 matcher_mapping = {
     'parse': ParseMatcher,
     're': RegexMatcher,
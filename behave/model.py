@@ -7,7 +7,7 @@ import itertools
 import os.path
 import time
 import traceback
-from behave import step_registry
+from behave import eventloop, step_registry
 from behave.compat.os_path import relpath
 
 
@@ -1561,7 +1561,10 @@ class Match(Replayable):
                 args.append(arg.value)
 
         with context.user_mode():
-            self.func(context, *args, **kwargs)
+            result = self.func(context, *args, **kwargs)
+            if eventloop.is_awaitable(result):
+                # -- ASYNC STEP: Wait until its coroutine is finished.
+                context._runner.run_until_complete(result)
 
     @staticmethod
     def make_location(step_function):
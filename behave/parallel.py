@@ -0,0 +1,941 @@
+# -*- coding: utf-8 -*-
+"""
+Provides the worker pool that is used for parallel test runs (--processes).
+
+The parent process talks directly to its worker processes. Each worker has
+two pipes of its own:
+
+  * a job pipe (parent -> worker)
+  * a result pipe (worker -> parent), the parent waits on all of them
+
+No manager (server) process is involved. Therefore, dispatching a job or
+returning its results does not need an extra proxied round-trip. Because
+no pipe is shared, a worker can be killed without harming the others,
+and a worker that died is detected at once (end of its result pipe).
+
+MESSAGE PROTOCOL (worker -> parent)::
+
+    (worker_id, "ready",  None)     # Worker is initialized, needs a job.
+    (worker_id, "result", data)     # Job is finished, worker needs a job.
+    (worker_id, "cancelled", None)  # Job was not run (after "cancel").
+    (worker_id, "progress", data)   # Scenario/step starts (for timeouts).
+    (worker_id, "retire", reason)   # Worker exits after its last result.
+    (worker_id, "memory", data)     # Shared/private memory, before "done".
+    (worker_id, "done",   None)     # Worker exits (after "stop").
+
+The parent answers each "ready"/"result" message by sending the next job
+to this worker or by sending the stop marker (None). When the parent
+cancels the run (fail-fast), workers skip the jobs they still have.
+A worker that retires (worker recycling) does not answer the jobs it still
+has, the parent hands them out again and replaces the worker when it is done.
+
+Remote workers (agents) use the same protocol (see :mod:`behave.distributed`),
+and so do worker threads (see :class:`ThreadWorkerPool`).
+"""
+
+from __future__ import with_statement
+import collections
+import contextlib
+import gc
+import os
+import Queue
+import select
+import sys
+import threading
+import time
+import traceback
+
+multiprocessing = None
+try:
+    import multiprocessing
+except ImportError, e:
+    pass
+
+
+def process_rss(pid="self"):
+    """
+    Provide the resident set size (RSS) of a process.
+
+    :param pid: Process id (default: current process).
+    :return: RSS in bytes, or None if unknown (no /proc filesystem).
+    """
+    try:
+        with open("/proc/{0}/statm".format(pid)) as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def process_memory(pid="self"):
+    """
+    Provide the shared and private memory of a process (from its memory
+    mappings). A worker that was forked shares the pages of the parent
+    until one of them writes to a page (copy-on-write).
+
+    :param pid: Process id (default: current process).
+    :return: List [shared, private] in bytes, or None if unknown.
+    """
+    for name in ("smaps_rollup", "smaps"):
+        try:
+            with open("/proc/{0}/{1}".format(pid, name)) as f:
+                return parse_smaps(f)
+        except (IOError, OSError, ValueError, IndexError):
+            pass
+    return None
+
+
+def parse_smaps(lines):
+    """
+    Sum up the shared and private memory of the memory mappings
+    (lines like: "Shared_Clean:  1024 kB").
+
+    :return: List [shared, private] in bytes.
+    """
+    memory = [0, 0]
+    for line in lines:
+        if line.startswith("Shared_"):
+            memory[0] += int(line.split()[1]) * 1024
+        elif line.startswith("Private_"):
+            memory[1] += int(line.split()[1]) * 1024
+    return memory
+
+
+def freeze_heap():
+    """
+    Prepare the memory of this process for forking a worker (Python 3.7+):
+    Collect the garbage, then move all objects that survive (like the parsed
+    features) out of the reach of the cyclic garbage collector, so that
+    collections in the worker don't write to (and copy) their pages.
+    Without gc.freeze (Python 2), nothing is done.
+    """
+    if hasattr(gc, "freeze"):
+        gc.collect()
+        gc.freeze()
+
+
+def unfreeze_heap():
+    """Let the garbage collector see the frozen objects again (after fork)."""
+    if hasattr(gc, "unfreeze"):
+        gc.unfreeze()
+
+
+@contextlib.contextmanager
+def frozen_heap():
+    """
+    Fork a worker with a frozen heap (see :func:`freeze_heap`) that is
+    unfrozen again in this process afterwards.
+
+    .. code-block:: python
+
+        with frozen_heap():
+            process.start()
+    """
+    freeze_heap()
+    try:
+        yield
+    finally:
+        unfreeze_heap()
+
+
+def describe_worker_memory(memory):
+    """
+    :param memory: Memory [shared, private] per worker id.
+    :return: Summary of the memory of the workers (as text).
+    """
+    megabyte = 1024.0 * 1024.0
+    workers = ", ".join("WORKER{0} {1:.1f}/{2:.1f}".format(
+                            worker_id, private / megabyte, shared / megabyte)
+                        for worker_id, (shared, private)
+                        in sorted(memory.items()))
+    return "Worker memory in MB (private/shared): {0}.".format(workers)
+
+
+def available_memory():
+    """
+    Provide the memory that is available for new processes (MemAvailable).
+
+    :return: Available memory in bytes, or None if unknown.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def load_average():
+    """
+    :return: System load average of the last minute, or None if unknown.
+    """
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+def cpu_count():
+    """
+    :return: Number of CPUs (at least 1).
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except (AttributeError, NotImplementedError):
+        return 1
+
+
+class WorkerChannel(object):
+    """
+    Worker-side end of the connection to the parent process.
+    """
+    def __init__(self, worker_id, job_connection, result_connection,
+                 cancel_event=None):
+        self.worker_id = worker_id
+        self.job_connection = job_connection
+        self.result_connection = result_connection
+        self.cancel_event = cancel_event
+
+    def send(self, kind, data=None):
+        self.result_connection.send((kind, data))
+
+    def cancelled(self):
+        """Indicates if the parent cancelled the run (skip remaining jobs)."""
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def receive(self):
+        """
+        Wait for the next job from the parent process.
+
+        :return: Next job, or None if the worker should stop.
+        """
+        try:
+            return self.job_connection.recv()
+        except EOFError:
+            # -- PARENT IS GONE: Stop, too.
+            return None
+
+
+class WorkerHandle(object):
+    """
+    Parent-side bookkeeping data of one worker process.
+    """
+    def __init__(self, worker_id, process, job_connection, result_connection):
+        self.worker_id = worker_id
+        self.process = process
+        self.job_connection = job_connection
+        self.result_connection = result_connection
+        self.done = False
+
+
+def run_worker(target, worker_id, channel, inherited=()):
+    """
+    Entry point of a worker process: Runs the worker target function
+    and ensures that the parent is notified when the worker exits.
+
+    :param inherited: Parent-side pipe ends that the worker inherited (fork).
+        They are closed, so the worker notices if the parent is gone.
+    """
+    for connection in inherited:
+        connection.close()
+    try:
+        target(worker_id, channel)
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+    channel.send("done")
+
+
+class ProcessWorkerPool(object):
+    """
+    Pool of worker processes that are fed with jobs by the parent process.
+
+    .. code-block:: python
+
+        pool = ProcessWorkerPool(4, worker_function)
+        pool.start()
+        for worker_id, kind, data in pool.messages():
+            if kind in ("ready", "result"):
+                pool.dispatch(worker_id, next_job)  # or: pool.stop(worker_id)
+        pool.join()
+
+    The worker function is called as ``worker_function(worker_id, channel)``
+    in the worker process (see :class:`WorkerChannel`).
+
+    If ``report_idle`` is enabled, ``(None, "idle", None)`` is provided
+    whenever no message arrived for ``poll_timeout`` seconds
+    (used by the parent to check the timeouts of its workers).
+    """
+    poll_timeout = 1.0
+    report_idle = False
+
+    def __init__(self, size, target):
+        assert multiprocessing, "REQUIRES: multiprocessing module"
+        self.size = size
+        self.target = target
+        self.cancel_event = multiprocessing.Event()
+        self.workers = {}
+
+    @property
+    def active_workers(self):
+        return [worker for worker in self.workers.values() if not worker.done]
+
+    def start(self):
+        for worker_id in range(self.size):
+            self.start_worker(worker_id)
+
+    def add_worker(self):
+        """
+        Start one more worker (adaptive worker count).
+
+        :return: Worker id of the new worker.
+        """
+        worker_id = len(self.workers)
+        self.start_worker(worker_id)
+        return worker_id
+
+    def worker_rss(self):
+        """
+        :return: Memory (RSS in bytes) of the active workers that is known.
+        """
+        memory = [process_rss(worker.process.pid)
+                  for worker in self.active_workers]
+        return [rss for rss in memory if rss is not None]
+
+    def start_worker(self, worker_id):
+        job_reader, job_writer = multiprocessing.Pipe(duplex=False)
+        result_reader, result_writer = multiprocessing.Pipe(duplex=False)
+        channel = WorkerChannel(worker_id, job_reader, result_writer,
+                                self.cancel_event)
+        inherited = [job_writer, result_reader]
+        for worker in self.active_workers:
+            inherited.extend([worker.job_connection, worker.result_connection])
+        process = multiprocessing.Process(target=run_worker,
+                    args=(self.target, worker_id, channel, inherited))
+        with frozen_heap():
+            # -- COPY-ON-WRITE: Workers share the memory of the parent.
+            process.start()
+        # -- Parent only needs its ends of the pipes.
+        job_reader.close()
+        result_writer.close()
+        self.workers[worker_id] = WorkerHandle(worker_id, process,
+                                               job_writer, result_reader)
+
+    def restart(self, worker_id):
+        """
+        Kill a (stuck) worker and start a new one with the same worker_id.
+        Messages of the killed worker that were not received are dropped.
+        """
+        worker = self.workers[worker_id]
+        worker.done = True
+        worker.process.terminate()
+        worker.process.join()
+        worker.job_connection.close()
+        worker.result_connection.close()
+        self.start_worker(worker_id)
+
+    def replace(self, worker_id):
+        """
+        Start a fresh worker (with the same worker_id) in place of a worker
+        that retired and is done (worker recycling).
+        """
+        worker = self.workers[worker_id]
+        assert worker.done
+        worker.process.join()
+        worker.job_connection.close()
+        worker.result_connection.close()
+        self.start_worker(worker_id)
+
+    def dispatch(self, worker_id, job):
+        try:
+            self.workers[worker_id].job_connection.send(job)
+        except (IOError, OSError):
+            pass    # -- WORKER IS GONE: Reported as "done"/"died" message.
+
+    def stop(self, worker_id):
+        self.dispatch(worker_id, None)
+
+    def cancel(self):
+        """Tell all workers to skip the jobs they still have."""
+        self.cancel_event.set()
+
+    def close(self):
+        """Called when no jobs are left (nothing to do for a local pool)."""
+        pass
+
+    def messages(self):
+        """
+        Iterates over the messages from the workers until all workers are done.
+        A worker that died without saying goodbye is reported as
+        ``(worker_id, "died", exitcode)`` message.
+        """
+        while self.active_workers:
+            workers = dict((worker.result_connection.fileno(), worker)
+                           for worker in self.active_workers)
+            readable, _, _ = select.select(workers.keys(), [], [],
+                                           self.poll_timeout)
+            if not readable and self.report_idle:
+                yield (None, "idle", None)
+            for fileno in readable:
+                worker = workers[fileno]
+                if worker.done:
+                    continue    # -- RESTARTED: While handling other messages.
+                try:
+                    kind, data = worker.result_connection.recv()
+                except (EOFError, IOError):
+                    # -- DIED: All its messages were received before.
+                    worker.done = True
+                    worker.process.join()
+                    yield (worker.worker_id, "died", worker.process.exitcode)
+                    continue
+                if kind == "done":
+                    worker.done = True
+                yield (worker.worker_id, kind, data)
+
+    def terminate(self):
+        for worker in self.active_workers:
+            worker.process.terminate()
+            worker.done = True
+
+    def join(self):
+        for worker in self.workers.values():
+            worker.job_connection.close()
+            worker.process.join()
+            worker.result_connection.close()
+
+
+class ThreadHandle(object):
+    """
+    Bookkeeping data of one worker thread (see :class:`ThreadWorkerPool`).
+    """
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.jobs = Queue.Queue()
+        self.thread = None
+        self.done = False
+        self.abandoned = False
+
+
+class ThreadChannel(object):
+    """
+    Worker-side end of the connection of a worker thread to the parent.
+    Provides the same interface as :class:`WorkerChannel`.
+    """
+    def __init__(self, worker, message_queue, cancel_event):
+        self.worker = worker
+        self.worker_id = worker.worker_id
+        self.message_queue = message_queue
+        self.cancel_event = cancel_event
+
+    def send(self, kind, data=None):
+        self.message_queue.put((self.worker, kind, data))
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def receive(self):
+        return self.worker.jobs.get()
+
+
+class ThreadWorkerPool(object):
+    """
+    Pool of worker threads in the parent process (--threads), for suites
+    whose steps mostly wait for I/O. Provides the same interface as
+    :class:`ProcessWorkerPool`, but the worker function must not share
+    mutable state with other threads (use one runner per thread).
+
+    A thread cannot be killed: A stuck worker thread is abandoned
+    when it is restarted (its messages are dropped).
+    """
+    poll_timeout = 1.0
+    report_idle = False
+
+    def __init__(self, size, target):
+        self.size = size
+        self.target = target
+        self.cancel_event = threading.Event()
+        self.message_queue = Queue.Queue()
+        self.workers = {}
+
+    @property
+    def active_workers(self):
+        return [worker for worker in self.workers.values() if not worker.done]
+
+    def start(self):
+        for worker_id in range(self.size):
+            self.start_worker(worker_id)
+
+    def start_worker(self, worker_id):
+        worker = ThreadHandle(worker_id)
+        channel = ThreadChannel(worker, self.message_queue, self.cancel_event)
+        worker.thread = threading.Thread(target=run_worker,
+                                         args=(self.target, worker_id, channel),
+                                         name="WORKER{0}".format(worker_id))
+        worker.thread.daemon = True
+        self.workers[worker_id] = worker
+        worker.thread.start()
+
+    def restart(self, worker_id):
+        """Abandon a (stuck) worker thread and start a new one instead."""
+        worker = self.workers[worker_id]
+        worker.done = True
+        worker.abandoned = True
+        self.start_worker(worker_id)
+
+    def replace(self, worker_id):
+        """
+        Start a fresh worker thread in place of a worker thread that retired
+        and is done (worker recycling).
+        """
+        worker = self.workers[worker_id]
+        assert worker.done
+        worker.thread.join()
+        self.start_worker(worker_id)
+
+    def dispatch(self, worker_id, job):
+        self.workers[worker_id].jobs.put(job)
+
+    def stop(self, worker_id):
+        self.dispatch(worker_id, None)
+
+    def cancel(self):
+        """Tell all workers to skip the jobs they still have."""
+        self.cancel_event.set()
+
+    def close(self):
+        """Called when no jobs are left (nothing to do for a local pool)."""
+        pass
+
+    def messages(self):
+        """
+        Iterates over the messages from the worker threads until all
+        workers are done.
+        """
+        while self.active_workers:
+            try:
+                worker, kind, data = self.message_queue.get(True,
+                                                            self.poll_timeout)
+            except Queue.Empty:
+                if self.report_idle:
+                    yield (None, "idle", None)
+                continue
+            if worker.done:
+                continue    # -- ABANDONED: Worker was restarted.
+            if kind == "done":
+                worker.done = True
+            yield (worker.worker_id, kind, data)
+
+    def terminate(self):
+        for worker in self.active_workers:
+            worker.done = True
+            worker.abandoned = True
+
+    def join(self):
+        for worker in self.workers.values():
+            if not worker.abandoned:
+                worker.thread.join()
+
+
+class ThreadLocalStream(object):
+    """
+    Replacement for sys.stdout/sys.stderr while worker threads run:
+    Each thread may redirect its own output (capture), the output of all
+    other threads still goes to the original stream.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def redirect(self, stream):
+        """Redirect the output of the current thread."""
+        self.local.stream = stream
+
+    def restore(self):
+        self.local.stream = None
+
+    @property
+    def current(self):
+        stream = getattr(self.local, "stream", None)
+        if stream is None:
+            stream = self.stream
+        return stream
+
+    def write(self, text):
+        self.current.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.current, name)
+
+
+class JobQueue(object):
+    """
+    Pending jobs (job indexes) of a parallel run, that are handed out to
+    the workers in chunks. Many short jobs are batched to save round-trips,
+    long jobs are handed out alone.
+
+    The chunk size is adapted to the expected durations of the jobs
+    (guided self-scheduling): A chunk takes about the remaining work divided
+    by twice the number of workers. Therefore, chunks shrink towards the end
+    of the run, so that all workers finish at about the same time.
+
+    Jobs may use limited resources (tags like "@db:2": at most 2 jobs
+    that use the "db" resource run at the same time). Such a job is
+    handed out alone, when its resources are available. Until then,
+    other jobs are handed out instead. A job holds its resources until
+    it is marked as :meth:`done` (or is put back).
+
+    Jobs may belong to groups (affinity scheduling): A worker gets jobs
+    of its group while there are any. Then, it takes a group that no other
+    worker has. If there is none, it helps with the biggest group
+    (work stealing). Chunks contain jobs of one group only. A worker that
+    stops (retires, dies or is restarted) is released (:meth:`release`), so
+    that other workers take over its group.
+
+    :param estimates: Expected duration of each job (by job index).
+    :param max_chunk_size: Maximal number of jobs in one chunk.
+    :param resources: Resource names that each job uses (by job index).
+    :param limits: Maximal number of concurrent jobs (by resource name).
+    :param groups: Group of each job (by job index, default: one group).
+    """
+    def __init__(self, estimates, max_chunk_size=1, resources=None,
+                 limits=None, groups=None):
+        self.estimates = estimates
+        self.max_chunk_size = max(1, max_chunk_size)
+        self.resources = resources or {}
+        self.limits = limits or {}
+        self.groups = groups or {}
+        self.in_use = collections.defaultdict(int)
+        self.pending = {}   # -- Pending jobs by their group.
+        self.group_order = []
+        self.worker_groups = {}
+        self.limited = {}   # -- Pending jobs by their resources.
+        self.limited_order = []
+        self.size = 0
+        self.remaining = 0.0
+        self.push_back(range(len(estimates)))
+
+    def __len__(self):
+        return self.size
+
+    def queue_of(self, index):
+        resources = self.resources.get(index)
+        if not resources:
+            group = self.groups.get(index)
+            if group not in self.pending:
+                self.pending[group] = collections.deque()
+                self.group_order.append(group)
+            return self.pending[group]
+        key = tuple(sorted(resources))
+        if key not in self.limited:
+            self.limited[key] = collections.deque()
+            self.limited_order.append(key)
+        return self.limited[key]
+
+    def push_back(self, indexes):
+        for index in indexes:
+            self.queue_of(index).append(index)
+            self.size += 1
+            self.remaining += self.estimates[index]
+
+    def push_front(self, indexes):
+        """Put jobs back (in this order) to be handed out next."""
+        self.done(indexes)
+        for index in reversed(indexes):
+            self.queue_of(index).appendleft(index)
+            self.size += 1
+            self.remaining += self.estimates[index]
+
+    def done(self, indexes):
+        """Release the resources of jobs that are finished (or put back)."""
+        for index in indexes:
+            for resource in self.resources.get(index, ()):
+                self.in_use[resource] -= 1
+
+    def available(self, resources):
+        return all(self.in_use[resource] < max(1, self.limits[resource])
+                   for resource in resources)
+
+    def release(self, worker_id):
+        """Forget the group of a worker that stopped."""
+        self.worker_groups.pop(worker_id, None)
+
+    def select_group(self, worker_id):
+        """
+        Select the group whose jobs a worker gets next: Its own group,
+        a group that no other worker has, or the biggest group.
+
+        :return: Group with pending jobs (or None).
+        """
+        group = self.worker_groups.get(worker_id)
+        if self.pending.get(group):
+            return group
+        candidates = [group for group in self.group_order
+                      if self.pending[group]]
+        if not candidates:
+            return None
+        taken = set(group for other_id, group in self.worker_groups.items()
+                    if other_id != worker_id)
+        for group in candidates:
+            if group not in taken:
+                break
+        else:
+            # -- WORK STEALING: Help the worker with the most jobs left.
+            group = max(candidates, key=lambda group: len(self.pending[group]))
+        self.worker_groups[worker_id] = group
+        return group
+
+    def take(self, workers=1, worker_id=None):
+        """
+        Take the next chunk of jobs.
+
+        :param workers: Number of workers that share the remaining work.
+        :param worker_id: Worker that gets the chunk (affinity scheduling).
+        :return: List of job indexes (empty, if no jobs are left or
+                 all remaining jobs wait for resources).
+        """
+        # -- LIMITED JOBS FIRST: Their resources are the bottleneck.
+        for key in self.limited_order:
+            queue = self.limited[key]
+            if queue and self.available(key):
+                index = queue.popleft()
+                for resource in key:
+                    self.in_use[resource] += 1
+                self.size -= 1
+                self.remaining = max(0.0,
+                                     self.remaining - self.estimates[index])
+                return [index]
+
+        pending = self.pending.get(self.select_group(worker_id))
+        target = self.remaining / (2 * max(1, workers))
+        chunk = []
+        duration = 0.0
+        while pending and len(chunk) < self.max_chunk_size:
+            estimate = self.estimates[pending[0]]
+            if chunk and duration + estimate > target:
+                break
+            chunk.append(pending.popleft())
+            duration += estimate
+        self.size -= len(chunk)
+        self.remaining = max(0.0, self.remaining - duration)
+        return chunk
+
+
+class WorkerScaler(object):
+    """
+    Adapts the number of worker processes to the machine (--processes auto).
+
+    The pool starts with one worker per idle CPU, as far as the available
+    memory suffices. While the run goes on, a worker is added if more jobs
+    are queued than there are workers and the machine has spare CPU time
+    (load average) and memory. A worker is retired if the machine is
+    overloaded (load average well above the number of CPUs) or another
+    worker would not fit into the available memory anymore.
+    There are never more workers than remaining jobs.
+
+    The measurements are passed in (None: unknown), so the rules can be
+    used (and tested) without a real pool.
+
+    :param cpus: Number of CPUs (also the maximal number of workers).
+    """
+    interval = 5.0          # -- Seconds between two changes.
+    check_interval = 1.0    # -- Seconds between two measurements.
+    overload = 1.5          # -- Load average (per CPU) to retire a worker.
+    min_worker_memory = 64 * 1024 * 1024
+
+    def __init__(self, cpus=None, now=None):
+        self.cpus = cpus or cpu_count()
+        if now is None:
+            now = time.time()
+        self.last_change = now
+        self.last_check = now
+
+    def initial_size(self, job_count, load=None, memory=None,
+                     worker_memory=None):
+        """
+        :param job_count: Number of jobs of the run.
+        :param load:      System load average.
+        :param memory:    Available memory (in bytes).
+        :param worker_memory: Expected memory of a worker (in bytes).
+        :return: Number of workers to start with.
+        """
+        size = self.cpus
+        if load is not None:
+            size -= int(load)
+        if memory is not None:
+            worker_memory = max(worker_memory or 0, self.min_worker_memory)
+            size = min(size, memory // worker_memory)
+        return min(max(1, size), job_count)
+
+    def due(self, now=None):
+        """
+        Indicates if it is time to measure and :meth:`adjust()` again.
+        """
+        if now is None:
+            now = time.time()
+        if now - self.last_change < self.interval or \
+                now - self.last_check < self.check_interval:
+            return False
+        self.last_check = now
+        return True
+
+    def adjust(self, workers, queued, load=None, memory=None,
+               worker_memory=None, now=None):
+        """
+        Decide if the number of workers should change.
+
+        :param workers: Number of active workers.
+        :param queued:  Number of queued jobs (not handed out yet).
+        :param load:    System load average.
+        :param memory:  Available memory (in bytes).
+        :param worker_memory: Memory of a worker (in bytes).
+        :return: 1 (add a worker), -1 (retire a worker) or 0.
+        """
+        worker_memory = max(worker_memory or 0, self.min_worker_memory)
+        change = 0
+        if (load is not None and load > self.cpus * self.overload) or \
+                (memory is not None and memory < worker_memory):
+            if workers > 1:
+                change = -1
+        elif queued > workers and workers < self.cpus and \
+                (load is None or load < self.cpus - 1) and \
+                (memory is None or memory > 2 * worker_memory):
+            change = 1
+        if change:
+            self.last_change = now or time.time()
+        return change
+
+
+class StartupWatch(object):
+    """
+    Measures the start-up latency of the workers that a pool starts with:
+    The time from starting the pool until a worker says "ready" (after
+    its initialization, including the before_worker hook). Jobs are
+    dispatched to each worker as soon as it is ready, nobody waits for
+    the slowest worker.
+
+    :param worker_ids: Workers to wait for.
+    """
+    def __init__(self, worker_ids, now=None):
+        if now is None:
+            now = time.time()
+        self.start_time = now
+        self.pending = set(worker_ids)
+        self.latencies = {}
+
+    def ready(self, worker_id, now=None):
+        """
+        A worker said "ready" (or is gone before, then its latency is None).
+
+        :return: True, if this was the last worker that was waited for.
+        """
+        if worker_id not in self.pending:
+            return False
+        if now is None:
+            now = time.time()
+        self.pending.remove(worker_id)
+        self.latencies[worker_id] = now - self.start_time
+        return not self.pending
+
+    def gone(self, worker_id, now=None):
+        if worker_id not in self.pending:
+            return False
+        self.pending.remove(worker_id)
+        self.latencies[worker_id] = None
+        return not self.pending
+
+    def describe(self):
+        """
+        :return: Summary of the start-up latencies (as text).
+        """
+        latencies = [(latency, worker_id)
+                     for worker_id, latency in self.latencies.items()
+                     if latency is not None]
+        if not latencies:
+            return "No worker started."
+        first, _ = min(latencies)
+        last, last_worker_id = max(latencies)
+        return ("{0} worker(s) ready after {1:.2f}s (first: {2:.2f}s,"
+                " slowest: WORKER{3}).".format(len(latencies), last, first,
+                                               last_worker_id))
+
+
+class TimeoutWatch(object):
+    """
+    Keeps track of the scenario and step that each worker is running,
+    and detects workers that exceed their (scenario or step) timeout.
+    Workers announce each scenario/step with a "progress" message and
+    the end of each step (its deadline does not cover the hooks after it)::
+
+        (worker_id, "progress", ["scenario", name, timeout, scenario_index])
+        (worker_id, "progress", ["step", name, timeout, step_index])
+        (worker_id, "progress", ["step_done", step_index])
+
+    The scenario index is the index in the scenarios of the job, the step
+    index the index in the steps of the scenario (background included).
+    A timeout of 0 (or None) means: no deadline.
+    """
+    def __init__(self):
+        self.deadlines = {}
+        self.positions = {}
+
+    def progress(self, worker_id, data, now=None):
+        """Process the data of a "progress" message of a worker."""
+        if data[0] == "step_done":
+            self.step_finished(worker_id, *data[1:])
+        else:
+            self.started(worker_id, *data, now=now)
+
+    def started(self, worker_id, kind, name, timeout, index=None, now=None):
+        if now is None:
+            now = time.time()
+        deadlines = self.deadlines.setdefault(worker_id, {})
+        if kind == "scenario":
+            deadlines.clear()
+            self.positions[worker_id] = [index, None, False]
+        else:
+            deadlines.pop(kind, None)
+            position = self.positions.setdefault(worker_id,
+                                                 [None, None, False])
+            position[1:] = [index, False]
+        if timeout:
+            deadlines[kind] = (now + timeout, name, timeout)
+
+    def step_finished(self, worker_id, index=None):
+        """A step is done: Its deadline does not apply to the hooks after it."""
+        self.deadlines.get(worker_id, {}).pop("step", None)
+        position = self.positions.get(worker_id)
+        if position is not None:
+            position[2] = True
+
+    def position(self, worker_id):
+        """
+        :return: Tuple (scenario_index, step_index, step_done) of the step
+            that a worker runs (or ran last), or None if it is not known.
+        """
+        position = self.positions.get(worker_id)
+        return position and tuple(position) or None
+
+    def finished(self, worker_id):
+        """Forget the deadlines of a worker (its job is done)."""
+        self.deadlines.pop(worker_id, None)
+        self.positions.pop(worker_id, None)
+
+    def expired(self, now=None):
+        """
+        Detect the workers that exceeded a deadline.
+
+        :return: List of (worker_id, error_message) tuples.
+        """
+        if now is None:
+            now = time.time()
+        expired = []
+        for worker_id, deadlines in self.deadlines.items():
+            for kind in ("step", "scenario"):
+                if kind in deadlines and deadlines[kind][0] <= now:
+                    _, name, timeout = deadlines[kind]
+                    expired.append((worker_id,
+                        u"TIMEOUT: {0} '{1}' exceeded its timeout of {2}s"
+                        .format(kind.capitalize(), name, timeout)))
+                    break
+        return expired
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
+from __future__ import with_statement
 import os.path
-import codecs
+import re
+import tempfile
 from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr
 from behave.reporter.base import Reporter
 from behave.model import Scenario, ScenarioOutline, Step
 from behave.formatter import ansi_escapes
@@ -10,10 +13,31 @@ from behave.model_describe import ModelDescriptor
 from behave.textutil import indent, make_indentation
 
 
+# -- XML 1.0: Control characters are not allowed (not even escaped).
+_illegal_xml_chars = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def xml_text(text):
+    """Provide text (as unicode) without characters that XML forbids."""
+    if text is None:
+        return u''
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    elif not isinstance(text, unicode):
+        text = unicode(text)
+    return _illegal_xml_chars.sub(u'?', text)
+
+
+def cdata_section(text, encoding):
+    # -- A CDATA section ends at the first "]]>": Split the section there.
+    text = text.encode(encoding).replace(']]>', ']]]]><![CDATA[>')
+    return "\n<![CDATA[%s]]>\n" % text
+
+
 def CDATA(text=None):
     # -- issue #70: remove_ansi_escapes(text)
     element = ElementTree.Element('![CDATA[')
-    element.text = ansi_escapes.strip_escapes(text)
+    element.text = ansi_escapes.strip_escapes(xml_text(text))
     return element
 
 
@@ -22,8 +46,7 @@ class ElementTreeWithCDATA(ElementTree.ElementTree):
         """This method is for ElementTree <= 1.2.6"""
 
         if node.tag == '![CDATA[':
-            text = node.text.encode(encoding)
-            file.write("\n<![CDATA[%s]]>\n" % text)
+            file.write(cdata_section(node.text, encoding))
         else:
             ElementTree.ElementTree._write(self, file, node, encoding,
                                            namespaces)
@@ -33,7 +56,7 @@ if hasattr(ElementTree, '_serialize'):
     def _serialize_xml(write, elem, encoding, qnames, namespaces,
                        orig=ElementTree._serialize_xml):
         if elem.tag == '![CDATA[':
-            write("\n<%s%s]]>\n" % (elem.tag, elem.text.encode(encoding)))
+            write(cdata_section(elem.text, encoding))
             return
         return orig(write, elem, encoding, qnames, namespaces)
 
@@ -43,6 +66,9 @@ if hasattr(ElementTree, '_serialize'):
 class FeatureReportData(object):
     """
     Provides value object to collect JUnit report data from a Feature.
+    The testcases are not kept in memory, they are spooled to the temp file
+    of the writer as soon as they are known. Only their position (of the
+    scenario in the feature), offset and size in the spool file are kept.
     """
     def __init__(self, feature, filename, classname=None):
         if not classname and filename:
@@ -51,6 +77,8 @@ class FeatureReportData(object):
         self.filename = filename
         self.classname = classname
         self.testcases = []
+        self.positions = None
+        self.duration = 0.0
         self.counts_tests = 0
         self.counts_errors = 0
         self.counts_failed = 0
@@ -58,18 +86,59 @@ class FeatureReportData(object):
 
     def reset(self):
         self.testcases = []
+        self.duration = 0.0
         self.counts_tests = 0
         self.counts_errors = 0
         self.counts_failed = 0
         self.counts_skipped = 0
 
+    def add_testcase(self, scenario, offset, size):
+        """Keep where the testcase of a scenario is in the spool file."""
+        if self.positions is None:
+            self.positions = dict((id(each), index) for index, each
+                                  in enumerate(self.feature.walk_scenarios()))
+        position = self.positions.get(id(scenario), len(self.positions))
+        self.testcases.append((position, offset, size))
 
-class JUnitReporter(Reporter):
+    def sorted_testcases(self):
+        """
+        :return: Testcases (offset, size) in the order of the feature file
+            (the scenarios of a parallel run are done in any order).
+        """
+        return [(offset, size) for position, offset, size in
+                sorted(self.testcases, key=lambda testcase: testcase[0])]
+
+
+class JUnitWriter(object):
     """
-    Generates JUnit-like XML test report for behave.
+    Writes JUnit-like XML test reports (one TESTS-*.xml file per feature)
+    incrementally: Each testcase is spooled to a temp file as soon as its
+    scenario is done, the testsuite file of a feature is written (from the
+    spool file) when the feature is done. Only the counts and the spool
+    offsets of the unfinished features are kept in memory, one spool file
+    is used for all features (and emptied when no feature is unfinished).
+    Used by the JUnitReporter (serial runs) and by the parent process of
+    parallel runs (where the scenarios of a feature finish in any order).
+
+    .. code-block:: python
+
+        writer = JUnitWriter(config)
+        writer.add_scenario(scenario)   # for each scenario, when it is done
+        writer.end_feature(feature)     # when all its scenarios are done
+        writer.close()                  # completes unfinished features, too
+
+    If ``config.junit_merged`` is set, all testsuites are written to this
+    file, too (as one ``<testsuites>`` document).
     """
     show_multiline = True
     show_timings   = True     # -- Show step timings.
+    copy_buffer_size = 64 * 1024
+
+    def __init__(self, config):
+        self.config = config
+        self.reports = {}
+        self.merged_stream = None
+        self.spool = None
 
     def make_feature_filename(self, feature):
         filename = None
@@ -84,42 +153,102 @@ class JUnitReporter(Reporter):
         filename = filename.replace('\\', '/').replace('/', '.')
         return filename
 
-    # -- REPORTER-API:
-    def feature(self, feature):
-        filename  = self.make_feature_filename(feature)
-        classname = filename
-        report    = FeatureReportData(feature, filename)
-        filename  = 'TESTS-%s.xml' % filename
-
-        suite = ElementTree.Element('testsuite')
-        suite.set('name', '%s.%s' % (classname, feature.name or feature.filename))
-
-        # -- BUILD-TESTCASES: From scenarios
-        for scenario in feature:
-            if isinstance(scenario, ScenarioOutline):
-                scenario_outline = scenario
-                self._process_scenario_outline(scenario_outline, report)
-            else:
-                self._process_scenario(scenario, report)
-
-        # -- ADD TESTCASES to testsuite:
-        for testcase in report.testcases:
-            suite.append(testcase)
-
-        suite.set('tests', str(report.counts_tests))
-        suite.set('errors', str(report.counts_errors))
-        suite.set('failures', str(report.counts_failed))
-        suite.set('skipped', str(report.counts_skipped))  # WAS: skips
-        # -- ORIG: suite.set('time', str(round(feature.duration, 3)))
-        suite.set('time', str(round(feature.duration, 6)))
-
-        if not os.path.exists(self.config.junit_directory):
+    def report_of(self, feature):
+        report = self.reports.get(id(feature))
+        if report is None:
+            report = FeatureReportData(feature,
+                                       self.make_feature_filename(feature))
+            self.reports[id(feature)] = report
+        return report
+
+    def write_feature(self, feature):
+        """Write the report of a feature whose scenarios are all done."""
+        self.report_of(feature)
+        for scenario in feature.walk_scenarios():
+            self.add_scenario(scenario)
+        self.end_feature(feature)
+
+    def add_scenario(self, scenario):
+        """Write the testcase of a scenario (that is done)."""
+        report = self.report_of(scenario.feature)
+        testcase = self.make_testcase(scenario, report)
+        text = ElementTree.tostring(testcase, 'utf-8')
+        if self.spool is None:
+            self.spool = tempfile.TemporaryFile()
+        self.spool.seek(0, os.SEEK_END)
+        report.add_testcase(scenario, self.spool.tell(), len(text))
+        self.spool.write(text)
+        report.duration += scenario.duration
+
+    def end_feature(self, feature):
+        """Complete the testsuite file of a feature."""
+        report = self.reports.pop(id(feature), None)
+        if report is None:
+            return
+        header = self.make_testsuite_header(report).encode('utf-8')
+        testcases = report.sorted_testcases()
+        directory = self.config.junit_directory
+        if not os.path.exists(directory):
             # -- ENSURE: Create multiple directory levels at once.
-            os.makedirs(self.config.junit_directory)
+            os.makedirs(directory)
+        report_filename = os.path.join(directory,
+                                       'TESTS-%s.xml' % report.filename)
+        with open(report_filename, 'wb') as f:
+            f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+            self.write_testsuite(header, testcases, f)
+
+        merged_filename = getattr(self.config, 'junit_merged', None)
+        if merged_filename:
+            if self.merged_stream is None:
+                self.merged_stream = open(merged_filename, 'wb')
+                self.merged_stream.write(
+                    "<?xml version='1.0' encoding='UTF-8'?>\n<testsuites>\n")
+            self.write_testsuite(header, testcases, self.merged_stream)
+        if not self.reports and self.spool is not None:
+            # -- ALL FEATURES DONE: Reuse the spool file from its start.
+            self.spool.seek(0)
+            self.spool.truncate()
+
+    def write_testsuite(self, header, testcases, stream):
+        """Write a testsuite, its testcases are copied from the spool file."""
+        stream.write(header)
+        for offset, size in testcases:
+            self.spool.seek(offset)
+            while size > 0:
+                data = self.spool.read(min(size, self.copy_buffer_size))
+                if not data:
+                    break
+                stream.write(data)
+                size -= len(data)
+        stream.write('</testsuite>\n')
+
+    def close(self):
+        """Complete the reports of all (partially run) features."""
+        for report in self.reports.values():
+            self.end_feature(report.feature)
+        if self.merged_stream is not None:
+            self.merged_stream.write('</testsuites>\n')
+            self.merged_stream.close()
+            self.merged_stream = None
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
 
-        tree = ElementTreeWithCDATA(suite)
-        report_filename = os.path.join(self.config.junit_directory, filename)
-        tree.write(codecs.open(report_filename, 'w'), 'UTF-8')
+    @staticmethod
+    def make_testsuite_header(report):
+        feature = report.feature
+        attributes = [
+            ('errors', report.counts_errors),
+            ('failures', report.counts_failed),
+            ('name', u'%s.%s' % (report.classname,
+                                 feature.name or feature.filename)),
+            ('skipped', report.counts_skipped),
+            ('tests', report.counts_tests),
+            ('time', round(report.duration, 6)),
+        ]
+        return u'<testsuite %s>' % u' '.join(
+            u'%s=%s' % (name, quoteattr(xml_text(value)))
+            for name, value in attributes)
 
     # -- MORE:
     @staticmethod
@@ -183,9 +312,27 @@ class JUnitReporter(Reporter):
         step_indentation = make_indentation(4)
         return header_line + indent(text, step_indentation) + footer_line
 
-    def _process_scenario(self, scenario, report):
+    @staticmethod
+    def describe_exception(exception):
         """
-        Process a scenario and append information to JUnit report object.
+        :return: Tuple (type name, message, is_failure) of a step exception.
+        """
+        if exception is None:
+            return ('NoneType', u'None', True)
+        # -- JOB RECORDS: Parallel runs provide a stand-in for the exception.
+        type_name = getattr(exception, 'type_name',
+                            exception.__class__.__name__)
+        is_failure = getattr(exception, 'is_assertion',
+                             isinstance(exception, AssertionError))
+        try:
+            message = unicode(exception)
+        except UnicodeError:
+            message = str(exception).decode('utf-8', 'replace')
+        return (type_name, message, is_failure)
+
+    def make_testcase(self, scenario, report):
+        """
+        Make the testcase element of a scenario and count it in the report.
         This corresponds to a JUnit testcase:
 
           * testcase.@classname = f(filename) +'.'+ feature.name
@@ -202,6 +349,7 @@ class JUnitReporter(Reporter):
 
         :param scenario:  Scenario to process.
         :param report:    Context object to store/add info to (outgoing param).
+        :return: Testcase element.
         """
         assert isinstance(scenario, Scenario)
         assert not isinstance(scenario, ScenarioOutline)
@@ -210,8 +358,9 @@ class JUnitReporter(Reporter):
         report.counts_tests += 1
 
         case = ElementTree.Element('testcase')
-        case.set('classname', '%s.%s' % (classname, feature.name or feature.filename))
-        case.set('name', scenario.name or '')
+        case.set('classname', xml_text('%s.%s' % (classname,
+                                       feature.name or feature.filename)))
+        case.set('name', xml_text(scenario.name or ''))
         case.set('status', scenario.status)
         # -- ORIG: case.set('time', str(round(scenario.duration, 3)))
         case.set('time', str(round(scenario.duration, 6)))
@@ -222,10 +371,19 @@ class JUnitReporter(Reporter):
                 step = self.select_step_with_status(status, scenario)
                 if step:
                     break
-            assert step, "OOPS: No failed step found in scenario: %s" % scenario.name
-            assert step.status in ('failed', 'undefined')
+            if step:
+                type_name, message, is_failure = \
+                    self.describe_exception(step.exception)
+                step_text = self.describe_step(step).rstrip()
+                text = u"\nFailing step: %s\nLocation: %s\n" % \
+                       (step_text, step.location)
+                text += xml_text(step.error_message)
+            else:
+                # -- ABORTED: Scenario failed without a failed step.
+                type_name, message, is_failure = ('unknown', u'', False)
+                text = u''
             element_name = 'failure'
-            if isinstance(step.exception, (AssertionError, type(None))):
+            if is_failure:
                 # -- FAILURE: AssertionError
                 report.counts_failed += 1
             else:
@@ -234,14 +392,11 @@ class JUnitReporter(Reporter):
                 element_name = 'error'
             # -- COMMON-PART:
             failure = ElementTree.Element(element_name)
-            step_text = self.describe_step(step).rstrip()
-            text = u"\nFailing step: %s\nLocation: %s\n" % (step_text, step.location)
-            message = unicode(step.exception)
+            message = xml_text(message)
             if len(message) > 80:
                 message = message[:80] + "..."
-            failure.set('type', step.exception.__class__.__name__)
+            failure.set('type', type_name)
             failure.set('message', message)
-            text += unicode(step.error_message)
             failure.append(CDATA(text))
             case.append(failure)
         elif scenario.status in ('skipped', 'untested'):
@@ -252,7 +407,8 @@ class JUnitReporter(Reporter):
                 report.counts_failed += 1
                 failure = ElementTree.Element('failure')
                 failure.set('type', 'undefined')
-                failure.set('message', ('Undefined Step: %s' % step.name))
+                failure.set('message', xml_text('Undefined Step: %s' %
+                                                step.name))
                 case.append(failure)
             else:
                 skip = ElementTree.Element('skipped')
@@ -264,21 +420,30 @@ class JUnitReporter(Reporter):
 
         # Append the captured standard output
         if scenario.stdout:
-            text += '\nCaptured stdout:\n%s\n' % scenario.stdout
+            text += u'\nCaptured stdout:\n%s\n' % xml_text(scenario.stdout)
         stdout.append(CDATA(text))
         case.append(stdout)
 
         # Create stderr section for each test case
         if scenario.stderr:
             stderr = ElementTree.Element('system-err')
-            text = u'\nCaptured stderr:\n%s\n' % scenario.stderr
+            text = u'\nCaptured stderr:\n%s\n' % xml_text(scenario.stderr)
             stderr.append(CDATA(text))
             case.append(stderr)
+        return case
 
-        report.testcases.append(case)
 
-    def _process_scenario_outline(self, scenario_outline, report):
-        assert isinstance(scenario_outline, ScenarioOutline)
-        for scenario in scenario_outline:
-            assert isinstance(scenario, Scenario)
-            self._process_scenario(scenario, report)
+class JUnitReporter(Reporter):
+    """
+    Generates JUnit-like XML test report for behave.
+    """
+    def __init__(self, config):
+        super(JUnitReporter, self).__init__(config)
+        self.writer = JUnitWriter(config)
+
+    # -- REPORTER-API:
+    def feature(self, feature):
+        self.writer.write_feature(feature)
+
+    def end(self):
+        self.writer.close()
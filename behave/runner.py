@@ -2,25 +2,34 @@
 
 from __future__ import with_statement
 import contextlib
+import copy
 import logging
 import StringIO
-import re
 import os
+import shutil
+import socket
 import sys
+import tempfile
 import traceback
 import warnings
 import weakref
 import time
 import collections
 
-from behave import matchers
+from behave import matchers, parallel, distributed, eventloop, jobrecord, \
+    forkserver
 from behave.step_registry import setup_step_decorators
 from behave.formatter import formatters
 from behave.configuration import ConfigError
-from behave.log_capture import LoggingCapture
+from behave.log_capture import LoggingCapture, ThreadLocalCapture
 from behave.runner_util import \
-    collect_feature_locations, parse_features
+    collect_feature_locations, parse_features, select_scenarios, \
+    keep_scenarios, partition_by_duration
 from behave.formatter.base import StreamOpener
+from behave.formatter.plain import PlainFormatter
+from behave.reporter.junit import JUnitWriter
+from behave.timings import TimingDatabase, collect_timings, make_timing_key
+from behave.tag_expression import get_tag_limit, split_tag_limit
 
 multiprocessing = None
 try:
@@ -363,6 +372,19 @@ class PathManager(object):
             self.paths.append(path)
 
 
+def format_time(timestamp):
+    """Format a timestamp (like time.time()) for the parallel job reports."""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+def index_of(item, items):
+    """:return: Index of an item (the same object) in a list, or None."""
+    for index, each in enumerate(items):
+        if each is item:
+            return index
+    return None
+
+
 class Runner(object):
     '''
     Test runner for behave.
@@ -395,6 +417,17 @@ class Runner(object):
         self.base_dir = None
         self.context = None
         self.formatters = None
+        self.timings = None
+        self.progress_channel = None
+        self.progress_job = None
+        self.progress_scenario = None
+        self.worker_feature = None
+        self.worker_retired = None
+        self.thread_log_capture = None
+        self.event_loop = None
+        self.event_loop_pid = None
+        self.output_store = jobrecord.OutputStore()
+        self.fork_server = None
 
     # @property
     def _get_aborted(self):
@@ -542,15 +575,31 @@ class Runner(object):
                         matchers.current_matcher = default_matcher
 
     def run_hook(self, name, context, *args):
+        if self.progress_channel and name in ('before_scenario', 'before_step',
+                                              'after_step'):
+            self.report_progress(name, args[0])
         if not self.config.dry_run and (name in self.hooks):
             # try:
             with context.user_mode():
-                self.hooks[name](context, *args)
+                result = self.hooks[name](context, *args)
+                if eventloop.is_awaitable(result):
+                    self.run_until_complete(result)
             # except KeyboardInterrupt:
             #     self.aborted = True
             #     if name not in ("before_all", "after_all"):
             #         raise
 
+    def run_until_complete(self, awaitable):
+        """
+        Run the coroutine of an async step function (or hook) on the
+        event loop of this runner (created when it is needed first).
+        """
+        if self.event_loop is None or self.event_loop_pid != os.getpid():
+            # -- WORKER PROCESS: Don't use the event loop of the parent.
+            self.event_loop = eventloop.new_event_loop()
+            self.event_loop_pid = os.getpid()
+        return self.event_loop.run_until_complete(awaitable)
+
     def feature_locations(self):
         return collect_feature_locations(self.config.paths)
 
@@ -568,23 +617,40 @@ class Runner(object):
         stream_openers = self.config.outputs
         failed_count = 0
 
+        if self.uses_fork_server():
+            # -- FORK SERVER: Template is forked before before_all runs.
+            self.fork_server = forkserver.ForkServer(self.prepare_template,
+                                                     self.template_worker)
+            self.fork_server.start()
+        elif self.config.preload:
+            self.preload_modules()
+
         # -- ENSURE: context.execute_steps() works in weird cases (hooks, ...)
         self.setup_capture()
         self.run_hook('before_all', context)
 
         # -- STEP: Parse all feature files (by using their file location).
-        feature_locations = [ filename for filename in self.feature_locations()
-                                    if not self.config.exclude(filename) ]
-        features = parse_features(feature_locations, language=self.config.lang)
+        features = self.collect_features()
         self.features.extend(features)
 
         # -- STEP: Multi-processing!
-        if getattr(self.config, 'proc_count'):
-            return self.run_multiproc()
+        if getattr(self.config, 'proc_count') or \
+            getattr(self.config, 'thread_count') or \
+            getattr(self.config, 'coordinator') or getattr(self.config, 'agent'):
+            try:
+                return self.run_multiproc()
+            finally:
+                if self.fork_server:
+                    self.fork_server.stop()
+                    self.fork_server = None
 
         # -- STEP: Run all features.
         self.formatters = formatters.get_formatter(self.config, stream_openers)
+        if not self.config.dry_run:
+            self.timings = TimingDatabase.open(self.config.timing_db)
         undefined_steps_initial_size = len(self.undefined)
+        max_failures = int(self.config.max_failures or 0)
+        failed_scenarios = 0
         run_feature = True
         for feature in features:
             if run_feature:
@@ -594,11 +660,19 @@ class Runner(object):
                         formatter.uri(feature.filename)
 
                     failed = feature.run(self)
+                    if self.timings:
+                        self.timings.record_all(collect_timings(feature))
                     if failed:
                         failed_count += 1
+                        failed_scenarios += len([scenario
+                                for scenario in feature.walk_scenarios()
+                                if scenario.status == 'failed'])
                         if self.config.stop or self.aborted:
                             # -- FAIL-EARLY: After first failure.
                             run_feature = False
+                        elif max_failures and failed_scenarios >= max_failures:
+                            # -- FAIL-EARLY: After --max-failures failures.
+                            run_feature = False
                 except KeyboardInterrupt:
                     self.aborted = True
                     failed_count += 1
@@ -617,6 +691,8 @@ class Runner(object):
         self.run_hook('after_all', context)
         for reporter in self.config.reporters:
             reporter.end()
+        if self.timings:
+            self.timings.flush()
         # if self.aborted:
         #     print "\nABORTED: By user."
 
@@ -624,19 +700,96 @@ class Runner(object):
                   (len(self.undefined) > undefined_steps_initial_size))
         return failed
 
+    def collect_features(self, verbose=True):
+        """
+        Parse all feature files (by using their file location), but
+        only the features of this shard (--shard).
+        """
+        feature_locations = [ filename for filename in self.feature_locations()
+                                    if not self.config.exclude(filename) ]
+        features = parse_features(feature_locations, language=self.config.lang)
+        if self.config.shard:
+            features = self.select_shard(features, verbose)
+        return features
+
+    def select_shard(self, features, verbose=True):
+        """
+        Select the scenarios of this shard (--shard INDEX/COUNT): The selected
+        scenarios (after location, tag and name filtering) are partitioned
+        into COUNT shards with about the same number of scenarios, or the
+        same estimated duration (with --shard-durations).
+        Scenarios of a feature that runs as one job (@serial,
+        --parallel-element=feature) stay in the same shard.
+
+        The local timing database (--timing-db) is not used: It differs
+        from machine to machine, so the shards would no longer agree on
+        the partition (overlap and miss scenarios).
+
+        :param features: Parsed features.
+        :param verbose:  If true, print the size of this shard.
+        :return: Features, that contain only the scenarios of this shard.
+        """
+        index, count = self.config.shard
+        whole_features = getattr(self.config, 'parallel_element') == 'feature'
+        units = []
+        for feature in features:
+            scenarios = select_scenarios(feature, self.config)
+            if not scenarios:
+                continue
+            elif whole_features or 'serial' in feature.tags:
+                units.append(scenarios)
+            else:
+                units.extend([scenario] for scenario in scenarios)
+
+        all_scenarios = [scenario for unit in units for scenario in unit]
+        durations = None
+        timings = TimingDatabase.open(getattr(self.config, 'shard_durations'))
+        if timings:
+            durations = timings.estimate_durations(all_scenarios)
+        known_durations = bool(durations and sum(durations))
+        if not known_durations:
+            # -- NO DURATIONS KNOWN: Balance by number of scenarios.
+            durations = [1.0] * len(all_scenarios)
+        estimates = []
+        for unit in units:
+            estimates.append(sum(durations[:len(unit)]))
+            durations = durations[len(unit):]
+
+        selected = []
+        estimate = 0.0
+        partitions = partition_by_duration(estimates, count)
+        for unit, unit_estimate, partition in zip(units, estimates, partitions):
+            if partition == index:
+                selected.extend(unit)
+                estimate += unit_estimate
+        if known_durations:
+            estimate_text = ", estimated {0:.1f}s".format(estimate)
+        else:
+            estimate_text = ""
+        if verbose:
+            print "INFO: Shard {0}/{1}: {2} of {3} scenario(s){4}".format(
+                index + 1, count, len(selected), len(all_scenarios),
+                estimate_text)
+        return keep_scenarios(features, selected)
+
+    # -- Tags with a number that are no resource limits (like "@timeout:60").
+    reserved_tag_limits = ('timeout', 'retry')
+    # -- Exit code of an agent worker process that retired (recycling).
+    retired_exitcode = 75
 
     def run_multiproc(self):
 
-        if not multiprocessing:
+        thread_count = getattr(self.config, 'thread_count')
+        if not multiprocessing and not thread_count:
             print ("ERROR: Cannot import multiprocessing module."
             " If you're on python2.5, go get the backport")
             return 1
-        self.config.format = ['plain']
         self.parallel_element = getattr(self.config, 'parallel_element')
 
         if not self.parallel_element:
             self.parallel_element = 'scenario'
-            print "INFO: Without giving --parallel-element, defaulting to 'scenario'..."
+            if not getattr(self.config, 'agent'):
+                print "INFO: Without giving --parallel-element, defaulting to 'scenario'..."
         else:
             if self.parallel_element != 'feature' and \
                 self.parallel_element != 'scenario':
@@ -644,113 +797,837 @@ class Runner(object):
                     " option must be set to 'feature' or 'scenario'. You gave '"+
                     str(self.parallel_element)+"', which isn't valid.")
                     return 1
+        if thread_count and getattr(self.config, 'proc_count'):
+            print "ERROR: Use either --processes or --threads, not both."
+            return 1
+        proc_count = getattr(self.config, 'proc_count')
+        affinity = getattr(self.config, 'affinity')
+        if affinity and affinity != 'feature' and \
+                not affinity.startswith('tag:'):
+            print ("ERROR: --affinity must be 'feature' or 'tag:PREFIX'."
+                   " You gave '{0}', which isn't valid.".format(affinity))
+            return 1
 
         # -- Prevent context warnings.
         def do_nothing(obj2, obj3):
             pass
         self.context._emit_warning = do_nothing
 
+        if getattr(self.config, 'agent'):
+            # -- AGENT: Uses the parallel element of the coordinator.
+            return self.run_agent()
+
+        scenario_count, feature_count, deselected_count = self.build_joblist()
+        estimates = None
+        self.timings = TimingDatabase.open(getattr(self.config, 'timing_db'))
+        if self.timings:
+            # -- LONGEST JOB FIRST: Prevent that a long job, that is started
+            #    last, becomes the tail of the whole run.
+            self.joblist = self.timings.sort_longest_first(self.joblist)
+            estimates = self.timings.estimate_durations(self.joblist)
+        if not estimates or not sum(estimates):
+            # -- NO DURATIONS KNOWN: Chunk by number of jobs.
+            estimates = [1.0] * len(self.joblist)
+
+        scaler = None
+        coordinator = getattr(self.config, 'coordinator')
+        if coordinator:
+            pool = distributed.CoordinatorPool(coordinator, self.agent_hello())
+            workers = "agents on {0}".format(coordinator)
+        elif thread_count:
+            thread_count = min(int(thread_count), len(self.joblist))
+            pool = parallel.ThreadWorkerPool(thread_count, self.thread_worker)
+            workers = "{0} worker threads".format(thread_count)
+            self.setup_thread_capture()
+            if eventloop.asyncio:
+                # -- ASYNC STEPS: All threads share one event loop.
+                self.event_loop = eventloop.EventLoopThread()
+                self.event_loop_pid = os.getpid()
+        else:
+            if proc_count == 'auto':
+                # -- ADAPTIVE: Start by CPUs and memory, scale while running.
+                scaler = parallel.WorkerScaler()
+                proc_count = scaler.initial_size(len(self.joblist),
+                    parallel.load_average(), parallel.available_memory(),
+                    parallel.process_rss())
+            proc_count = min(int(proc_count), len(self.joblist))
+            if self.fork_server:
+                # -- FORKED WORKERS: Connect like agents, records are inline.
+                pool = forkserver.ForkServerPool(self.fork_server, proc_count,
+                                                 self.agent_hello())
+                workers = "{0} forked workers".format(proc_count)
+            else:
+                pool = parallel.ProcessWorkerPool(proc_count, self.worker)
+                workers = "{0} workers".format(proc_count)
+                # -- OUT-OF-BAND: Large outputs of job records (see jobrecord).
+                self.output_store = jobrecord.OutputStore(
+                    tempfile.mkdtemp(prefix="behave-"))
+            if scaler:
+                workers += " (at first, up to {0})".format(scaler.cpus)
+        print ("INFO: {0} scenario(s) and {1} feature(s) queued for {2}"
+               " ({3} scenario(s) not selected by location, tags or name)."
+               .format(scenario_count, feature_count, workers,
+                       deselected_count))
+        # -- STREAMING: Results are reported as soon as they arrive.
+        #    JUnit testcases are written as they arrive, a testsuite file
+        #    is completed when all jobs of its feature are done.
+        self.multiproc_metrics = collections.defaultdict(int)
+        self.multiproc_feature_statuses = collections.defaultdict(set)
+        self.multiproc_retried_jobs = []
+        self.multiproc_junit_writer = None
+        if getattr(self.config, 'junit'):
+            self.multiproc_junit_writer = JUnitWriter(self.config)
+        # -- FORMATTERS: Replay the formatter events of the job records,
+        #    one feature after another in file order (a feature that is
+        #    done waits for the features before it).
+        #    The job reports are printed if stdout is not used by them.
+        self.formatters = formatters.get_formatter(self.config,
+                                                   self.config.outputs)
+        self.multiproc_feature_records = collections.defaultdict(list)
+        self.multiproc_replay_order = self.build_replay_order()
+        self.multiproc_replays = {}
+        self.multiproc_print_reports = not self.formatters_use_stdout()
+
+        # -- DISPATCH: Hand out the next chunk of job indexes whenever
+        #    a worker has finished its previous chunk.
+        max_chunk_size = int(getattr(self.config, 'max_chunk_size') or 1)
+        resources, limits = self.build_job_resources()
+        joblist_indexes = parallel.JobQueue(estimates, max_chunk_size,
+                                            resources, limits,
+                                            self.build_job_groups())
+        running = {}
+        waiting = collections.deque()
+        lost_jobs = set()
+        given_up = 0
+        # -- FAIL-FAST: Stop all workers after --max-failures failures.
+        max_failures = int(getattr(self.config, 'max_failures') or 0)
+        if getattr(self.config, 'stop'):
+            max_failures = 1
+        cancelled = 0
+        stopping = False
+        # -- WORKER RECYCLING: Retired workers are replaced when done.
+        retiring = set()
+        recycled = 0
+        # -- ADAPTIVE WORKER COUNT: Workers to retire (--processes auto).
+        surplus = 0
+        # -- MEMORY: Shared/private memory of each worker (when it exits).
+        worker_memory = {}
+        # -- TIMEOUTS: Kill and restart workers that are stuck.
+        watch = parallel.TimeoutWatch()
+        pool.report_idle = True
+        # -- LOST AGENTS: Jobs are left, but all agents are gone.
+        agent_wait = float(getattr(self.config, 'agent_wait') or 0)
+        agent_deadline = None
+
+        # -- READINESS: Each worker says "ready" when it is initialized,
+        #    it gets its first jobs at once (no start-up delay).
+        #    Agents may join at any time, their start-up is not measured.
+        startup = parallel.StartupWatch(range(getattr(pool, 'size', 0)))
+
+        def dispatch_waiting():
+            # -- LIMITED RESOURCES: Workers may have to wait for a job
+            #    until a running job releases its resources.
+            while waiting and joblist_indexes and not stopping:
+                chunk = joblist_indexes.take(len(pool.active_workers),
+                                             waiting[0])
+                if not chunk:
+                    break
+                ready_worker_id = waiting.popleft()
+                running[ready_worker_id] = collections.deque(chunk)
+                pool.dispatch(ready_worker_id, chunk)
+            if stopping or not joblist_indexes:
+                while waiting:
+                    pool.stop(waiting.popleft())
+                if not running:
+                    pool.close()
+
+        def requeue_lost_jobs(worker_id):
+            # -- RETRY: Jobs of a lost worker (or agent) once, in a fresh
+            #    worker (like a stuck worker), to keep the worker count.
+            #    Returns the number of jobs that are given up.
+            retries = []
+            given_up = 0
+            for joblist_index in running.pop(worker_id, []):
+                if joblist_index in lost_jobs:
+                    given_up += 1
+                    joblist_indexes.done([joblist_index])
+                else:
+                    lost_jobs.add(joblist_index)
+                    retries.append(joblist_index)
+            joblist_indexes.push_front(retries)
+            if worker_id in waiting:
+                waiting.remove(worker_id)
+            if retries and not stopping:
+                pool.replace(worker_id)
+            return given_up
+
+        try:
+            # -- START WORKERS: After all setup that may fail, and within
+            #    try-finally, so that workers are always joined.
+            try:
+                pool.start()
+            except socket.error, e:
+                print "ERROR: Cannot listen on {0}: {1}".format(
+                    coordinator or "localhost", e)
+                return 1
+            if not joblist_indexes:
+                pool.close()
+            for worker_id, kind, data in pool.messages():
+                for stuck_worker_id, error in watch.expired():
+                    print "ERROR: WORKER{0} is stuck, restarting it. {1}".format(
+                        stuck_worker_id, error)
+                    position = watch.position(stuck_worker_id)
+                    watch.finished(stuck_worker_id)
+                    joblist_indexes.release(stuck_worker_id)
+                    pool.restart(stuck_worker_id)
+                    chunk = running.pop(stuck_worker_id, None)
+                    if chunk:
+                        joblist_index = chunk.popleft()
+                        joblist_indexes.done([joblist_index])
+                        current_job = self.joblist[joblist_index]
+                        joblist_indexes.push_front(list(chunk))
+                        timeout_record = self.make_timeout_record(
+                            stuck_worker_id, current_job, error, position)
+                        self.multiproc_report_result(current_job,
+                                                     timeout_record)
+                        self.multiproc_job_done(current_job)
+                    if not stopping and self.multiproc_failures_exceeded(
+                            max_failures):
+                        stopping = True
+                        pool.cancel()
+                    dispatch_waiting()
+
+                if coordinator and pool.workers and joblist_indexes and \
+                        not pool.active_workers:
+                    # -- NO AGENT LEFT: Wait for agents to (re)connect.
+                    if agent_deadline is None:
+                        agent_deadline = time.time() + agent_wait
+                        print ("WARNING: All agents are gone, waiting {0}s"
+                               " for agents to connect.".format(agent_wait))
+                    if time.time() >= agent_deadline:
+                        print ("ERROR: No agent connected within {0}s."
+                               .format(agent_wait))
+                        pool.close()
+                else:
+                    agent_deadline = None
+
+                if scaler and not stopping and scaler.due():
+                    worker_rss = pool.worker_rss()
+                    change = scaler.adjust(
+                        len(pool.active_workers) - surplus,
+                        len(joblist_indexes), parallel.load_average(),
+                        parallel.available_memory(),
+                        worker_rss and max(worker_rss) or None)
+                    if change > 0:
+                        pool.add_worker()
+                    elif change < 0:
+                        surplus += 1
+
+                if kind == 'idle':
+                    continue
+                elif kind == 'progress':
+                    watch.progress(worker_id, data)
+                    continue
+                elif kind == 'memory':
+                    worker_memory[worker_id] = data
+                    continue
+                elif kind == 'ready':
+                    if startup.ready(worker_id):
+                        print "INFO: {0}".format(startup.describe())
+                elif kind in ('result', 'cancelled'):
+                    watch.finished(worker_id)
+                    joblist_index = running[worker_id].popleft()
+                    joblist_indexes.done([joblist_index])
+                    current_job = self.joblist[joblist_index]
+                    if kind == 'cancelled':
+                        cancelled += 1
+                    elif data:
+                        self.multiproc_report_result(current_job, data)
+                        if self.timings:
+                            self.timings.record_all(
+                                collect_timings(current_job))
+                    self.multiproc_job_done(current_job)
+                    if not stopping and self.multiproc_failures_exceeded(
+                            max_failures):
+                        stopping = True
+                        pool.cancel()
+                    if running[worker_id]:
+                        continue    # -- CHUNK: More results will follow.
+                    del running[worker_id]
+                elif kind == 'died':
+                    watch.finished(worker_id)
+                    joblist_indexes.release(worker_id)
+                    if startup.gone(worker_id):
+                        print "INFO: {0}".format(startup.describe())
+                    print "ERROR: WORKER{0} died unexpectedly{1}.".format(
+                        worker_id, data is not None and
+                        " (exitcode={0})".format(data) or "")
+                    given_up += requeue_lost_jobs(worker_id)
+                    dispatch_waiting()
+                    continue
+                elif kind == 'retire':
+                    # -- RECYCLING: The jobs that the worker still has
+                    #    (not answered) are handed out again.
+                    watch.finished(worker_id)
+                    joblist_indexes.release(worker_id)
+                    joblist_indexes.push_front(list(running.pop(worker_id,
+                                                                [])))
+                    if worker_id in waiting:
+                        waiting.remove(worker_id)
+                    retiring.add(worker_id)
+                    dispatch_waiting()
+                    continue
+                elif kind == 'done':
+                    joblist_indexes.release(worker_id)
+                    if worker_id in retiring:
+                        retiring.remove(worker_id)
+                        recycled += 1
+                        if joblist_indexes and not stopping:
+                            pool.replace(worker_id)
+                    elif running.get(worker_id):
+                        # -- WORKER FAILED: Stopped with jobs (exception).
+                        print ("ERROR: WORKER{0} stopped with {1} unfinished"
+                               " job(s).".format(worker_id,
+                                                 len(running[worker_id])))
+                        given_up += requeue_lost_jobs(worker_id)
+                        dispatch_waiting()
+                    continue
+
+                if surplus:
+                    # -- ADAPTIVE: Retire a worker when it needs a new job.
+                    surplus -= 1
+                    pool.stop(worker_id)
+                    continue
+                waiting.append(worker_id)
+                dispatch_waiting()
+        except KeyboardInterrupt:
+            self.aborted = True
+            pool.terminate()
+            print "\nABORTED: By user."
+        finally:
+            pool.join()
+            if thread_count:
+                self.teardown_thread_capture()
+                if self.event_loop:
+                    self.event_loop.close()
+                    self.event_loop = None
+            # -- PARTIAL RESULTS: Write reports of incomplete features, too.
+            for feature in self.multiproc_replay_order:
+                job_records = self.multiproc_replays.pop(id(feature), None) \
+                    or self.multiproc_feature_records.pop(
+                        feature.filename + feature.name, None)
+                self.replay_feature(feature, job_records)
+            self.multiproc_replay_order = []
+            for formatter in self.formatters:
+                formatter.close()
+            if self.multiproc_junit_writer:
+                self.multiproc_junit_writer.close()
+            if self.timings:
+                self.timings.flush()
+            if self.output_store.directory:
+                shutil.rmtree(self.output_store.directory, ignore_errors=True)
+
+        not_run = len(joblist_indexes) + given_up + cancelled + \
+                  sum(len(chunk) for chunk in running.values())
+        if recycled:
+            print "INFO: {0} worker(s) were recycled.".format(recycled)
+        if worker_memory:
+            print "INFO: {0}".format(
+                parallel.describe_worker_memory(worker_memory))
+        if stopping:
+            print ("INFO: Stopped after {0} failure(s), {1} job(s) were"
+                   " not run.".format(self.multiproc_metrics['scenarios_failed'],
+                                      not_run))
+        elif not_run and not self.aborted:
+            print "ERROR: {0} job(s) were not run.".format(not_run)
+            self.aborted = True
 
-        self.joblist_index_queue = multiprocessing.Manager().JoinableQueue()
-        self.resultsqueue = multiprocessing.Manager().JoinableQueue()
+        self.run_hook('after_all', self.context)
+        failed = self.multiproc_fullreport()
+        return failed or self.aborted
 
+    def build_joblist(self):
+        """
+        Split the features into the jobs of a parallel run.
+        Only scenarios that are selected (by location, tags and name) become
+        jobs, a feature job is only created if any of its scenarios is.
+
+        :return: Tuple (scenario_count, feature_count, deselected_count):
+            Number of scenario and feature jobs, and the number of
+            scenarios that were not selected.
+        """
         self.joblist = []
+        self.multiproc_pending_jobs = collections.defaultdict(int)
         scenario_count = 0
         feature_count = 0
+        deselected_count = 0
         for feature in self.features:
-            if self.parallel_element == 'feature' or 'serial' in feature.tags:
+            selected = select_scenarios(feature, self.config)
+            deselected_count += len(feature.walk_scenarios()) - len(selected)
+            if not selected:
+                continue
+            elif self.parallel_element == 'feature' or \
+                    'serial' in feature.tags:
                 self.joblist.append(feature)
-                self.joblist_index_queue.put(feature_count + scenario_count)
                 feature_count += 1
                 continue
-            for scenario in feature.scenarios:
-                if scenario.type == 'scenario':
-                    self.joblist.append(scenario)
-                    self.joblist_index_queue.put(
-                        feature_count + scenario_count)
-                    scenario_count += 1
-                else:
-                    for subscenario in scenario.scenarios:
-                        self.joblist.append(subscenario)
-                        self.joblist_index_queue.put(
-                            feature_count + scenario_count)
-                        scenario_count += 1
-
-        proc_count = int(getattr(self.config, 'proc_count'))
-        print ("INFO: {0} scenario(s) and {1} feature(s) queued for"
-                " consideration by {2} workers. Some may be skipped if the"
-                " -t option was given..."
-               .format(scenario_count, feature_count, proc_count))
-        time.sleep(2)
-
-        procs = []
-        for i in range(proc_count):
-            p = multiprocessing.Process(target=self.worker, args=(i, ))
-            procs.append(p)
-            p.start()
-        [p.join() for p in procs]
+            self.joblist.extend(selected)
+            scenario_count += len(selected)
+            # -- NEEDED-FOR: Reports, written when all jobs are done.
+            uniquekey = feature.filename + feature.name
+            self.multiproc_pending_jobs[uniquekey] = len(selected)
+        return (scenario_count, feature_count, deselected_count)
+
+    def build_job_resources(self):
+        """
+        Find the limited resources that each job uses. A tag with a number
+        (like "@db:2") limits how many jobs with this tag may run at the
+        same time (across all workers). A limit that is given with --tags
+        (like: --tags=@db:2) is used instead of the number in the tags.
 
+        :return: Tuple (resources, limits) for :class:`parallel.JobQueue`.
+        """
+        tag_limits = self.config.tags.limits
+        limits = {}
+        resources = {}
+        for joblist_index, job in enumerate(self.joblist):
+            if job.type == 'feature':
+                tags = set(job.tags)
+                for scenario in job.walk_scenarios():
+                    tags.update(scenario.effective_tags)
+            else:
+                tags = job.effective_tags
+            names = set()
+            for tag in tags:
+                try:
+                    name, limit = split_tag_limit(tag)
+                except ValueError:
+                    continue
+                if name in tag_limits:
+                    names.add(name)
+                elif limit is not None and name not in self.reserved_tag_limits:
+                    names.add(name)
+                    limits[name] = min(limit, limits.get(name, limit))
+            if names:
+                resources[joblist_index] = sorted(names)
+        limits.update(tag_limits)
+        return (resources, limits)
+
+    def build_job_groups(self):
+        """
+        Group the jobs for affinity scheduling (--affinity): By feature,
+        or by the first tag that starts with a prefix ("tag:PREFIX").
+
+        :return: Group of each job (by job index), or None.
+        """
+        affinity = getattr(self.config, 'affinity')
+        if not affinity:
+            return None
+        prefix = None
+        if affinity.startswith('tag:'):
+            prefix = affinity[4:]
+        groups = {}
+        for joblist_index, job in enumerate(self.joblist):
+            feature = job
+            tags = job.tags
+            if job.type != 'feature':
+                feature = job.feature
+                tags = job.effective_tags
+            group = feature.filename
+            if prefix is not None:
+                for tag in tags:
+                    if tag.startswith(prefix):
+                        group = u'@' + tag
+                        break
+            groups[joblist_index] = group
+        return groups
+
+    def agent_hello(self):
+        """
+        :return: Greeting for agents (and forked workers): They use the
+            same parallel element and job order as this runner.
+        """
+        return dict(parallel_element=self.parallel_element,
+                    junit=bool(getattr(self.config, 'junit')),
+                    job_keys=[make_timing_key(job) for job in self.joblist])
+
+    def run_agent(self):
+        """
+        Run as agent of a distributed test run (--agent): Connect to the
+        coordinator and run the jobs that it serves, with --processes
+        connections (worker processes) in parallel.
+        """
+        proc_count = getattr(self.config, 'proc_count') or 1
+        if proc_count == 'auto':
+            proc_count = parallel.cpu_count()
+        proc_count = int(proc_count)
+        recycling = getattr(self.config, 'max_jobs_per_worker') or \
+                    getattr(self.config, 'max_worker_rss')
+        if proc_count == 1 and not recycling:
+            failed = self.agent_worker()
+        else:
+            procs = [self.start_agent_process() for i in range(proc_count)]
+            failed = False
+            while procs:
+                time.sleep(0.1)
+                for proc in [proc for proc in procs if not proc.is_alive()]:
+                    procs.remove(proc)
+                    proc.join()
+                    if proc.exitcode == self.retired_exitcode:
+                        # -- RECYCLING: Fresh worker connects again.
+                        procs.append(self.start_agent_process())
+                    elif proc.exitcode:
+                        failed = True
         self.run_hook('after_all', self.context)
-        return self.multiproc_fullreport()
+        return failed
 
-    def worker(self, proc_number):
-        while 1:
-            try:
-                joblist_index = self.joblist_index_queue.get_nowait()
-            except Exception, e:
+    def start_agent_process(self):
+        proc = multiprocessing.Process(target=self.agent_process)
+        with parallel.frozen_heap():
+            proc.start()
+        return proc
+
+    def agent_process(self):
+        sys.exit(self.agent_worker())
+
+    def agent_worker(self, address=None, ticket=None):
+        address = address or getattr(self.config, 'agent')
+        try:
+            channel = distributed.AgentChannel.connect(address, ticket)
+        except (socket.error, EOFError), e:
+            print "ERROR: Cannot connect to coordinator {0}: {1}".format(
+                address, e)
+            return 1
+        if ticket is not None:
+            # -- FORK SERVER: The parent kills a stuck worker by its pid.
+            channel.send('pid', os.getpid())
+
+        # -- SAME JOBS: Use the job order (and indexes) of the coordinator.
+        self.parallel_element = channel.hello['parallel_element']
+        self.config.junit = channel.hello['junit']
+        self.build_joblist()
+        jobs = dict((make_timing_key(job), job) for job in self.joblist)
+        job_keys = channel.hello['job_keys']
+        unknown = [key for key in job_keys if key not in jobs]
+        if unknown:
+            print ("ERROR: Agent does not know {0} job(s) of the coordinator"
+                   " (first: {1}). Use the same sources and arguments."
+                   .format(len(unknown), unknown[0]))
+            channel.close()
+            return 1
+        self.joblist = [jobs[key] for key in job_keys]
+
+        try:
+            self.worker(channel.worker_id, channel)
+            channel.send('done')
+        finally:
+            channel.close()
+        if self.worker_retired:
+            return self.retired_exitcode
+        return 0
+
+    def uses_fork_server(self):
+        """
+        Indicates if the workers of this run are forked by a fork server
+        (--fork-server, for --processes only).
+        """
+        return bool(multiprocessing and getattr(self.config, 'fork_server')
+                    and getattr(self.config, 'proc_count')
+                    and not (getattr(self.config, 'thread_count') or
+                             getattr(self.config, 'coordinator') or
+                             getattr(self.config, 'agent')))
+
+    def preload_modules(self):
+        failures = forkserver.import_modules(getattr(self.config, 'preload')
+                                             or [])
+        for name, error in failures:
+            print "ERROR: Cannot preload module {0}: {1}".format(name, error)
+
+    def prepare_template(self):
+        """
+        Prepare the template process of the fork server: It has the hooks
+        and step definitions, preloads modules and parses the features,
+        so that the workers (forked from it) start with all of them.
+        """
+        self.preload_modules()
+        self.setup_capture()
+        def do_nothing(obj2, obj3):
+            pass
+        self.context._emit_warning = do_nothing
+        self.features.extend(self.collect_features(verbose=False))
+
+    def template_worker(self, address, ticket):
+        """
+        Run a worker that was forked by the fork server.
+
+        :param ticket: Ticket that admits the worker (once) to the pool.
+        :return: Exit code of the worker.
+        """
+        return self.agent_worker(address, ticket)
+
+    def thread_worker(self, proc_number, channel):
+        self.make_thread_runner().worker(proc_number, channel)
+
+    def make_thread_runner(self):
+        """
+        Provide the runner of a worker thread (--threads). It shares hooks
+        and step definitions with this runner, but has its own context,
+        configuration (outputs, formatters) and capture. The context
+        attributes that were set by before_all are copied.
+        """
+        runner = copy.copy(self)
+        runner.config = copy.copy(self.config)
+        runner.undefined = []
+        runner.feature = None
+        runner.formatters = None
+        runner.context = Context(runner)
+        runner.context._root.update(self.context._root)
+        runner.context._root['config'] = runner.config
+        runner.context._record.update(self.context._record)
+        runner.context._origin.update(self.context._origin)
+        runner.context._emit_warning = self.context._emit_warning
+        return runner
+
+    def worker(self, proc_number, channel):
+        # -- PER WORKER: Set up resources once, reuse them for all its jobs.
+        self.run_hook('before_worker', self.context, proc_number)
+        try:
+            self.run_jobs(proc_number, channel)
+        finally:
+            self.run_hook('after_worker', self.context, proc_number)
+
+    def run_jobs(self, proc_number, channel):
+        self.progress_channel = channel
+        affinity = getattr(self.config, 'affinity')
+        job_count = 0
+        channel.send('ready')
+        while not self.worker_retired:
+            chunk = channel.receive()
+            if chunk is None:
                 break
-            current_job = self.joblist[joblist_index]
-            writebuf = StringIO.StringIO()
-            self.setfeature(current_job)
-            self.config.outputs = []
-            self.config.outputs.append(StreamOpener(stream=writebuf))
+            # -- ALWAYS: Answer each job, the parent sends the next chunk
+            #    after the last result of this chunk (unless it retires).
+            for joblist_index in chunk:
+                if channel.cancelled():
+                    # -- FAIL-FAST: Too many failures in any worker.
+                    channel.send('cancelled')
+                    continue
+                current_job = self.joblist[joblist_index]
+                if affinity:
+                    self.switch_feature(current_job.type != 'feature' and
+                                        current_job.feature or None)
+                self.progress_job = current_job
+                results = self.run_job(proc_number, current_job)
+                channel.send('result', results)
+                job_count += 1
+                self.worker_retired = self.worker_retire_reason(job_count)
+                if self.worker_retired:
+                    channel.send('retire', self.worker_retired)
+                    break
+        if affinity:
+            self.switch_feature(None)
+        if not isinstance(sys.stdout, parallel.ThreadLocalStream):
+            # -- COPY-ON-WRITE: How much of its memory the worker shares.
+            memory = parallel.process_memory()
+            if memory:
+                channel.send('memory', memory)
+
+    def worker_retire_reason(self, job_count):
+        """
+        Worker recycling: A worker retires after a job, if it has run
+        --max-jobs-per-worker jobs or its memory (RSS) exceeds
+        --max-worker-rss megabytes. A fresh worker takes its place.
 
-            stream_openers = self.config.outputs
+        :param job_count: Number of jobs that this worker has run.
+        :return: Reason to retire (as string), or None.
+        """
+        max_jobs = getattr(self.config, 'max_jobs_per_worker')
+        if max_jobs and job_count >= max_jobs:
+            return "{0} jobs".format(job_count)
+        max_rss = getattr(self.config, 'max_worker_rss')
+        if max_rss and not isinstance(sys.stdout, parallel.ThreadLocalStream):
+            # -- WORKER THREADS: Share the memory of their process.
+            rss = parallel.process_rss()
+            if rss is not None and rss > max_rss * 1024 * 1024:
+                return "RSS {0} MB".format(rss // (1024 * 1024))
+        return None
+
+    def switch_feature(self, feature):
+        """
+        Affinity scheduling (--affinity): Run the feature hooks only once
+        for all the scenarios of a feature that a worker runs in a row,
+        so the scenarios can share the feature setup.
 
-            self.formatters = formatters.get_formatter(self.config, stream_openers)
+        :param feature: Feature of the next scenario job (or None).
+        """
+        if feature is self.worker_feature:
+            return
+        previous = self.worker_feature
+        if previous is not None:
+            if self.feature_hooks_apply(previous):
+                self.run_hook('after_feature', self.context, previous)
+                for tag in previous.tags:
+                    self.run_hook('after_tag', self.context, tag)
+            self.context._pop()
+        self.worker_feature = feature
+        if feature is not None:
+            self.context._push()
+            self.context.feature = feature
+            self.context.tags = set(feature.tags)
+            if self.feature_hooks_apply(feature):
+                for tag in feature.tags:
+                    self.run_hook('before_tag', self.context, tag)
+                self.run_hook('before_feature', self.context, feature)
+
+    def feature_hooks_apply(self, feature):
+        return not self.config.dry_run and feature.should_run(self.config)
+
+    def run_job(self, proc_number, current_job):
+        """
+        Run one job (feature or scenario) in a worker process.
 
-            for formatter in self.formatters:
-                formatter.uri(current_job.filename)
+        :return: Job record (see :mod:`behave.jobrecord`) or None,
+            if nothing was reported.
+        """
+        self.setfeature(current_job)
+        if current_job.type == 'feature':
+            tags = current_job.tags
+        else:
+            tags = current_job.effective_tags
+        retries = get_tag_limit(tags, 'retry', getattr(self.config, 'retry'))
 
-            start_time = time.strftime("%Y-%m-%d %H:%M:%S")
+        attempts = 0
+        start_time = time.time()
+        while True:
+            attempts += 1
+            recorder = jobrecord.JobRecorder(current_job, self.output_store)
+            self.formatters = [recorder]
             current_job.run(self)
-            end_time = time.strftime("%Y-%m-%d %H:%M:%S")
-
-            sys.stderr.write(current_job.status[0]+"\n")
-
-            if current_job.type == 'feature':
-                for reporter in self.config.reporters:
-                    reporter.feature(current_job)
-
-            self.clean_buffer(writebuf)
-            job_report_text = self.generatereport(
-                proc_number, current_job,
-                start_time, end_time, writebuf)
-
-            if job_report_text:
-                results = dict()
-                results['steps_passed'] = 0
-                results['steps_failed'] = 0
-                results['steps_skipped'] = 0
-                results['steps_undefined'] = 0
-                results['steps_untested'] = 0
-                results['jobtype'] = current_job.type
-                results['reportinginfo'] = job_report_text
-                results['status'] = current_job.status
-                if current_job.type != 'feature':
-                    results['uniquekey'] = \
-                    current_job.filename + current_job.feature.name
-                else:
-                    results['scenarios_passed'] = 0
-                    results['scenarios_failed'] = 0
-                    results['scenarios_skipped'] = 0
-                    self.countscenariostatus(current_job, results)
-                self.countstepstatus(current_job, results)
-                if current_job.type != 'feature' and \
-                    getattr(self.config, 'junit'):
-                        results['junit_report'] = \
-                        self.generate_junit_report(current_job, writebuf)
-                self.resultsqueue.put(results)
+            if current_job.status != 'failed' or attempts > (retries or 0) \
+                    or self.aborted:
+                break
+            # -- RETRY: Run the failed job again (hooks and imports are warm),
+            #    only the last attempt is reported.
+            self.reset_job(current_job)
+        end_time = time.time()
+
+        sys.stderr.write(current_job.status[0]+"\n")
+        record = recorder.make_record(proc_number, start_time, end_time)
+        if record is not None:
+            record['attempts'] = attempts
+        return record
+
+    @staticmethod
+    def reset_job(current_job):
+        """
+        Reset the results of a job that was run, so it can run again.
+        Skipped scenarios (by location) and outline rows stay as they are.
+        """
+        current_job._cached_status = None
+        if current_job.type == 'feature':
+            scenarios = current_job.walk_scenarios(with_outlines=True)
+        else:
+            scenarios = [current_job]
+        for scenario in scenarios:
+            scenario._cached_status = None
+            if scenario.type == 'scenario_outline':
+                continue
+            scenario.was_dry_run = False
+            scenario.stdout = None
+            scenario.stderr = None
+            for step in scenario.all_steps:
+                step.reset()
+
+    def report_progress(self, name, statement):
+        """
+        Tell the parent process which scenario/step starts (or which step
+        ends) in this worker, so it can kill the worker if it exceeds its
+        timeout and knows which step hung. A scenario timeout can be set per
+        feature/scenario by tag (like: @timeout:120), otherwise
+        --scenario-timeout/--step-timeout are used. Without any timeout,
+        nothing is reported.
+        """
+        step_timeout = getattr(self.config, 'step_timeout')
+        if name == 'before_scenario':
+            timeout = get_tag_limit(statement.effective_tags, 'timeout',
+                                    getattr(self.config, 'scenario_timeout'))
+            self.progress_scenario = None
+            if not (timeout or step_timeout):
+                return
+            self.progress_scenario = statement
+            index = None
+            if self.progress_job is not None:
+                scenarios = list(jobrecord.job_scenarios(self.progress_job))
+                index = index_of(statement, scenarios)
+            self.progress_channel.send('progress', ['scenario', statement.name,
+                                                    float(timeout or 0),
+                                                    index])
+            return
+
+        if self.progress_scenario is None:
+            return
+        index = index_of(statement, list(self.progress_scenario.all_steps))
+        if index is None:
+            return  # -- NESTED STEP: Part of the step that executes it.
+        if name == 'before_step':
+            self.progress_channel.send('progress', ['step', statement.name,
+                                                    float(step_timeout or 0),
+                                                    index])
+        else:
+            self.progress_channel.send('progress', ['step_done', index])
+
+    def make_timeout_record(self, proc_number, current_job, error,
+                            position=None):
+        """
+        Provide the job record of a job whose worker was killed (timeout):
+        The step that hung failed with the timeout error, the steps before
+        it passed, the steps after it are skipped. The scenarios of a feature
+        before it are skipped (their results were lost with the worker),
+        the scenarios after it are untested.
+
+        :param position: Tuple (scenario_index, step_index, step_done) of
+            the last progress of the worker (see :class:`TimeoutWatch`).
+            If a hook after a step hung, the next step fails (or the last
+            step). Without a known step, the first step of the scenario
+            fails (a hook before it hung).
+        """
+        now = time.time()
+        scenarios = []
+        events = []
+        if current_job.type == 'feature':
+            events.append(['feature'])
+            if current_job.background:
+                events.append(['background'])
+        job_scenarios = list(jobrecord.job_scenarios(current_job))
+        scenario_index, step_index, step_done = position or (0, None, False)
+        if scenario_index is None or scenario_index >= len(job_scenarios):
+            scenario_index = 0
+        for index, scenario in enumerate(job_scenarios):
+            step_count = len(list(scenario.all_steps))
+            if index != scenario_index:
+                code = index < scenario_index and 's' or 'n'
+                scenarios.append([code, code * step_count, False, None, None])
+                continue
+            failed = step_index or 0
+            if step_done and failed + 1 < step_count:
+                failed += 1
+            failed = min(failed, max(step_count - 1, 0))
+            step_codes = ('p' * failed + 'f' +
+                          's' * (step_count - failed - 1))[:step_count]
+            scenarios.append(['f', step_codes, False, None, None])
+            events.append(['scenario', index])
+            events.extend(['step', step] for step in range(step_count))
+            for step in range(failed):
+                events.append(['match'])
+                events.append(['result', step, 'passed', 0.0, None, None])
+            if step_count:
+                events.append(['match'])
+                events.append(['result', failed, 'failed', 0.0, error,
+                               ['Timeout', error]])
+        if current_job.type == 'feature':
+            events.append(['eof'])
+        return dict(worker=proc_number, start=now, end=now,
+                    scenarios=scenarios, events=events, error=error)
 
     def setfeature(self, current_job):
         if current_job.type == 'feature':
@@ -758,7 +1635,33 @@ class Runner(object):
         else:
             self.feature = current_job.feature
 
-    def generatereport(self, proc_number, current_job, start_time, end_time, writebuf):
+    def render_job_report(self, current_job, record):
+        """
+        Render the report of a job from its (applied) job record.
+
+        :return: Report text.
+        """
+        if 'error' in record:
+            # -- WORKER KILLED: Its job report is not known.
+            return u"{0}|WORKER{1} KILLED|status:failed|{2}\n" \
+                u"{3}: {4}\n{5}".format(format_time(record['end']),
+                                      record['worker'], current_job.filename,
+                                      current_job.keyword, current_job.name,
+                                      record['error'])
+
+        writebuf = StringIO.StringIO()
+
+        report_formatter = PlainFormatter(StreamOpener(stream=writebuf),
+                                          self.config)
+        jobrecord.replay_record(current_job, record, [report_formatter])
+        self.clean_buffer(writebuf)
+        return self.generatereport(
+            record['worker'], current_job, format_time(record['start']),
+            format_time(record['end']), writebuf,
+            attempts=record.get('attempts', 1))
+
+    def generatereport(self, proc_number, current_job, start_time, end_time,
+                       writebuf, attempts=1):
         if not writebuf.pos:
             return u""
 
@@ -768,8 +1671,10 @@ class Runner(object):
         reportfooter = end_time + "|WORKER" + str(proc_number) + " END|" + \
         "status:" + current_job.status + "|" + current_job.filename + \
         "|Duration:" + str(current_job.duration)
+        if attempts > 1:
+            reportfooter += "|Attempts:" + str(attempts)
 
-        if self.config.format[0] == 'plain' and len(current_job.tags):
+        if len(current_job.tags):
             tags = "@"
             for tag in current_job.tags:
                 tags += tag + " "
@@ -818,43 +1723,120 @@ class Runner(object):
             for step in current_job.all_steps:
                 results['steps_' + step.status] += 1
 
-    def multiproc_fullreport(self):
-        metrics = collections.defaultdict(int)
-        combined_features_from_scenarios_results = collections.defaultdict(lambda: '')
-        junit_report_objs = []
-        while not self.resultsqueue.empty():
+    def multiproc_report_result(self, current_job, record):
+        jobrecord.apply_record(current_job, record, self.output_store)
+        attempts = record.get('attempts', 1)
+        if attempts > 1:
+            self.multiproc_retried_jobs.append((current_job, attempts))
+        if self.multiproc_print_reports:
+            report_text = self.render_job_report(current_job, record)
             print "\n" * 3
             print "_" * 75
-            jobresult = self.resultsqueue.get()
-
             try:
-                print self.to_unicode(jobresult['reportinginfo'])
+                print self.to_unicode(report_text)
             except Exception as e:
                 logging.info(e)
+            sys.stdout.flush()
+
+        metrics = self.multiproc_metrics
+        if current_job.type != 'feature':
+            uniquekey = current_job.filename + current_job.feature.name
+            self.multiproc_feature_statuses[uniquekey].add(current_job.status)
+            self.multiproc_feature_records[uniquekey].append(
+                (current_job, record))
+            metrics['scenarios_' + current_job.status] += 1
+            if self.multiproc_junit_writer:
+                self.multiproc_junit_writer.add_scenario(current_job)
+        else:
+            metrics['features_' + current_job.status] += 1
+            self.countscenariostatus(current_job, metrics)
+            self.replay_in_order(current_job, [(current_job, record)])
+            if self.multiproc_junit_writer:
+                self.multiproc_junit_writer.write_feature(current_job)
+        self.countstepstatus(current_job, metrics)
+
+    def multiproc_job_done(self, current_job):
+        if current_job.type == 'feature':
+            return
+        uniquekey = current_job.filename + current_job.feature.name
+        self.multiproc_pending_jobs[uniquekey] -= 1
+        if self.multiproc_pending_jobs[uniquekey] == 0:
+            # -- LAST JOB OF FEATURE: Replay it, complete its JUnit report.
+            self.replay_in_order(current_job.feature,
+                self.multiproc_feature_records.pop(uniquekey, []))
+            if self.multiproc_junit_writer:
+                self.multiproc_junit_writer.end_feature(current_job.feature)
+
+    def formatters_use_stdout(self):
+        """Indicates if any formatter writes to stdout."""
+        outputs = self.config.outputs
+        for index, formatter in enumerate(self.formatters):
+            if formatter.name == 'null':
+                continue
+            if index >= len(outputs) or not outputs[index].name:
+                return True
+        return False
 
-            if 'junit_report' in jobresult:
-                junit_report_objs.append(jobresult['junit_report'])
-            if jobresult['jobtype'] != 'feature':
-                combined_features_from_scenarios_results[
-                    jobresult['uniquekey']] += '|' + jobresult['status']
-                metrics['scenarios_' + jobresult['status']] += 1
-            else:
-                metrics['features_' + jobresult['status']] += 1
+    def build_replay_order(self):
+        """
+        :return: Features of the jobs in file order (order of the reports).
+        """
+        used = set(id(job.type == 'feature' and job or job.feature)
+                   for job in self.joblist)
+        return [feature for feature in self.features if id(feature) in used]
 
-            metrics['steps_passed'] += jobresult['steps_passed']
-            metrics['steps_failed'] += jobresult['steps_failed']
-            metrics['steps_skipped'] += jobresult['steps_skipped']
-            metrics['steps_undefined'] += jobresult['steps_undefined']
+    def replay_in_order(self, feature, job_records):
+        """
+        Replay a feature (when all its jobs are done) and the features
+        after it that are done, as soon as all features before it are.
+        """
+        self.multiproc_replays[id(feature)] = job_records
+        order = self.multiproc_replay_order
+        while order and id(order[0]) in self.multiproc_replays:
+            feature = order.pop(0)
+            self.replay_feature(feature,
+                                self.multiproc_replays.pop(id(feature)))
+
+    def replay_feature(self, feature, job_records):
+        """
+        Replay the formatter events of the job records of a feature to the
+        formatters, the scenario jobs in the order of the feature file.
+
+        :param job_records: List of (job, job record) tuples.
+        """
+        if not job_records:
+            return
+        for formatter in self.formatters:
+            formatter.uri(feature.filename)
+        if job_records[0][0] is feature:
+            # -- FEATURE JOB: Its record contains all formatter events.
+            jobrecord.replay_record(feature, job_records[0][1],
+                                    self.formatters)
+            return
+
+        order = dict((id(scenario), index) for index, scenario
+                     in enumerate(feature.walk_scenarios()))
+        job_records = sorted(job_records,
+                             key=lambda job_record: order[id(job_record[0])])
+        for formatter in self.formatters:
+            formatter.feature(feature)
+            if feature.background:
+                formatter.background(feature.background)
+        for job, record in job_records:
+            jobrecord.replay_record(job, record, self.formatters)
+        for formatter in self.formatters:
+            formatter.eof()
 
-            if jobresult['jobtype'] == 'feature':
-                metrics['scenarios_passed'] += jobresult['scenarios_passed']
-                metrics['scenarios_failed'] += jobresult['scenarios_failed']
-                metrics['scenarios_skipped'] += jobresult['scenarios_skipped']
+    def multiproc_failures_exceeded(self, max_failures):
+        return max_failures and \
+            self.multiproc_metrics['scenarios_failed'] >= max_failures
 
-        for uniquekey in combined_features_from_scenarios_results:
-            if 'failed' in combined_features_from_scenarios_results[uniquekey]:
+    def multiproc_fullreport(self):
+        metrics = self.multiproc_metrics
+        for statuses in self.multiproc_feature_statuses.values():
+            if 'failed' in statuses:
                 metrics['features_failed'] += 1
-            elif 'passed' in combined_features_from_scenarios_results[uniquekey]:
+            elif 'passed' in statuses:
                 metrics['features_passed'] += 1
             else:
                 metrics['features_skipped'] += 1
@@ -868,165 +1850,34 @@ class Runner(object):
                 metrics['features_passed'], metrics['features_failed'], metrics['features_skipped'],
                 metrics['scenarios_passed'], metrics['scenarios_failed'], metrics['scenarios_skipped'],
                 metrics['steps_passed'], metrics['steps_failed'], metrics['steps_skipped'], metrics['steps_undefined'])
-        if getattr(self.config,'junit'):
-            self.write_paralleltestresults_to_junitfile(junit_report_objs)
+        self.print_retry_summary()
         return metrics['features_failed']
 
-    def generate_junit_report(self, cj, writebuf):
-        report_obj = {} 
-        report_string = u""
-        report_obj['filebasename'] = cj.location.basename()[:-8]
-        report_obj['feature_name'] = cj.feature.name        
-        report_obj['status'] = cj.status
-        report_obj['duration'] = round(cj.duration,4)
-        report_string += '<testcase classname="'
-        report_string += report_obj['filebasename']+'.'
-        report_string += report_obj['feature_name']+'" '
-        report_string += 'name="'+cj.name+'" '
-        report_string += 'status="'+cj.status+'" '
-        report_string += 'time="'+str(round(cj.duration,4))+'">'
-        if cj.status == 'failed':
-            report_string += self.get_junit_error(cj, writebuf)
-        report_string += "<system-out>\n<![CDATA[\n"
-        report_string += "@scenario.begin\n"   
-        writebuf.seek(0)
-        loglines = writebuf.readlines()
-        report_string += loglines[1]
-        for step in cj.all_steps:
-            report_string += " "*4
-            report_string += step.keyword + " "
-            report_string += step.name + " ... "
-            report_string += step.status + " in "
-            report_string += str(round(step.duration,4)) + "s\n"
-        report_string += "\n@scenario.end\n"
-        report_string += "-"*80 
-        report_string += "\n"
-
-        report_string += self.get_junit_stdoutstderr(cj,loglines)
-        report_string += "</testcase>"
-        report_obj['report_string'] = report_string
-        return report_obj
-
-    def get_junit_stdoutstderr(self, cj, loglines):
-        substring = ""
-        if cj.status == 'passed':
-            substring += "\nCaptured stdout:\n"
-            substring += cj.stdout
-            substring += "\n]]>\n</system-out>"
-            if cj.stderr:
-                substring += "<system-err>\n<![CDATA[\n"
-                substring += "Captured stderr:\n"
-                substring += cj.stderr
-                substring += "\n]]>\n</system-err>"
-            return substring
-
-        q = 0
-        while q < len(loglines):
-            if loglines[q] == "Captured stdout:\n":
-                while q < len(loglines) and \
-                        loglines[q] != "Captured stderr:\n":
-                    substring += loglines[q]
-                    q += 1
-                break       
-            q += 1
-
-        substring += "]]>\n</system-out>"
-
-        if q < len(loglines):
-            substring += "<system-err>\n<![CDATA[\n"
-            while q < len(loglines):
-                substring += loglines[q]
-                q = q + 1
-            substring += "]]>\n</system-err>"
-            
-        return substring
-
-        
-    def get_junit_error(self, cj, writebuf):
-        failed_step = None
-        error_string = u""
-        error_string += '<error message="'
-        for step in cj.steps:
-            if step.status == 'failed':
-                failed_step = step
-                break
-
-        if not failed_step:
-            error_string += "Unknown Error" '" type="AttributeError">\n'
-            error_string += "Failing step: Unknown\n"
-            error_string += "<![CDATA[\n"
-            error_string += "]]>\n"
-            error_string += "</error>"
-            return error_string
-
-        try:
-            error_string += failed_step.exception[0]+'" '
-        except Exception:
-            error_string += 'No Exception" '
-
-        error_string += 'type="'
-        error_string += re.sub(".*?\.(.*?)\'.*","\\1",\
-        str(type(failed_step.exception)))+'">\n'
-        error_string += "Failing step: "
-        error_string += failed_step.name + " ... failed in "
-        error_string += str(round(failed_step.duration,4))+"s\n"
-        error_string += "Location: " + str(failed_step.location)
-        error_string += "<![CDATA[\n"
-        error_string += failed_step.error_message 
-        error_string += "]]>\n</error>"
-        return error_string
-
-    def write_paralleltestresults_to_junitfile(self,junit_report_objs): 
-        feature_reports = {}
-        for jro in junit_report_objs:
-            #NOTE: There's an edge-case where this key would not be unique
-            #Where a feature has the same filename and feature name but
-            #different directory.
-            uniquekey = jro['filebasename']+"."+jro['feature_name']
-            if uniquekey not in feature_reports:
-                newfeature = {}
-                newfeature['duration'] = float(jro['duration'])
-                newfeature['statuses'] = jro['status']
-                newfeature['filebasename'] = jro['filebasename']
-                newfeature['total_scenarios'] = 1
-                newfeature['data'] = jro['report_string']
-                feature_reports[uniquekey] = newfeature 
-            else:
-                feature_reports[uniquekey]['duration'] += float(jro['duration'])
-                feature_reports[uniquekey]['statuses'] += jro['status']
-                feature_reports[uniquekey]['total_scenarios'] += 1
-                feature_reports[uniquekey]['data'] += jro['report_string']
-
-        for uniquekey in feature_reports.keys(): 
-            filedata = u"<?xml version='1.0' encoding='UTF-8'?>\n"
-            filedata += '<testsuite errors="'
-            filedata += unicode(len(re.findall\
-            ("failed",feature_reports[uniquekey]['statuses'])))
-            filedata += '" failures="0" name="'
-            filedata += uniquekey+'" '
-            filedata += 'skipped="'
-            filedata += unicode(len(re.findall\
-            ("skipped",feature_reports[uniquekey]['statuses'])))
-            filedata += '" tests="'
-            filedata += unicode(feature_reports[uniquekey]['total_scenarios'])
-            filedata += '" time="'
-            filedata += unicode(round(feature_reports[uniquekey]['duration'],4))
-            filedata += '">'
-            filedata += "\n\n"
-            filedata += feature_reports[uniquekey]['data']
-            filedata += "</testsuite>"
-            outputdir = "reports"
-            custdir = getattr(self.config,'junit_directory')
-            if custdir:
-                outputdir = custdir
-            if not os.path.exists(outputdir):
-                os.makedirs(outputdir)
-            filename = outputdir+"/"+"TESTS-"
-            filename += feature_reports[uniquekey]['filebasename']
-            filename += ".xml"
-            fd = open(filename,"w")
-            fd.write(filedata.encode('utf8'))
-            fd.close() 
+    def print_retry_summary(self):
+        """
+        Print the jobs that were retried (--retry, @retry:N): Flaky jobs
+        passed after a retry, the others failed in each attempt.
+        """
+        flaky = [(job, attempts) for job, attempts in self.multiproc_retried_jobs
+                 if job.status != 'failed']
+        failing = [(job, attempts)
+                   for job, attempts in self.multiproc_retried_jobs
+                   if job.status == 'failed']
+        for title, jobs in (("Flaky (passed after retry)", flaky),
+                            ("Failing in every attempt", failing)):
+            if not jobs:
+                continue
+            print "{0}:".format(title)
+            for job, attempts in jobs:
+                # -- SCENARIO OUTLINE: Show the line of the examples row.
+                row = getattr(job, '_row', None)
+                line = row is not None and row.line or job.line
+                print u"  {0}:{1}  {2}  ({3} attempts)".format(
+                    job.filename, line, job.name, attempts)
+            print
+        if self.multiproc_retried_jobs:
+            print "{0} job(s) retried: {1} flaky, {2} failing".format(
+                len(self.multiproc_retried_jobs), len(flaky), len(failing))
 
     def setup_capture(self):
         if self.config.stdout_capture:
@@ -1039,28 +1890,66 @@ class Runner(object):
 
         if self.config.log_capture:
             self.log_capture = LoggingCapture(self.config)
-            self.log_capture.inveigle()
+            if self.thread_log_capture:
+                self.thread_log_capture.redirect(self.log_capture)
+            else:
+                self.log_capture.inveigle()
             self.context.log_capture = self.log_capture
 
     def start_capture(self):
+        # -- WORKER THREADS: Only capture the output of the current thread.
         if self.config.stdout_capture:
-            self.old_stdout = sys.stdout
-            sys.stdout = self.stdout_capture
+            if isinstance(sys.stdout, parallel.ThreadLocalStream):
+                sys.stdout.redirect(self.stdout_capture)
+            else:
+                self.old_stdout = sys.stdout
+                sys.stdout = self.stdout_capture
 
         if self.config.stderr_capture:
-            self.old_stderr = sys.stderr
-            sys.stderr = self.stderr_capture
+            if isinstance(sys.stderr, parallel.ThreadLocalStream):
+                sys.stderr.redirect(self.stderr_capture)
+            else:
+                self.old_stderr = sys.stderr
+                sys.stderr = self.stderr_capture
 
     def stop_capture(self):
         if self.config.stdout_capture:
-            sys.stdout = self.old_stdout
+            if isinstance(sys.stdout, parallel.ThreadLocalStream):
+                sys.stdout.restore()
+            else:
+                sys.stdout = self.old_stdout
 
         if self.config.stderr_capture:
-            sys.stderr = self.old_stderr
+            if isinstance(sys.stderr, parallel.ThreadLocalStream):
+                sys.stderr.restore()
+            else:
+                sys.stderr = self.old_stderr
 
     def teardown_capture(self):
         if self.config.log_capture:
-            self.log_capture.abandon()
+            if self.thread_log_capture:
+                self.thread_log_capture.restore()
+            else:
+                self.log_capture.abandon()
+
+    def setup_thread_capture(self):
+        """
+        Prepare the capture for worker threads (--threads): Install proxies
+        for sys.stdout/sys.stderr and a logging handler, so each thread
+        can capture its own output (instead of swapping sys.stdout).
+        """
+        sys.stdout = parallel.ThreadLocalStream(sys.stdout)
+        sys.stderr = parallel.ThreadLocalStream(sys.stderr)
+        if self.config.log_capture:
+            self.thread_log_capture = ThreadLocalCapture(self.config)
+            self.thread_log_capture.inveigle()
+
+    def teardown_thread_capture(self):
+        sys.stdout = sys.stdout.stream
+        sys.stderr = sys.stderr.stream
+        if self.thread_log_capture:
+            self.thread_log_capture.abandon()
+            self.thread_log_capture = None
 
     def clean_buffer(self, buf):
         for i in range(len(buf.buflist)):
@@ -343,6 +343,97 @@ def collect_feature_locations(paths, strict=True):
     return locations
 
 
+def select_scenarios(feature, config):
+    """
+    Select the scenarios of a feature that will run, after the scenarios
+    are filtered by location (feature.filename:line), tags and name.
+    Scenario outlines are expanded into their scenarios.
+
+    :param feature: Feature to use.
+    :param config:  Configuration with tags and name selection.
+    :return: List of scenarios (in file order).
+    """
+    selected = []
+    for scenario in feature.walk_scenarios():
+        if not scenario.should_run(config):
+            continue
+        elif config.name and not config.name_re.search(scenario.name):
+            continue
+        selected.append(scenario)
+    return selected
+
+
+def keep_scenarios(features, scenarios):
+    """
+    Remove all scenarios from the features that are not given.
+    Scenario outlines keep only the given scenarios of their examples,
+    features without any remaining scenario are removed.
+
+    :param features:  List of features (modified).
+    :param scenarios: Scenarios to keep (outline scenarios, not outlines).
+    :return: List of remaining features.
+    """
+    keep = set(id(scenario) for scenario in scenarios)
+    remaining_features = []
+    for feature in features:
+        remaining = []
+        for scenario in feature.scenarios:
+            if scenario.type == 'scenario_outline':
+                outline_scenarios = [outline_scenario
+                                     for outline_scenario in scenario.scenarios
+                                     if id(outline_scenario) in keep]
+                if outline_scenarios:
+                    scenario._scenarios = outline_scenarios
+                    remaining.append(scenario)
+            elif id(scenario) in keep:
+                remaining.append(scenario)
+        if remaining:
+            feature.scenarios = remaining
+            remaining_features.append(feature)
+    return remaining_features
+
+
+def parse_shard(text):
+    """
+    Parse the shard of a run in "INDEX/COUNT" notation (like: "2/4"),
+    where INDEX counts from 1 to COUNT.
+
+    :param text: Shard description to parse.
+    :return: Tuple (index, count) with zero-based index.
+    :raises: ValueError, if the text is no valid shard.
+    """
+    parts = text.split("/")
+    if len(parts) != 2 or not parts[0].strip().isdigit() or \
+            not parts[1].strip().isdigit():
+        raise ValueError("Use INDEX/COUNT (like: 2/4), not '%s'" % text)
+    index, count = int(parts[0]), int(parts[1])
+    if not 1 <= index <= count:
+        raise ValueError("INDEX must be between 1 and %d, not %d" % \
+                         (count, index))
+    return (index - 1, count)
+
+
+def partition_by_duration(estimates, count):
+    """
+    Assign items to ``count`` partitions with about the same total duration:
+    The longest item goes to the partition with the smallest total first.
+    The result only depends on the estimates (and their order), so that
+    each shard of a run computes the same partitions.
+
+    :param estimates: Estimated duration of each item.
+    :param count:     Number of partitions.
+    :return: List with the partition index of each item.
+    """
+    totals = [0.0] * count
+    partitions = [None] * len(estimates)
+    order = sorted(range(len(estimates)), key=lambda index: -estimates[index])
+    for index in order:
+        partition = totals.index(min(totals))
+        partitions[index] = partition
+        totals[partition] += estimates[index]
+    return partitions
+
+
 def make_undefined_step_snippet(step, language=None):
     """
     Helper function to create an undefined-step snippet for a step.
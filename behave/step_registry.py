@@ -5,11 +5,69 @@ The step registry allows to match steps (model elements) with
 step implementations (step definitions). This is necessary to execute steps.
 """
 
+import re
+
 
 class AmbiguousStep(ValueError):
     pass
 
 
+class StepIndex(object):
+    """
+    Index of step definitions by the literal prefix of their patterns
+    (case-insensitive): A step name is only tried with the step definitions
+    whose first word is its first word and those without a known first word
+    (like patterns that start with a parameter), and only if it starts with
+    their literal prefix. The candidates keep the order of the step
+    definitions, so the first matching step definition still wins.
+
+    :param step_definitions: Step definitions (matchers) in lookup order.
+    """
+    first_word_pattern = re.compile(r"(\S+)\s", re.UNICODE)
+
+    def __init__(self, step_definitions):
+        self.step_definitions = step_definitions
+        self.buckets = {}
+        self.fallback = []
+        self.entries_by_word = {}
+        for position, step_definition in enumerate(step_definitions):
+            prefix = self.literal_prefix(step_definition)
+            entry = (position, prefix, step_definition)
+            match = self.first_word_pattern.match(prefix)
+            if match:
+                self.buckets.setdefault(match.group(1), []).append(entry)
+            else:
+                self.fallback.append(entry)
+
+    @staticmethod
+    def literal_prefix(step_definition):
+        """
+        :return: Literal prefix of a step definition (lowercase), that each
+            matching step name starts with (maybe empty).
+        """
+        literal_prefix = getattr(step_definition, "literal_prefix", None)
+        prefix = callable(literal_prefix) and literal_prefix()
+        if not isinstance(prefix, basestring):
+            return u""      # -- UNKNOWN MATCHER: Try it for all steps.
+        return prefix.lower()
+
+    def candidates(self, step_name):
+        """
+        :return: Step definitions that may match a step name (in order).
+        """
+        if not isinstance(step_name, basestring):
+            return self.step_definitions
+        step_name = step_name.lower()
+        words = step_name.split(None, 1)
+        word = words and words[0] or u""
+        entries = self.entries_by_word.get(word)
+        if entries is None:
+            entries = sorted(self.buckets.get(word, []) + self.fallback)
+            self.entries_by_word[word] = entries
+        return [step_definition for _, prefix, step_definition in entries
+                if step_name.startswith(prefix)]
+
+
 class StepRegistry(object):
     def __init__(self):
         self.steps = {
@@ -18,6 +76,8 @@ class StepRegistry(object):
             'then': [],
             'step': [],
         }
+        self.version = 0    # -- Changes with the step definitions.
+        self.indexes = {}
 
     @staticmethod
     def same_step_definition(step, other_string, other_location):
@@ -44,28 +104,41 @@ class StepRegistry(object):
                 existing_step += " at %s" % existing.location
                 raise AmbiguousStep(message % (new_step, existing_step))
         step_definitions.append(matchers.get_matcher(func, string))
+        self.steps_changed()
+
+    def steps_changed(self):
+        """
+        Invalidate the step indexes. Called when a step definition is added,
+        call it after changing the lists in ``steps`` directly.
+        """
+        self.version += 1
+
+    def get_index(self, step_type):
+        """
+        Provide the index of the step definitions for a step type (generic
+        step definitions included). It is rebuilt when the step definitions
+        changed (see :meth:`steps_changed`).
+        """
+        version_and_index = self.indexes.get(step_type)
+        if version_and_index is None or version_and_index[0] != self.version:
+            step_lists = [self.steps[step_type]]
+            if step_type != 'step':
+                step_lists.append(self.steps['step'])
+            step_definitions = [step_definition for step_list in step_lists
+                                for step_definition in step_list]
+            version_and_index = (self.version, StepIndex(step_definitions))
+            self.indexes[step_type] = version_and_index
+        return version_and_index[1]
 
     def find_step_definition(self, step):
-        candidates = self.steps[step.step_type]
-        more_steps = self.steps['step']
-        if step.step_type != 'step' and more_steps:
-            # -- ENSURE: self.step_type lists are not modified/extended.
-            candidates = list(candidates)
-            candidates += more_steps
-
+        candidates = self.get_index(step.step_type).candidates(step.name)
         for step_definition in candidates:
             if step_definition.match(step.name):
                 return step_definition
         return None
 
     def find_match(self, step):
-        candidates = self.steps[step.step_type]
-        more_steps = self.steps['step']
-        if step.step_type != 'step' and more_steps:
-            # -- ENSURE: self.step_type lists are not modified/extended.
-            candidates = list(candidates)
-            candidates += more_steps
-
+        candidates = self.get_index(step.step_type).candidates(step.name)
         for step_definition in candidates:
             result = step_definition.match(step.name)
             if result:
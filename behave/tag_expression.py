@@ -1,6 +1,38 @@
 # -*- coding: utf-8 -*-
 
 
+def split_tag_limit(tag):
+    """
+    Split a tag with a numeric value (like: "timeout:120") into its parts.
+
+    :param tag: Tag to split (without leading '@').
+    :return: Tuple (name, limit); limit is None for a plain tag.
+    :raises: ValueError, if the value is not a number.
+    """
+    name, sep, value = tag.partition(':')
+    if not sep:
+        return (name, None)
+    return (name, int(value))
+
+
+def get_tag_limit(tags, name, default=None):
+    """
+    Get the numeric value of a tag (like "@timeout:120") from a tag list.
+
+    :param tags: Tags to search (without leading '@').
+    :param name: Tag name to look for (like: "timeout").
+    :param default: Used if no such tag exists (or its value is no number).
+    :return: Value of the first matching tag, or default.
+    """
+    for tag in tags:
+        if tag.startswith(name + ':'):
+            try:
+                return split_tag_limit(tag)[1]
+            except ValueError:
+                pass
+    return default
+
+
 class TagExpression(object):
     def __init__(self, tag_expressions):
         self.ands = []
@@ -43,12 +75,10 @@ class TagExpression(object):
         tags_with_negation = []
 
         for tag in tags:
-            tag = tag.split(':')
-            tag_with_negation = tag.pop(0)
+            tag_with_negation, limit = split_tag_limit(tag)
             tags_with_negation.append(tag_with_negation)
 
-            if tag:
-                limit = int(tag[0])
+            if limit is not None:
                 if negated:
                     tag_without_negation = tag_with_negation[1:]
                 else:
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Provides a local database with the durations of previous test runs.
+
+Each run (serial or parallel) records the durations of its features,
+scenarios and steps. For each model element, rolling statistics are kept
+(number of runs, last/min/max duration, mean, standard deviation and an
+exponentially weighted moving average that follows recent changes).
+
+The data is used to schedule the longest jobs first in parallel runs
+(--processes), but can be queried by other tools, too (like slow-test
+reports). Each element is stored by a stable identity
+(see :func:`make_timing_key()`).
+"""
+
+from __future__ import with_statement
+import math
+import os.path
+import time
+
+sqlite3 = None
+try:
+    import sqlite3
+except ImportError, e:
+    pass
+
+
+def make_timing_key(statement):
+    """
+    Build the stable identity of a feature, scenario or step, consisting of:
+
+      * feature filename
+      * line number (of the examples row for a scenario outline scenario)
+      * name
+
+    :param statement: Feature, scenario or step to use.
+    :return: Timing key (as unicode string).
+    """
+    line = statement.line
+    row = getattr(statement, "_row", None)
+    if row is not None and row.line:
+        line = row.line
+    return u"%s:%s:%s" % (statement.filename, line, statement.name)
+
+
+def collect_timings(statement):
+    """
+    Collect the durations of a feature or scenario and all its parts
+    (scenarios, steps) that were run.
+
+    :param statement: Feature or scenario that was run.
+    :return: List of (key, type, duration) tuples.
+    """
+    timings = []
+    if statement.status not in TimingDatabase.recorded_status:
+        return timings
+
+    if statement.type == "feature":
+        timings.append((make_timing_key(statement), statement.type,
+                        statement.duration))
+        for scenario in statement.walk_scenarios():
+            timings.extend(collect_timings(scenario))
+        return timings
+
+    assert statement.type == "scenario"
+    timings.append((make_timing_key(statement), statement.type,
+                    statement.duration))
+    for step in statement.all_steps:
+        if step.status in TimingDatabase.recorded_status:
+            timings.append((make_timing_key(step), step.type, step.duration))
+    return timings
+
+
+class TimingStatistics(object):
+    """
+    Rolling statistics of the durations of one model element.
+    """
+    ewma_weight = 0.3   # Weight of newest duration in moving average.
+
+    def __init__(self, key, type, runs=0, last=0.0, minimum=0.0, maximum=0.0,
+                 mean=0.0, m2=0.0, ewma=0.0, updated=None):
+        self.key = key
+        self.type = type
+        self.runs = runs
+        self.last = last
+        self.minimum = minimum
+        self.maximum = maximum
+        self.mean = mean
+        self.m2 = m2
+        self.ewma = ewma
+        self.updated = updated
+
+    @property
+    def stddev(self):
+        if self.runs < 2:
+            return 0.0
+        return math.sqrt(self.m2 / (self.runs - 1))
+
+    @property
+    def expected(self):
+        """Expected duration of the next run (moving average)."""
+        return self.ewma
+
+    def add(self, duration):
+        # -- ALGORITHM: Welford's online algorithm for mean/variance.
+        self.runs += 1
+        if self.runs == 1:
+            self.minimum = self.maximum = self.ewma = duration
+        else:
+            self.minimum = min(self.minimum, duration)
+            self.maximum = max(self.maximum, duration)
+            self.ewma += self.ewma_weight * (duration - self.ewma)
+        delta = duration - self.mean
+        self.mean += delta / self.runs
+        self.m2 += delta * (duration - self.mean)
+        self.last = duration
+        self.updated = time.time()
+
+    def __repr__(self):
+        return "<TimingStatistics %s: runs=%d, mean=%.3fs>" % \
+               (self.key, self.runs, self.mean)
+
+
+class TimingDatabase(object):
+    """
+    Stores rolling duration statistics in a SQLite database file.
+    New durations are collected in memory and written by :meth:`flush()`.
+
+    .. code-block:: python
+
+        timings = TimingDatabase.open(".behave_timings.db")
+        for statistics in timings.slowest("scenario", limit=10):
+            print statistics.key, statistics.mean
+    """
+    recorded_status = ("passed", "failed")
+    schema_version = 2
+    columns = ("key", "type", "runs", "last", "minimum", "maximum",
+               "mean", "m2", "ewma", "updated")
+    schema = """
+        CREATE TABLE IF NOT EXISTS timings (
+            key         TEXT PRIMARY KEY,
+            type        TEXT NOT NULL,
+            runs        INTEGER NOT NULL,
+            last        REAL NOT NULL,
+            minimum     REAL NOT NULL,
+            maximum     REAL NOT NULL,
+            mean        REAL NOT NULL,
+            m2          REAL NOT NULL,
+            ewma        REAL NOT NULL,
+            updated     REAL
+        )
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.statistics = None
+        self.new_timings = []
+
+    @classmethod
+    def open(cls, filename):
+        """
+        Open the timing database (if a filename is given and SQLite is usable).
+
+        :param filename: Database filename (None/empty: disabled).
+        :return: TimingDatabase object or None.
+        """
+        if not filename or not sqlite3:
+            return None
+        return cls(filename)
+
+    def connect(self):
+        connection = sqlite3.connect(self.filename)
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version < self.schema_version:
+            # -- OLDER SCHEMA: Only stored the last durations, start afresh.
+            with connection:
+                connection.execute("DROP TABLE IF EXISTS timings")
+                connection.execute(self.schema)
+                connection.execute("PRAGMA user_version = %d" % \
+                                   self.schema_version)
+        return connection
+
+    def load(self):
+        self.statistics = {}
+        if not os.path.exists(self.filename):
+            return
+        connection = self.connect()
+        try:
+            query = "SELECT %s FROM timings" % ", ".join(self.columns)
+            for row in connection.execute(query):
+                statistics = TimingStatistics(*row)
+                self.statistics[statistics.key] = statistics
+        finally:
+            connection.close()
+
+    def get_statistics(self, key):
+        if self.statistics is None:
+            self.load()
+        return self.statistics.get(key, None)
+
+    def get_duration(self, key, default=None):
+        statistics = self.get_statistics(key)
+        if statistics is None:
+            return default
+        return statistics.expected
+
+    def slowest(self, type=None, limit=None):
+        """
+        Provide the statistics of the slowest elements (by mean duration).
+
+        :param type:  Element type to select ("feature", "scenario", "step").
+        :param limit: Max. number of elements (optional).
+        :return: List of TimingStatistics objects, slowest first.
+        """
+        if self.statistics is None:
+            self.load()
+        selected = [statistics for statistics in self.statistics.values()
+                    if not type or statistics.type == type]
+        selected.sort(key=lambda statistics: statistics.mean, reverse=True)
+        if limit:
+            selected = selected[:limit]
+        return selected
+
+    def record(self, statement, duration=None):
+        """
+        Remember the duration of a feature, scenario or step that was run.
+
+        :param statement: Model element that was run.
+        :param duration:  Duration to use (default: statement.duration).
+        """
+        if duration is None:
+            duration = statement.duration
+        self.new_timings.append((make_timing_key(statement), statement.type,
+                                 duration))
+
+    def record_all(self, timings):
+        """
+        Remember many durations at once.
+
+        :param timings: List of (key, type, duration) tuples.
+        :see: :func:`collect_timings()`
+        """
+        self.new_timings.extend(timings)
+
+    def flush(self):
+        """
+        Add the new durations to the statistics in the database file.
+
+        The statistics are read again and written in one transaction that
+        locks the file (BEGIN IMMEDIATE), so that concurrent runs that share
+        the database file don't lose each other's updates.
+        """
+        if not self.new_timings:
+            return
+        query = "SELECT %s FROM timings WHERE key = ?" % ", ".join(self.columns)
+        statement = "INSERT OR REPLACE INTO timings (%s) VALUES (%s)" % \
+                    (", ".join(self.columns), ", ".join("?" * len(self.columns)))
+        connection = self.connect()
+        try:
+            connection.isolation_level = None   # -- Explicit transaction.
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                changed = {}
+                for key, type, duration in self.new_timings:
+                    statistics = changed.get(key, None)
+                    if statistics is None:
+                        row = connection.execute(query, (key,)).fetchone()
+                        if row:
+                            statistics = TimingStatistics(*row)
+                        else:
+                            statistics = TimingStatistics(key, type)
+                        changed[key] = statistics
+                    statistics.add(duration)
+                rows = [[getattr(statistics, name) for name in self.columns]
+                        for statistics in changed.values()]
+                connection.executemany(statement, rows)
+            except:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        self.new_timings = []
+        if self.statistics is not None:
+            self.statistics.update(changed)
+
+    def estimate_duration(self, statement, default=None):
+        """
+        Estimate the duration of a feature or scenario by its previous runs.
+        A feature without a known duration is estimated by its scenarios.
+
+        :param statement: Feature or scenario to estimate.
+        :param default:   Estimate for unknown (new) scenarios.
+        :return: Estimated duration (in seconds), or default.
+        """
+        duration = self.get_duration(make_timing_key(statement))
+        if duration is not None or statement.type != "feature":
+            if duration is None:
+                duration = default
+            return duration
+
+        # -- FEATURE: Sum up its scenarios.
+        durations = [self.get_duration(make_timing_key(scenario), default)
+                     for scenario in statement.walk_scenarios()]
+        if None in durations:
+            return default
+        return sum(durations)
+
+    def estimate_durations(self, jobs):
+        """
+        Estimate the durations of many jobs at once.
+        Jobs without a known duration are estimated with the average duration
+        of the known jobs (or zero, if no job is known).
+
+        :param jobs: List of features and scenarios (jobs) to estimate.
+        :return: List of estimated durations (in seconds), in the same order.
+        """
+        estimates = [self.estimate_duration(job) for job in jobs]
+        known = [estimate for estimate in estimates if estimate is not None]
+        default = 0.0
+        if known:
+            default = sum(known) / len(known)
+        for index, estimate in enumerate(estimates):
+            if estimate is None:
+                estimates[index] = default
+        return estimates
+
+    def sort_longest_first(self, jobs):
+        """
+        Sort jobs by their estimated duration, longest job first.
+        The order of jobs with the same estimate is kept.
+
+        :param jobs: List of features and scenarios (jobs) to sort.
+        :return: Sorted list of jobs.
+        :see: :meth:`estimate_durations()`
+        """
+        estimates = self.estimate_durations(jobs)
+        order = sorted(range(len(jobs)), key=lambda index: -estimates[index])
+        return [jobs[index] for index in order]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Utility script to measure the per-job dispatch overhead of parallel runs.
+
+Compares the old job/result queues (proxied by multiprocessing.Manager
+server processes) with the direct worker pool in :mod:`behave.parallel`.
+The jobs are no-ops, so the measured time is pure dispatch overhead.
+
+REQUIRES: Python >= 2.6 (multiprocessing module)
+LICENSE:  BSD
+"""
+
+VERSION = "0.1.0"
+
+
+# -- IMPORTS:
+from optparse import OptionParser
+import multiprocessing
+import os.path
+import sys
+import time
+
+HERE = os.path.dirname(__file__)
+TOP  = os.path.join(HERE, "..")
+if os.path.isdir(os.path.join(TOP, "behave")):
+    sys.path.insert(0, os.path.abspath(TOP))
+from behave.parallel import ProcessWorkerPool
+
+
+# ----------------------------------------------------------------------------
+# FUNCTIONS:
+# ----------------------------------------------------------------------------
+def make_results(payload_size):
+    # -- SIMILAR-TO: Results of Runner.worker() for one job.
+    return dict(status="passed", jobtype="scenario",
+                reportinginfo=u"x" * payload_size)
+
+
+def benchmark_manager_queues(jobs, processes, payload_size):
+    """Old implementation: Manager-proxied JoinableQueues."""
+    joblist_index_queue = multiprocessing.Manager().JoinableQueue()
+    resultsqueue = multiprocessing.Manager().JoinableQueue()
+    for index in range(jobs):
+        joblist_index_queue.put(index)
+
+    def worker(proc_number):
+        while 1:
+            try:
+                joblist_index_queue.get_nowait()
+            except Exception:
+                break
+            resultsqueue.put(make_results(payload_size))
+
+    start = time.time()
+    procs = [multiprocessing.Process(target=worker, args=(i,))
+             for i in range(processes)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    results = 0
+    while not resultsqueue.empty():
+        resultsqueue.get()
+        results += 1
+    assert results == jobs
+    return time.time() - start
+
+
+def benchmark_worker_pool(jobs, processes, payload_size):
+    """New implementation: Direct pipes and result queue."""
+    def worker(worker_id, channel):
+        channel.send("ready")
+        while channel.receive() is not None:
+            channel.send("result", make_results(payload_size))
+
+    start = time.time()
+    pending = range(jobs)
+    pending.reverse()
+    results = 0
+    pool = ProcessWorkerPool(processes, worker)
+    pool.start()
+    for worker_id, kind, data in pool.messages():
+        if kind == "result":
+            results += 1
+        if kind in ("ready", "result"):
+            if pending:
+                pool.dispatch(worker_id, pending.pop())
+            else:
+                pool.stop(worker_id)
+    pool.join()
+    assert results == jobs
+    return time.time() - start
+
+
+def report(name, duration, jobs, ostream=sys.stdout):
+    ostream.write("%-16s %8.3fs total, %8.1f usec per job\n" % \
+                  (name, duration, duration * 1e6 / jobs))
+
+
+# ----------------------------------------------------------------------------
+# MAIN FUNCTION:
+# ----------------------------------------------------------------------------
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    usage_ = """%prog [OPTIONS]
+Measure the per-job dispatch overhead of parallel runs (before/after)."""
+    parser = OptionParser(usage=usage_, version=VERSION)
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=5000,
+                     help="Number of no-op jobs (default: %default).")
+    parser.add_option("-p", "--processes", dest="processes", type="int",
+                     default=4,
+                     help="Number of worker processes (default: %default).")
+    parser.add_option("-s", "--payload-size", dest="payload_size",
+                     type="int", default=1000,
+                     help="Size of the result text per job (default: %default).")
+    options, _ = parser.parse_args(args)
+    if options.jobs < 1 or options.processes < 1:
+        parser.error("OOPS: Need at least one job and one process.")
+
+    sys.stdout.write("DISPATCH OVERHEAD (jobs=%d, processes=%d):\n" % \
+                     (options.jobs, options.processes))
+    sys.stdout.write("-" * 80)
+    sys.stdout.write("\n")
+    duration = benchmark_manager_queues(options.jobs, options.processes,
+                                        options.payload_size)
+    report("before (Manager)", duration, options.jobs)
+    duration = benchmark_worker_pool(options.jobs, options.processes,
+                                     options.payload_size)
+    report("after (pool)", duration, options.jobs)
+    return 0
+
+
+# ----------------------------------------------------------------------------
+# AUTO-MAIN:
+# ----------------------------------------------------------------------------
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-Utility script to retrieve duration information from behave JSON output.
+Utility script to retrieve duration information from behave JSON output
+or from the timing database that is written by each behave run.
 
 REQUIRES: Python >= 2.6 (json module is part of Python standard library)
 LICENSE:  BSD
@@ -16,6 +17,7 @@ VERSION = "0.1.0"
 # -- IMPORTS:
 from behave import json_parser
 from behave.model import ScenarioOutline
+from behave.timings import TimingDatabase
 from optparse import OptionParser
 import os.path
 import sys
@@ -115,6 +117,30 @@ class BehaveDurationData(object):
                 break
 
 
+def report_timing_database_durations(timings, type="step", limit=None,
+                                    min_duration=None, ostream=sys.stdout):
+    all_statistics = timings.slowest(type)
+    size = len(all_statistics)
+    ostream.write("%s DURATIONS (longest mean first, size=%d):\n" % \
+                  (type.upper(), size))
+    ostream.write("-" * 80)
+    ostream.write("\n")
+    for index, statistics in enumerate(all_statistics):
+        ostream.write("% 4d.  %9.6fs  %s" % \
+                      (index+1, statistics.mean, statistics.key))
+        if statistics.runs > 1:
+            ostream.write(" (%d runs, min: %.6fs, max: %.6fs, stddev: %.6fs)\n" % \
+                          (statistics.runs, statistics.minimum,
+                           statistics.maximum, statistics.stddev))
+        else:
+            ostream.write("\n")
+        if ((limit and index+1 >= limit) or
+            (statistics.mean < min_duration)):
+            remaining = size - (index+1)
+            ostream.write("...\nSkip remaining %d elements.\n" % remaining)
+            break
+
+
 # ----------------------------------------------------------------------------
 # MAIN FUNCTION:
 # ----------------------------------------------------------------------------
@@ -123,7 +149,9 @@ def main(args=None):
         args = sys.argv[1:]
 
     usage_ = """%prog [OPTIONS] JsonFile
-Read behave JSON data file and extract steps with longest duration."""
+       %prog [OPTIONS] --timing-db DatabaseFile
+Read behave JSON data file (or timing database) and
+extract steps with longest duration."""
     parser = OptionParser(usage=usage_, version=VERSION)
     parser.add_option("-e", "--encoding", dest="encoding",
                      default="UTF-8",
@@ -132,14 +160,27 @@ Read behave JSON data file and extract steps with longest duration."""
                      help="Max. number of steps (default: %default).")
     parser.add_option("-m", "--min", dest="min_duration", default="0",
                      help="Min. duration threshold (default: %default).")
+    parser.add_option("-d", "--timing-db", dest="timing_db",
+                     help="Timing database to use (instead of JSON file).")
+    parser.add_option("-t", "--type", dest="type", default="step",
+                     choices=["feature", "scenario", "step"],
+                     help="Element type for timing database (default: %default).")
     options, filenames = parser.parse_args(args)
-    if not filenames:
-        parser.error("OOPS, no filenames provided.")
-    elif len(filenames) > 1:
-        parser.error("OOPS: Can only process one JSON file.")
     min_duration = float(options.min_duration)
     if min_duration < 0:
         min_duration = None
+    if options.timing_db:
+        # -- USE TIMING DATABASE: Durations are already aggregated.
+        if not os.path.exists(options.timing_db):
+            parser.error("Timing database '%s' not found" % options.timing_db)
+        timings = TimingDatabase.open(options.timing_db)
+        report_timing_database_durations(timings, options.type,
+                                         options.limit, min_duration)
+        return 0
+    elif not filenames:
+        parser.error("OOPS, no filenames provided.")
+    elif len(filenames) > 1:
+        parser.error("OOPS: Can only process one JSON file.")
     json_filename = filenames[0]
     if not os.path.exists(json_filename):
         parser.error("JSON file '%s' not found" % json_filename)
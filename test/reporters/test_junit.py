@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import os.path
+import shutil
+import tempfile
+from xml.etree import ElementTree
+
+from mock import Mock
+from nose.tools import *
+
+from behave import parser
+from behave.reporter.junit import JUnitWriter
+
+FEATURE_TEXT = u"""
+Feature: Alice & <Bob>
+  Scenario: One ]]> two
+    Given a step
+
+  Scenario: Three
+    Given a step
+"""
+
+
+class TestJUnitWriter(object):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = Mock(paths=["features"], junit_directory=self.directory,
+                           junit_merged=None)
+        self.feature = parser.parse_feature(FEATURE_TEXT,
+                                            filename="features/alice.feature")
+        one, two = self.feature.scenarios
+        one.steps[0].status = "failed"
+        one.steps[0].error_message = u"Boom ]]> \x01 \xe4"
+        one.steps[0].exception = ValueError(u"Boom")
+        one.stdout = "captured \xc3\xa4"
+        two.steps[0].status = "passed"
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def parse_report(self, filename="TESTS-alice.xml"):
+        return ElementTree.parse(os.path.join(self.directory, filename))
+
+    def test_testsuite_is_written_when_feature_ends(self):
+        # -- PARALLEL RUN: Scenarios are done in any order.
+        writer = JUnitWriter(self.config)
+        writer.add_scenario(self.feature.scenarios[1])
+        ok_(not os.listdir(self.directory))
+        writer.add_scenario(self.feature.scenarios[0])
+        writer.end_feature(self.feature)
+
+        suite = self.parse_report().getroot()
+        eq_(suite.get("name"), u"alice.Alice & <Bob>")
+        eq_((suite.get("tests"), suite.get("errors"), suite.get("failures")),
+            ("2", "1", "0"))
+        eq_([case.get("name") for case in suite],
+            [u"One ]]> two", u"Three"])
+
+    def test_testcases_are_spooled_not_kept_in_memory(self):
+        writer = JUnitWriter(self.config)
+        writer.add_scenario(self.feature.scenarios[1])
+        report = writer.reports[id(self.feature)]
+        eq_([testcase[0] for testcase in report.testcases], [1])
+        ok_(writer.spool.tell() > 0)
+        writer.end_feature(self.feature)
+        # -- NO UNFINISHED FEATURE: Spool file is emptied.
+        writer.spool.seek(0, os.SEEK_END)
+        eq_(writer.spool.tell(), 0)
+        writer.close()
+        eq_(writer.spool, None)
+
+    def test_text_is_escaped_in_cdata_sections(self):
+        writer = JUnitWriter(self.config)
+        writer.write_feature(self.feature)
+
+        case = self.parse_report().getroot()[0]
+        error = case.find("error")
+        eq_(error.get("type"), "ValueError")
+        ok_(u"Boom ]]> ? \xe4" in error.text)
+        ok_(u"captured \xe4" in case.find("system-out").text)
+
+    def test_close_completes_unfinished_features_and_merged_file(self):
+        self.config.junit_merged = os.path.join(self.directory, "all.xml")
+        writer = JUnitWriter(self.config)
+        writer.add_scenario(self.feature.scenarios[1])
+        writer.close()
+
+        eq_(self.parse_report().getroot().get("tests"), "1")
+        merged = self.parse_report("all.xml").getroot()
+        eq_(merged.tag, "testsuites")
+        eq_([suite.get("tests") for suite in merged], ["1"])
@@ -1,7 +1,9 @@
 from __future__ import with_statement
 import os.path
+import StringIO
 import tempfile
 
+from mock import patch
 from nose.tools import *
 from behave import configuration
 
@@ -41,3 +43,36 @@ class TestConfiguration(object):
         eq_(d['stdout_capture'], False)
         ok_('bogus' not in d)
 
+
+    def test_numeric_options_are_converted(self):
+        config = configuration.Configuration("--max-failures 3")
+        eq_(config.max_failures, 3)
+        config = configuration.Configuration(
+            "--scenario-timeout 2.5 --step-timeout 1")
+        eq_(config.scenario_timeout, 2.5)
+        eq_(config.step_timeout, 1.0)
+        config = configuration.Configuration(
+            "--threads 4 --max-chunk-size 2")
+        eq_((config.thread_count, config.max_chunk_size), (4, 2))
+        eq_(configuration.Configuration("--agent-wait 5").agent_wait, 5.0)
+        eq_(configuration.Configuration("--retry 0").retry, 0)
+        eq_(configuration.Configuration("--retry 2").retry, 2)
+        config = configuration.Configuration(
+            "--max-jobs-per-worker 20 --max-worker-rss 500")
+        eq_((config.max_jobs_per_worker, config.max_worker_rss), (20, 500))
+        eq_(configuration.Configuration("--processes 3").proc_count, 3)
+        eq_(configuration.Configuration("--processes auto").proc_count, "auto")
+
+    def test_invalid_numeric_options_are_usage_errors(self):
+        for command_args in ("--max-failures x", "--max-failures -1",
+                             "--scenario-timeout x", "--step-timeout -1",
+                             "--threads 0", "--threads x",
+                             "--max-chunk-size 0", "--processes 0",
+                             "--processes x", "--processes -2",
+                             "--agent-wait -1", "--retry -1", "--retry x",
+                             "--max-jobs-per-worker 0",
+                             "--max-jobs-per-worker -3",
+                             "--max-worker-rss 0", "--max-worker-rss x"):
+            with patch("sys.stderr", StringIO.StringIO()):
+                assert_raises(SystemExit, configuration.Configuration,
+                              command_args)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from nose.tools import *
+
+from behave.distributed import parse_address, AgentChannel, CoordinatorPool
+
+
+def square_agent(address):
+    channel = AgentChannel.connect(address)
+    channel.send("ready")
+    while 1:
+        job = channel.receive()
+        if job is None:
+            break
+        channel.send("result", [job, job * job])
+    channel.send("done")
+    channel.close()
+
+
+def cancelled_agent(address):
+    channel = AgentChannel.connect(address)
+    channel.send("ready")
+    while 1:
+        chunk = channel.receive()
+        if chunk is None:
+            break
+        for job in chunk:
+            if channel.cancelled():
+                channel.send("cancelled")
+            else:
+                channel.send("result", job)
+    channel.send("done")
+    channel.close()
+
+
+def vanishing_agent(address):
+    channel = AgentChannel.connect(address)
+    channel.send("ready")
+    channel.receive()
+    channel.close()
+
+
+class TestParseAddress(object):
+
+    def test_parses_host_and_port(self):
+        eq_(parse_address("ci.example.com:7777"), ("ci.example.com", 7777))
+
+    def test_empty_host_means_all_interfaces(self):
+        eq_(parse_address(":7777"), ("", 7777))
+
+    @raises(ValueError)
+    def test_rejects_address_without_port(self):
+        parse_address("ci.example.com")
+
+
+class TestCoordinatorPool(object):
+
+    def run_pool(self, agents, jobs):
+        pool = CoordinatorPool("127.0.0.1:0", dict(parallel_element="scenario"))
+        pool.poll_timeout = 0.1
+        pool.start()
+        address = "127.0.0.1:%d" % pool.address[1]
+        threads = [threading.Thread(target=agent, args=(address,))
+                   for agent in agents]
+        for thread in threads:
+            thread.start()
+
+        pending = list(jobs)
+        running = {}
+        messages = []
+        connected = set()
+        for worker_id, kind, data in pool.messages():
+            messages.append((worker_id, kind, data))
+            connected.add(worker_id)
+            if kind in ("result", "died"):
+                running.pop(worker_id, None)
+            if kind in ("ready", "result"):
+                if pending:
+                    running[worker_id] = pending.pop(0)
+                    pool.dispatch(worker_id, running[worker_id])
+                else:
+                    pool.stop(worker_id)
+            if not pending and not running and len(connected) == len(agents):
+                pool.close()
+        pool.join()
+        for thread in threads:
+            thread.join()
+        return messages
+
+    def test_serves_all_jobs_to_agents(self):
+        messages = self.run_pool([square_agent, square_agent], range(10))
+        results = sorted(data for _, kind, data in messages if kind == "result")
+        eq_(results, [[i, i * i] for i in range(10)])
+        eq_(sorted(worker_id for worker_id, kind, _ in messages
+                   if kind == "done"), [0, 1])
+
+    def test_greets_each_agent_with_its_worker_id(self):
+        hellos = []
+        def greeted_agent(address):
+            channel = AgentChannel.connect(address)
+            hellos.append(channel.hello)
+            channel.send("ready")
+            channel.receive()
+            channel.send("done")
+            channel.close()
+        self.run_pool([greeted_agent], [])
+        eq_(hellos, [dict(parallel_element="scenario", worker_id=0)])
+
+    def test_cancelled_agents_skip_their_jobs(self):
+        pool = CoordinatorPool("127.0.0.1:0", dict(parallel_element="scenario"))
+        pool.poll_timeout = 0.1
+        pool.start()
+        agent = threading.Thread(target=cancelled_agent,
+                                 args=("127.0.0.1:%d" % pool.address[1],))
+        agent.start()
+        kinds = []
+        for worker_id, kind, data in pool.messages():
+            kinds.append(kind)
+            if kind == "ready":
+                pool.cancel()
+                pool.dispatch(worker_id, [1, 2])
+            elif len(kinds) == 3:
+                pool.stop(worker_id)
+                pool.close()
+        pool.join()
+        agent.join()
+        eq_(kinds, ["ready", "cancelled", "cancelled", "done"])
+
+    def test_reports_vanished_agent(self):
+        messages = self.run_pool([vanishing_agent], [1])
+        eq_(messages, [(0, "ready", None), (0, "died", None)])
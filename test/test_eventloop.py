@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from mock import Mock
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+
+from behave import eventloop, model, runner
+
+
+class TestEventLoop(object):
+
+    def setUp(self):
+        if eventloop.asyncio is None:
+            raise SkipTest("REQUIRES: asyncio module (or trollius)")
+
+    def test_plain_values_are_not_awaitable(self):
+        eq_(eventloop.is_awaitable(None), False)
+        eq_(eventloop.is_awaitable(42), False)
+
+    def test_runner_runs_async_step_until_complete(self):
+        r = runner.Runner(Mock())
+        context = runner.Context(r)
+
+        def step(context):
+            return eventloop.asyncio.sleep(0.1)
+
+        start = time.time()
+        model.Match(step, []).run(context)
+        ok_(time.time() - start >= 0.1)
+        eq_(r.event_loop.is_running(), False)
+
+    def test_event_loop_thread_runs_coroutines_of_all_threads(self):
+        loop_thread = eventloop.EventLoopThread()
+        results = []
+
+        def wait(value):
+            results.append(loop_thread.run_until_complete(
+                eventloop.asyncio.sleep(0.3, value)))
+
+        threads = [threading.Thread(target=wait, args=(value,))
+                   for value in range(10)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.time() - start
+        loop_thread.close()
+
+        eq_(sorted(results), range(10))
+        ok_(duration < 2.0, "Coroutines did not run concurrently")
+
+    def test_event_loop_thread_raises_error_of_ensure_future(self):
+        loop_thread = eventloop.EventLoopThread()
+        try:
+            # -- NOT AWAITABLE: ensure_future() raises TypeError in the loop.
+            assert_raises(TypeError, loop_thread.run_until_complete, 42)
+            eq_(loop_thread.run_until_complete(
+                eventloop.asyncio.sleep(0, "still running")), "still running")
+        finally:
+            loop_thread.close()
+
+    def test_event_loop_thread_raises_exception_of_coroutine(self):
+        loop_thread = eventloop.EventLoopThread()
+        future = eventloop.asyncio.Future(loop=loop_thread.loop)
+        loop_thread.loop.call_soon_threadsafe(future.set_exception,
+                                              ValueError("OOPS"))
+        try:
+            assert_raises(ValueError, loop_thread.run_until_complete, future)
+        finally:
+            loop_thread.close()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import time
+
+from nose.tools import *
+
+from behave.distributed import AgentChannel
+from behave.forkserver import ForkServer, ForkServerPool, import_modules
+
+template_state = {}
+
+
+def prepare_template():
+    template_state["prepared_in"] = os.getpid()
+
+
+def square_worker(address, ticket):
+    channel = AgentChannel.connect(address, ticket)
+    channel.send("pid", os.getpid())
+    channel.send("ready")
+    while 1:
+        job = channel.receive()
+        if job is None:
+            break
+        if job == "hang":
+            time.sleep(60)
+        channel.send("result", [job, job * job,
+                                template_state.get("prepared_in")])
+    channel.send("done")
+    channel.close()
+    return 0
+
+
+class TestImportModules(object):
+
+    def test_returns_modules_that_cannot_be_imported(self):
+        failures = import_modules("json, behave.no_such_module,")
+        eq_([name for name, error in failures], ["behave.no_such_module"])
+
+    def test_accepts_list_of_module_names(self):
+        eq_(import_modules(["json", "behave.parallel"]), [])
+
+
+class TestForkServerPool(object):
+
+    def setUp(self):
+        self.fork_server = ForkServer(prepare_template, square_worker)
+        self.fork_server.start()
+
+    def tearDown(self):
+        self.fork_server.stop()
+
+    def run_pool(self, size, jobs, on_message=None, pool=None):
+        pool = pool or ForkServerPool(self.fork_server, size,
+                                      dict(parallel_element="scenario"))
+        pool.poll_timeout = 0.1
+        pool.start()
+        pending = list(jobs)
+        running = {}
+        messages = []
+        for worker_id, kind, data in pool.messages():
+            messages.append((worker_id, kind, data))
+            if on_message and on_message(pool, worker_id, kind, data):
+                running.pop(worker_id, None)
+                continue
+            if kind in ("result", "died"):
+                running.pop(worker_id, None)
+            if kind in ("ready", "result"):
+                if pending:
+                    running[worker_id] = pending.pop(0)
+                    pool.dispatch(worker_id, running[worker_id])
+                else:
+                    pool.stop(worker_id)
+            if not pending and not running:
+                pool.close()
+        pool.join()
+        return pool, messages
+
+    def test_serves_all_jobs_to_forked_workers(self):
+        pool, messages = self.run_pool(2, range(6))
+        results = sorted(data for _, kind, data in messages if kind == "result")
+        eq_([result[:2] for result in results], [[i, i * i] for i in range(6)])
+        eq_(sorted(worker_id for worker_id, kind, _ in messages
+                   if kind == "done"), [0, 1])
+        eq_(len(set(pool.pids.values())), 2)
+        ok_(os.getpid() not in pool.pids.values())
+
+    def test_workers_are_forked_from_prepared_template(self):
+        pool, messages = self.run_pool(1, [3])
+        result = [data for _, kind, data in messages if kind == "result"][0]
+        eq_(result[2], self.fork_server.process.pid)
+
+    def test_connections_without_valid_ticket_are_rejected(self):
+        def connect_intruders(pool, worker_id, kind, data):
+            if kind == "ready" and not intruders:
+                for line in ("", '["ticket", "forged"]\n'):
+                    sock = socket.create_connection(pool.address[:2])
+                    sock.settimeout(5.0)
+                    sock.sendall(line)
+                    intruders.append(sock.recv(1024))
+                    sock.close()
+            return False
+        intruders = []
+        pool = ForkServerPool(self.fork_server, 1,
+                              dict(parallel_element="scenario"))
+        pool.ticket_timeout = 0.5
+        self.run_pool(1, [2, 3], connect_intruders, pool)
+        # -- REJECTED: Connection is closed without greeting.
+        eq_(intruders, ["", ""])
+        eq_(sorted(pool.workers.keys()), [0])
+
+    def test_restart_kills_stuck_worker_and_forks_new_one(self):
+        def restart_hanging_worker(pool, worker_id, kind, data):
+            if kind == "ready" and not restarted:
+                pool.dispatch(worker_id, "hang")
+                time.sleep(0.2)
+                pool.restart(worker_id)
+                restarted.append(pool.pids.get(worker_id))
+                return True
+            return False
+        restarted = []
+        pool, messages = self.run_pool(1, [2, 4], restart_hanging_worker)
+        results = [data[:2] for _, kind, data in messages if kind == "result"]
+        eq_(results, [[2, 4], [4, 16]])
+        # -- SAME WORKER ID: The fresh worker replaces the stuck one.
+        eq_([worker_id for worker_id, kind, _ in messages if kind == "done"],
+            [0])
+        eq_(restarted, [None])
+        eq_(len(pool.pids), 1)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import StringIO
+import tempfile
+
+from mock import Mock
+from nose.tools import *
+
+from behave import jobrecord, parser
+from behave.formatter.base import StreamOpener
+from behave.formatter.plain import PlainFormatter
+from behave.formatter.progress import ScenarioStepProgressFormatter
+from behave.model import Argument, Match
+
+FEATURE_TEXT = u"""
+Feature: Alice
+  Background:
+    Given a background step
+
+  Scenario: Bob
+    When I pass
+    Then I fail
+
+  Scenario: Charly
+    When I pass
+"""
+
+
+def parse_feature():
+    return parser.parse_feature(FEATURE_TEXT, filename="alice.feature")
+
+
+def run_feature(feature, recorder):
+    """Simulate a run of the feature (like Feature.run) in a worker."""
+    bob, charly = feature.walk_scenarios()
+    recorder.feature(feature)
+    recorder.background(feature.background)
+    recorder.scenario(bob)
+    steps = list(bob.all_steps)
+    for step in steps:
+        recorder.step(step)
+    steps[2].error_message = u"Assertion Failed: boom"
+    steps[2].exception = AssertionError(u"boom")
+    for step, status in zip(steps, ["passed", "passed", "failed"]):
+        step.status, step.duration = status, 0.5
+        recorder.match(Match(run_feature, [Argument(0, 4, u"pass", 42)]))
+        recorder.result(step)
+    charly.mark_skipped()
+    recorder.eof()
+
+
+class TestJobRecord(object):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_store = jobrecord.OutputStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_record(self):
+        feature = parse_feature()
+        recorder = jobrecord.JobRecorder(feature, self.output_store)
+        run_feature(feature, recorder)
+        return recorder.make_record(1, 100.0, 102.0)
+
+    def test_job_without_events_has_no_record(self):
+        recorder = jobrecord.JobRecorder(parse_feature(), self.output_store)
+        eq_(recorder.make_record(1, 100.0, 102.0), None)
+
+    def test_apply_record_sets_status_of_parent_model(self):
+        feature = parse_feature()
+        jobrecord.apply_record(feature, self.make_record(), self.output_store)
+
+        bob, charly = feature.walk_scenarios()
+        eq_(feature.status, "failed")
+        eq_((bob.status, charly.status), ("failed", "skipped"))
+        eq_([step.status for step in bob.all_steps],
+            ["passed", "passed", "failed"])
+        eq_(bob.duration, 1.5)
+        failed_step = list(bob.all_steps)[2]
+        eq_(failed_step.error_message, u"Assertion Failed: boom")
+        eq_(failed_step.exception.type_name, "AssertionError")
+        eq_(failed_step.exception.args, (u"boom",))
+
+    def test_replay_record_renders_report_in_parent(self):
+        feature = parse_feature()
+        record = self.make_record()
+        jobrecord.apply_record(feature, record, self.output_store)
+        config = Mock(show_timings=False, show_multiline=True)
+        stream = Mock()
+        formatter = PlainFormatter(StreamOpener(stream=stream), config)
+        jobrecord.replay_record(feature, record, [formatter])
+
+        text = u"".join(call[0][0] for call in stream.write.call_args_list)
+        ok_(u"Feature: Alice" in text)
+        ok_(u"Given a background step ... passed" in text)
+        ok_(u"Then I fail ... failed\nAssertion Failed: boom" in text)
+
+    def test_replayed_assertion_is_reported_as_failure_like_serial_run(self):
+        def render(run):
+            stream = StringIO.StringIO()
+            config = Mock(show_timings=False, show_source=False)
+            formatter = ScenarioStepProgressFormatter(
+                StreamOpener(stream=stream), config)
+            run(formatter)
+            return stream.getvalue()
+
+        record = self.make_record()
+        def replay(formatter):
+            feature = parse_feature()
+            jobrecord.apply_record(feature, record, self.output_store)
+            jobrecord.replay_record(feature, record, [formatter])
+
+        serial = render(lambda formatter: run_feature(parse_feature(),
+                                                      formatter))
+        ok_(u"..F" in serial)
+        eq_(render(replay), serial)
+
+    def test_recorded_exception_keeps_assertion_type(self):
+        failure = jobrecord.make_exception("AssertionError", u"boom", True)
+        error = jobrecord.make_exception("KeyError", u"boom", False)
+        ok_(isinstance(failure, AssertionError))
+        ok_(not isinstance(error, AssertionError))
+        eq_(failure.type_name, "AssertionError")
+
+    def test_large_texts_are_passed_in_files(self):
+        small = u"x" * 10
+        large = u"\xe4" * jobrecord.OutputStore.limit
+        eq_(self.output_store.put(small), small)
+        reference = self.output_store.put(large)
+        ok_(os.path.isfile(reference["file"]))
+        eq_(self.output_store.get(reference), large)
+
+    def test_texts_are_inline_without_directory(self):
+        large = u"x" * jobrecord.OutputStore.limit
+        eq_(jobrecord.OutputStore().put(large), large)
@@ -3,7 +3,7 @@ from __future__ import with_statement
 from nose.tools import *
 from mock import patch
 
-from behave.log_capture import LoggingCapture
+from behave.log_capture import LoggingCapture, ThreadLocalCapture
 
 class TestLogCapture(object):
     def test_get_value_returns_all_log_records(self):
@@ -26,3 +26,20 @@ class TestLogCapture(object):
 
             calls = [args[0][0] for args in format.call_args_list]
             eq_(calls, fake_records)
+
+    def test_thread_local_capture_passes_events_of_current_thread(self):
+        class FakeConfig(object):
+            logging_filter = None
+            logging_format = None
+            logging_datefmt = None
+            logging_level = None
+
+        capture = LoggingCapture(FakeConfig())
+        handler = ThreadLocalCapture(FakeConfig())
+        record = object()
+        handler.handle(record)
+        handler.redirect(capture)
+        handler.handle(record)
+        handler.restore()
+        handler.handle(record)
+        eq_(capture.buffer, [record])
@@ -39,6 +39,13 @@ class TestParseMatcher(object):
     def record_args(self, *args, **kwargs):
         self.recorded_args = (args, kwargs)
 
+    def test_literal_prefix_ends_at_first_field(self):
+        eq_(matchers.ParseMatcher(None, 'a {name} with {count:d}')
+                    .literal_prefix(), 'a ')
+        eq_(matchers.ParseMatcher(None, 'a string').literal_prefix(),
+            'a string')
+        eq_(matchers.ParseMatcher(None, '{name} says').literal_prefix(), '')
+
     def test_returns_none_if_parser_does_not_match(self):
         matcher = matchers.ParseMatcher(None, 'a string')
         with patch.object(matcher.parser, 'parse') as parse:
@@ -140,6 +147,20 @@ class TestRegexMatcher(object):
         have = [(a.start, a.end, a.original, a.value, a.name) for a in args]
         eq_(have, expected)
 
+    def test_literal_prefix_ends_at_first_special_character(self):
+        prefixes = [
+            ('the user (?P<name>.+) logs in', 'the user '),
+            ('^the user logs in$', 'the user logs in'),
+            ('the users? log in', 'the user'),
+            ('the user\\s+logs in', 'the user'),
+            ('the (user|admin) logs in', 'the '),
+            ('the user logs in|nobody logs in', ''),
+            ('(?i)the user', ''),
+            ('x* marks', ''),
+        ]
+        for pattern, prefix in prefixes:
+            eq_(matchers.RegexMatcher(None, pattern).literal_prefix(), prefix)
+
 def test_step_matcher_current_matcher():
     current_matcher = matchers.current_matcher
 
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+
+import os
+import StringIO
+import threading
+import time
+
+from mock import Mock, patch
+from nose.tools import *
+
+from behave.parallel import ProcessWorkerPool, ThreadWorkerPool, \
+     ThreadLocalStream, JobQueue, StartupWatch, TimeoutWatch, WorkerScaler, \
+     describe_worker_memory, frozen_heap, parse_smaps, process_memory
+
+
+def square_worker(worker_id, channel):
+    channel.send("ready")
+    while 1:
+        job = channel.receive()
+        if job is None:
+            break
+        channel.send("result", (job, job * job))
+
+
+def chunk_worker(worker_id, channel):
+    channel.send("ready")
+    while 1:
+        chunk = channel.receive()
+        if chunk is None:
+            break
+        for job in chunk:
+            if channel.cancelled():
+                channel.send("cancelled")
+            else:
+                channel.send("result", job)
+
+
+def hanging_worker(worker_id, channel):
+    channel.send("ready")
+    while 1:
+        job = channel.receive()
+        if job is None:
+            break
+        channel.send("result", job)
+        if job == "hang":
+            time.sleep(60)
+
+
+def retiring_worker(worker_id, channel):
+    channel.send("ready")
+    job = channel.receive()
+    if job is not None:
+        channel.send("result", job)
+        channel.send("retire", "1 jobs")
+
+
+def crashing_worker(worker_id, channel):
+    os._exit(3)
+
+
+def run_recycled_pool(pool, jobs):
+    pending = list(jobs)
+    messages = []
+    pool.start()
+    for worker_id, kind, data in pool.messages():
+        messages.append((worker_id, kind, data))
+        if kind == "ready":
+            if pending:
+                pool.dispatch(worker_id, pending.pop(0))
+            else:
+                pool.stop(worker_id)
+        elif kind == "done" and pending:
+            pool.replace(worker_id)
+    pool.join()
+    return messages
+
+
+def run_pool(pool, jobs):
+    pending = list(jobs)
+    messages = []
+    pool.start()
+    for worker_id, kind, data in pool.messages():
+        messages.append((worker_id, kind, data))
+        if kind in ("ready", "result"):
+            if pending:
+                pool.dispatch(worker_id, pending.pop(0))
+            else:
+                pool.stop(worker_id)
+    pool.join()
+    return messages
+
+
+class TestProcessWorkerPool(object):
+
+    def test_dispatches_all_jobs_and_collects_results(self):
+        pool = ProcessWorkerPool(3, square_worker)
+        messages = run_pool(pool, range(10))
+        results = sorted(data for _, kind, data in messages if kind == "result")
+        eq_(results, [(i, i * i) for i in range(10)])
+
+    def test_each_worker_says_ready_and_done(self):
+        pool = ProcessWorkerPool(2, square_worker)
+        messages = run_pool(pool, range(3))
+        for kind in ("ready", "done"):
+            worker_ids = sorted(worker_id for worker_id, kind2, _ in messages
+                                if kind2 == kind)
+            eq_(worker_ids, [0, 1])
+
+    def test_cancelled_workers_skip_their_jobs(self):
+        pool = ProcessWorkerPool(1, chunk_worker)
+        pool.cancel()
+        pool.start()
+        kinds = []
+        for worker_id, kind, data in pool.messages():
+            kinds.append(kind)
+            if kind == "ready":
+                pool.dispatch(worker_id, [1, 2, 3])
+            elif len(kinds) == 4:
+                pool.stop(worker_id)
+        pool.join()
+        eq_(kinds, ["ready", "cancelled", "cancelled", "cancelled", "done"])
+
+    def test_restarted_worker_replaces_stuck_worker(self):
+        pool = ProcessWorkerPool(1, hanging_worker)
+        pool.start()
+        messages = []
+        for worker_id, kind, data in pool.messages():
+            messages.append((worker_id, kind, data))
+            if kind == "ready" and len(messages) == 1:
+                pool.dispatch(worker_id, "hang")
+            elif kind == "result" and data == "hang":
+                pool.restart(worker_id)
+            elif kind == "ready":
+                pool.stop(worker_id)
+        pool.join()
+        eq_(messages, [(0, "ready", None), (0, "result", "hang"),
+                       (0, "ready", None), (0, "done", None)])
+
+    def test_reports_died_worker(self):
+        pool = ProcessWorkerPool(1, crashing_worker)
+        pool.poll_timeout = 0.1
+        messages = run_pool(pool, range(3))
+        eq_(messages, [(0, "died", 3)])
+
+    def test_replaces_retired_worker(self):
+        messages = run_recycled_pool(ProcessWorkerPool(1, retiring_worker),
+                                     ["a", "b"])
+        eq_([message[1:] for message in messages], [
+            ("ready", None), ("result", "a"), ("retire", "1 jobs"),
+            ("done", None), ("ready", None), ("result", "b"),
+            ("retire", "1 jobs"), ("done", None)])
+
+
+class TestThreadWorkerPool(object):
+
+    def test_dispatches_all_jobs_and_collects_results(self):
+        pool = ThreadWorkerPool(3, square_worker)
+        messages = run_pool(pool, range(10))
+        results = sorted(data for _, kind, data in messages if kind == "result")
+        eq_(results, [(i, i * i) for i in range(10)])
+
+    def test_each_worker_says_ready_and_done(self):
+        pool = ThreadWorkerPool(2, square_worker)
+        messages = run_pool(pool, range(3))
+        for kind in ("ready", "done"):
+            worker_ids = sorted(worker_id for worker_id, kind2, _ in messages
+                                if kind2 == kind)
+            eq_(worker_ids, [0, 1])
+
+    def test_cancelled_workers_skip_their_jobs(self):
+        pool = ThreadWorkerPool(1, chunk_worker)
+        pool.cancel()
+        pool.start()
+        kinds = []
+        for worker_id, kind, data in pool.messages():
+            kinds.append(kind)
+            if kind == "ready":
+                pool.dispatch(worker_id, [1, 2])
+            elif len(kinds) == 3:
+                pool.stop(worker_id)
+        pool.join()
+        eq_(kinds, ["ready", "cancelled", "cancelled", "done"])
+
+    def test_replaces_retired_worker(self):
+        messages = run_recycled_pool(ThreadWorkerPool(1, retiring_worker),
+                                     ["a", "b"])
+        eq_([message[1:] for message in messages], [
+            ("ready", None), ("result", "a"), ("retire", "1 jobs"),
+            ("done", None), ("ready", None), ("result", "b"),
+            ("retire", "1 jobs"), ("done", None)])
+
+    def test_restarted_worker_replaces_stuck_worker(self):
+        pool = ThreadWorkerPool(1, hanging_worker)
+        pool.start()
+        messages = []
+        for worker_id, kind, data in pool.messages():
+            messages.append((worker_id, kind, data))
+            if kind == "ready" and len(messages) == 1:
+                pool.dispatch(worker_id, "hang")
+            elif kind == "result" and data == "hang":
+                pool.restart(worker_id)
+            elif kind == "ready":
+                pool.stop(worker_id)
+        pool.join()
+        eq_(messages, [(0, "ready", None), (0, "result", "hang"),
+                       (0, "ready", None), (0, "done", None)])
+
+
+class TestThreadLocalStream(object):
+
+    def test_redirects_output_of_current_thread_only(self):
+        original = StringIO.StringIO()
+        captured = StringIO.StringIO()
+        stream = ThreadLocalStream(original)
+        stream.redirect(captured)
+        thread = threading.Thread(target=stream.write, args=("other",))
+        thread.start()
+        thread.join()
+        stream.write("mine")
+        stream.restore()
+        stream.write("!")
+        eq_(captured.getvalue(), "mine")
+        eq_(original.getvalue(), "other!")
+
+
+class TestJobQueue(object):
+
+    def take_all(self, queue, workers):
+        chunks = []
+        while queue:
+            chunks.append(queue.take(workers))
+        return chunks
+
+    def test_batches_short_jobs_and_shrinks_chunks_towards_the_end(self):
+        queue = JobQueue([1.0] * 40, max_chunk_size=100)
+        chunks = self.take_all(queue, 2)
+        sizes = [len(chunk) for chunk in chunks]
+        eq_(sizes[0], 10)
+        eq_(sizes[-1], 1)
+        eq_(sizes, sorted(sizes, reverse=True))
+        eq_(sum(chunks, []), range(40))
+
+    def test_long_jobs_are_handed_out_alone(self):
+        queue = JobQueue([10.0, 10.0, 0.1, 0.1, 0.1, 0.1], max_chunk_size=100)
+        chunks = self.take_all(queue, 2)
+        eq_(chunks[:2], [[0], [1]])
+
+    def test_respects_max_chunk_size(self):
+        queue = JobQueue([1.0] * 100, max_chunk_size=3)
+        ok_(max(len(chunk) for chunk in self.take_all(queue, 1)) <= 3)
+
+    def test_push_front_hands_out_jobs_again(self):
+        queue = JobQueue([1.0] * 4, max_chunk_size=1)
+        chunk = queue.take()
+        queue.push_front(chunk)
+        eq_(len(queue), 4)
+        eq_(queue.take(), chunk)
+
+    def test_limited_jobs_wait_for_their_resources(self):
+        resources = {0: ["db"], 1: ["db"], 2: ["db"]}
+        queue = JobQueue([1.0] * 5, max_chunk_size=1,
+                         resources=resources, limits={"db": 2})
+        eq_(queue.take(), [0])
+        eq_(queue.take(), [1])
+        # -- DB IS BUSY: Other jobs are handed out instead.
+        eq_(queue.take(), [3])
+        eq_(queue.take(), [4])
+        eq_(queue.take(), [])
+        eq_(len(queue), 1)
+        queue.done([0])
+        eq_(queue.take(), [2])
+
+    def test_limited_jobs_are_not_chunked(self):
+        queue = JobQueue([1.0] * 6, max_chunk_size=100,
+                         resources={2: ["db"]}, limits={"db": 1})
+        eq_(queue.take(), [2])
+        ok_(2 not in sum(self.take_all(queue, 1), []))
+
+    def test_push_front_releases_resources(self):
+        queue = JobQueue([1.0] * 2, resources={0: ["db"], 1: ["db"]},
+                         limits={"db": 1})
+        chunk = queue.take()
+        eq_(queue.take(), [])
+        queue.push_front(chunk)
+        eq_(queue.take(), chunk)
+
+
+    def test_workers_keep_their_group(self):
+        groups = {0: "a", 1: "b", 2: "a", 3: "b", 4: "a", 5: "b"}
+        queue = JobQueue([1.0] * 6, groups=groups)
+        eq_(queue.take(2, worker_id=0), [0])
+        eq_(queue.take(2, worker_id=1), [1])
+        eq_(queue.take(2, worker_id=1), [3])
+        eq_(queue.take(2, worker_id=0), [2])
+        eq_(queue.take(2, worker_id=0), [4])
+        eq_(queue.take(2, worker_id=1), [5])
+
+    def test_worker_without_jobs_steals_from_the_biggest_group(self):
+        groups = {0: "a", 1: "a", 2: "a", 3: "b", 4: "c"}
+        queue = JobQueue([1.0] * 5, groups=groups)
+        eq_(queue.take(3, worker_id=0), [0])
+        eq_(queue.take(3, worker_id=1), [3])
+        eq_(queue.take(3, worker_id=2), [4])
+        eq_(queue.take(3, worker_id=2), [1])
+        eq_(queue.take(3, worker_id=0), [2])
+        eq_(len(queue), 0)
+
+    def test_group_of_released_worker_is_taken_over(self):
+        groups = {0: "a", 1: "b", 2: "a", 3: "a"}
+        queue = JobQueue([1.0] * 4, groups=groups)
+        eq_(queue.take(2, worker_id=0), [0])
+        eq_(queue.take(2, worker_id=1), [1])
+        queue.release(0)    # -- Worker 0 retired, a fresh worker 2 starts.
+        eq_(queue.take(2, worker_id=2), [2])
+        eq_(queue.worker_groups, {1: "b", 2: "a"})
+
+    def test_stopped_workers_do_not_hold_groups(self):
+        groups = {0: "a", 1: "b", 2: "b", 3: "c"}
+        queue = JobQueue([1.0] * 4, groups=groups)
+        eq_(queue.take(3, worker_id=0), [0])
+        eq_(queue.take(3, worker_id=1), [1])
+        queue.release(1)    # -- Worker 1 died, its job is put back.
+        queue.push_front([1])
+        eq_(queue.take(3, worker_id=0), [1])
+        eq_(queue.take(3, worker_id=2), [3])
+
+    def test_chunks_contain_jobs_of_one_group(self):
+        groups = dict((index, index % 2) for index in range(20))
+        queue = JobQueue([1.0] * 20, max_chunk_size=100, groups=groups)
+        chunk = queue.take(1, worker_id=0)
+        eq_(set(groups[index] for index in chunk), set([0]))
+
+
+class TestWorkerScaler(object):
+    MB = 1024 * 1024
+
+    def test_initial_size_uses_idle_cpus_and_memory(self):
+        scaler = WorkerScaler(cpus=8)
+        eq_(scaler.initial_size(100), 8)
+        eq_(scaler.initial_size(100, load=3.5), 5)
+        eq_(scaler.initial_size(100, memory=1000 * self.MB,
+                                worker_memory=300 * self.MB), 3)
+        eq_(scaler.initial_size(100, load=12.0), 1)
+
+    def test_never_more_workers_than_jobs(self):
+        scaler = WorkerScaler(cpus=8)
+        eq_(scaler.initial_size(3), 3)
+        eq_(scaler.initial_size(0), 0)
+        eq_(scaler.adjust(3, queued=2, load=0.5, now=100.0), 0)
+
+    def test_adds_worker_while_jobs_are_queued_and_cpus_are_idle(self):
+        scaler = WorkerScaler(cpus=4)
+        eq_(scaler.adjust(2, queued=10, load=1.0, memory=4096 * self.MB,
+                          worker_memory=100 * self.MB, now=100.0), 1)
+        eq_(scaler.adjust(2, queued=10, load=3.5, now=110.0), 0)
+        eq_(scaler.adjust(4, queued=10, load=0.0, now=120.0), 0)
+        eq_(scaler.adjust(2, queued=10, memory=150 * self.MB,
+                          worker_memory=100 * self.MB, now=130.0), 0)
+
+    def test_retires_worker_if_machine_is_overloaded(self):
+        scaler = WorkerScaler(cpus=4)
+        eq_(scaler.adjust(3, queued=10, load=7.0, now=100.0), -1)
+        eq_(scaler.adjust(3, queued=10, memory=50 * self.MB,
+                          worker_memory=100 * self.MB, now=110.0), -1)
+        eq_(scaler.adjust(1, queued=10, load=7.0, now=120.0), 0)
+
+    def test_checks_are_due_after_interval_since_last_change(self):
+        scaler = WorkerScaler(cpus=4, now=100.0)
+        eq_(scaler.due(now=101.0), False)
+        eq_(scaler.due(now=105.0), True)
+        eq_(scaler.due(now=105.5), False)
+        scaler.adjust(1, queued=10, load=0.0, now=105.5)
+        eq_(scaler.due(now=107.0), False)
+        eq_(scaler.due(now=110.5), True)
+
+
+class TestStartupWatch(object):
+
+    def test_measures_latency_until_all_workers_are_ready(self):
+        watch = StartupWatch([0, 1, 2], now=10.0)
+        eq_(watch.ready(1, now=10.5), False)
+        eq_(watch.gone(2), False)
+        eq_(watch.ready(1, now=11.0), False)
+        eq_(watch.ready(0, now=12.0), True)
+        eq_(watch.latencies, {0: 2.0, 1: 0.5, 2: None})
+        eq_(watch.describe(), "2 worker(s) ready after 2.00s"
+                              " (first: 0.50s, slowest: WORKER0).")
+
+    def test_later_workers_are_not_measured(self):
+        watch = StartupWatch([], now=10.0)
+        eq_(watch.ready(5, now=11.0), False)
+        eq_(watch.latencies, {})
+
+
+class TestWorkerMemory(object):
+
+    def test_parse_smaps_sums_shared_and_private_memory(self):
+        lines = ["00400000-00452000 r-xp 00000000 08:02 173521  /bin/sh\n",
+                 "Rss:                 800 kB\n",
+                 "Shared_Clean:        500 kB\n",
+                 "Shared_Dirty:        100 kB\n",
+                 "Private_Clean:        50 kB\n",
+                 "Private_Dirty:       150 kB\n",
+                 "Shared_Clean:         24 kB\n"]
+        eq_(parse_smaps(lines), [624 * 1024, 200 * 1024])
+
+    def test_process_memory_of_unknown_process_is_none(self):
+        eq_(process_memory(pid="no-such-process"), None)
+
+    def test_heap_is_frozen_during_fork_only(self):
+        gc = Mock(spec=["collect", "freeze", "unfreeze", "fork"])
+        with patch("behave.parallel.gc", gc):
+            with frozen_heap():
+                gc.fork()
+        eq_([call[0] for call in gc.method_calls],
+            ["collect", "freeze", "fork", "unfreeze"])
+
+    def test_heap_is_not_frozen_without_gc_freeze(self):
+        gc = Mock(spec=["collect"])
+        with patch("behave.parallel.gc", gc):
+            with frozen_heap():
+                pass
+        eq_(gc.method_calls, [])
+
+    def test_describe_worker_memory(self):
+        megabyte = 1024 * 1024
+        memory = {1: [20 * megabyte, 3 * megabyte], 0: [21 * megabyte, 0]}
+        eq_(describe_worker_memory(memory),
+            "Worker memory in MB (private/shared):"
+            " WORKER0 0.0/21.0, WORKER1 3.0/20.0.")
+
+
+class TestTimeoutWatch(object):
+
+    def test_detects_expired_scenario(self):
+        watch = TimeoutWatch()
+        watch.started(1, "scenario", u"Alice", 10.0, now=100.0)
+        eq_(watch.expired(now=105.0), [])
+        eq_(watch.expired(now=110.0),
+            [(1, u"TIMEOUT: Scenario 'Alice' exceeded its timeout of 10.0s")])
+
+    def test_detects_expired_step(self):
+        watch = TimeoutWatch()
+        watch.started(1, "scenario", u"Alice", 60.0, now=100.0)
+        watch.started(1, "step", u"I wait", 2.0, now=101.0)
+        eq_(watch.expired(now=104.0),
+            [(1, u"TIMEOUT: Step 'I wait' exceeded its timeout of 2.0s")])
+
+    def test_next_scenario_resets_step_deadline(self):
+        watch = TimeoutWatch()
+        watch.started(1, "step", u"I wait", 2.0, now=100.0)
+        watch.started(1, "scenario", u"Bob", 60.0, now=101.0)
+        eq_(watch.expired(now=104.0), [])
+
+    def test_step_deadline_ends_with_step(self):
+        # -- SLOW HOOK: after_step/after_scenario run after a fast step.
+        watch = TimeoutWatch()
+        watch.progress(1, ["scenario", u"Alice", 0, 0], now=100.0)
+        watch.progress(1, ["step", u"I pass", 2.0, 0], now=100.0)
+        watch.progress(1, ["step_done", 0], now=100.001)
+        eq_(watch.expired(now=103.0), [])
+        eq_(watch.position(1), (0, 0, True))
+
+    def test_position_of_running_step(self):
+        watch = TimeoutWatch()
+        watch.progress(1, ["scenario", u"Alice", 60.0, 2], now=100.0)
+        watch.progress(1, ["step", u"I wait", 0, 3], now=100.0)
+        eq_(watch.position(1), (2, 3, False))
+        eq_(watch.expired(now=150.0), [])
+        watch.finished(1)
+        eq_(watch.position(1), None)
+
+    def test_finished_worker_has_no_deadlines(self):
+        watch = TimeoutWatch()
+        watch.started(1, "scenario", u"Alice", 10.0, now=100.0)
+        watch.finished(1)
+        eq_(watch.expired(now=200.0), [])
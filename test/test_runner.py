@@ -3,6 +3,7 @@
 from __future__ import with_statement
 from collections import defaultdict
 import os.path
+import shutil
 import StringIO
 import sys
 import warnings
@@ -12,10 +13,12 @@ from mock import Mock, patch
 from nose.tools import *
 import unittest
 
-from behave import model, parser, runner, step_registry
+from behave import jobrecord, model, parser, runner, step_registry
 from behave.configuration import ConfigError
 from behave.log_capture import LoggingCapture
 from behave.formatter.base import StreamOpener
+from behave.tag_expression import TagExpression
+from behave.timings import TimingDatabase
 
 
 class TestContext(object):
@@ -556,6 +559,339 @@ class TestRunner(object):
         r.run_with_paths.return_value = False
         assert not r.run()
 
+    def test_worker_runs_before_worker_and_after_worker_hooks_once(self):
+        r = runner.Runner(Mock())
+        r.context = Mock()
+        r.run_hook = Mock()
+        channel = Mock()
+        channel.receive.return_value = None
+        with patch('behave.parallel.process_memory', Mock(return_value=None)):
+            r.worker(3, channel)
+
+        eq_(r.run_hook.call_args_list, [
+            (('before_worker', r.context, 3), {}),
+            (('after_worker', r.context, 3), {}),
+        ])
+        channel.send.assert_called_once_with('ready')
+
+    def test_worker_runs_after_worker_hook_if_job_fails(self):
+        r = runner.Runner(Mock())
+        r.context = Mock()
+        r.run_hook = Mock()
+        channel = Mock()
+        channel.receive.side_effect = RuntimeError("OOPS")
+        assert_raises(RuntimeError, r.worker, 0, channel)
+        eq_(r.run_hook.call_args_list[-1], (('after_worker', r.context, 0), {}))
+
+    def test_worker_retires_after_max_jobs(self):
+        r = runner.Runner(Mock(affinity=None, max_jobs_per_worker=2,
+                               max_worker_rss=None))
+        r.joblist = ['one', 'two', 'three']
+        r.run_job = Mock(return_value='record')
+        channel = Mock()
+        channel.cancelled.return_value = False
+        channel.receive.side_effect = [[0], [1, 2]]
+        memory = Mock(return_value=[3, 4])
+        with patch('behave.parallel.process_memory', memory):
+            r.run_jobs(0, channel)
+
+        eq_(channel.send.call_args_list, [
+            (('ready',), {}), (('result', 'record'), {}),
+            (('result', 'record'), {}), (('retire', '2 jobs'), {}),
+            (('memory', [3, 4]), {}),
+        ])
+        eq_(r.run_job.call_count, 2)
+
+    def test_build_joblist_contains_selected_scenarios_only(self):
+        features = [parser.parse_feature(u"""
+Feature: Alice
+  @smoke
+  Scenario: One
+    Given a step
+
+  @smoke
+  Scenario Outline: Two
+    Given a step with <x>
+
+    Examples:
+      | x |
+      | 1 |
+      | 2 |
+
+  Scenario: Three
+    Given a step
+""", filename="alice.feature"), parser.parse_feature(u"""
+@serial
+Feature: Bob
+  Scenario: Four
+    Given a step
+""", filename="bob.feature")]
+        r = runner.Runner(Mock(tags=TagExpression(['@smoke']), name=None))
+        r.features = features
+        r.parallel_element = 'scenario'
+
+        one, two, three = features[0].scenarios
+        eq_(r.build_joblist(), (3, 0, 2))
+        eq_(r.joblist, [one] + two.scenarios)
+        eq_(r.multiproc_pending_jobs, {'alice.featureAlice': 3})
+
+    def select_shard(self, shard, timing_db, shard_durations=None):
+        feature = parser.parse_feature(u"\n".join(
+            [u"Feature: Alice"] +
+            [u"  Scenario: s%d\n    Given a step" % i for i in range(1, 7)]),
+            filename="alice.feature")
+        r = runner.Runner(Mock(tags=TagExpression([]), name=None,
+                               parallel_element=None, shard=shard,
+                               timing_db=timing_db,
+                               shard_durations=shard_durations))
+        features = r.select_shard([feature])
+        return set(scenario.name for feature in features
+                   for scenario in feature.walk_scenarios())
+
+    def write_timings(self, filename, durations):
+        timings = TimingDatabase.open(filename)
+        feature = parser.parse_feature(u"\n".join(
+            [u"Feature: Alice"] +
+            [u"  Scenario: s%d\n    Given a step" % i for i in range(1, 7)]),
+            filename="alice.feature")
+        for scenario, duration in zip(feature.scenarios, durations):
+            timings.record(scenario, duration)
+        timings.flush()
+
+    def test_shards_with_different_local_timings_cover_all_scenarios(self):
+        directory = tempfile.mkdtemp()
+        try:
+            first_db = os.path.join(directory, "first.db")
+            second_db = os.path.join(directory, "second.db")
+            self.write_timings(first_db, [9.0, 1.0, 1.0, 1.0, 1.0, 1.0])
+            self.write_timings(second_db, [1.0, 9.0, 1.0, 1.0, 9.0, 1.0])
+            first = self.select_shard((0, 2), first_db)
+            second = self.select_shard((1, 2), second_db)
+        finally:
+            shutil.rmtree(directory)
+
+        eq_(first & second, set())
+        eq_(first | second, set(u"s%d" % i for i in range(1, 7)))
+
+    def test_shards_are_balanced_by_shared_durations(self):
+        directory = tempfile.mkdtemp()
+        try:
+            shared_db = os.path.join(directory, "shared.db")
+            self.write_timings(shared_db, [9.0, 1.0, 1.0, 1.0, 1.0, 1.0])
+            first = self.select_shard((0, 2), None, shared_db)
+            second = self.select_shard((1, 2), None, shared_db)
+        finally:
+            shutil.rmtree(directory)
+
+        eq_(first, set([u"s1"]))
+        eq_(second, set(u"s%d" % i for i in range(2, 7)))
+
+    def test_build_job_resources_uses_tags_with_limits(self):
+        feature = model.Feature('foo.feature', 1, u'Feature', u'foo',
+                                tags=[u'db:2'])
+        scenarios = [
+            model.Scenario('foo.feature', 3, u'Scenario', u'one'),
+            model.Scenario('foo.feature', 5, u'Scenario', u'two',
+                           tags=[u'payment:1', u'timeout:60', u'wip']),
+        ]
+        for scenario in scenarios:
+            feature.add_scenario(scenario)
+        config = Mock()
+        config.tags.limits = {'payment': 3}
+        r = runner.Runner(config)
+        r.joblist = scenarios + [model.Scenario('bar.feature', 3,
+                                                u'Scenario', u'three')]
+
+        resources, limits = r.build_job_resources()
+        eq_(resources, {0: ['db'], 1: ['db', 'payment']})
+        eq_(limits, {'db': 2, 'payment': 3})
+
+    def test_thread_runner_has_own_context_and_config(self):
+        r = runner.Runner(Mock())
+        r.context = runner.Context(r)
+        r.context.shared = 'from before_all'
+        thread_runner = r.make_thread_runner()
+
+        assert thread_runner.context is not r.context
+        assert thread_runner.config is not r.config
+        eq_(thread_runner.context.shared, 'from before_all')
+        assert thread_runner.context.config is thread_runner.config
+        thread_runner.context.shared = 'changed'
+        eq_(r.context.shared, 'from before_all')
+
+    def make_affinity_runner(self, affinity):
+        features = []
+        for filename in ('foo.feature', 'bar.feature'):
+            feature = model.Feature(filename, 1, u'Feature', u'foo')
+            feature.add_scenario(model.Scenario(filename, 3, u'Scenario',
+                                                u'one', tags=[u'browser_a']))
+            feature.add_scenario(model.Scenario(filename, 5, u'Scenario',
+                                                u'two'))
+            features.append(feature)
+        config = Mock()
+        config.affinity = affinity
+        config.dry_run = False
+        r = runner.Runner(config)
+        r.joblist = sum([feature.scenarios for feature in features], [])
+        return r
+
+    def test_build_job_groups_by_feature(self):
+        r = self.make_affinity_runner('feature')
+        eq_(r.build_job_groups(), {0: 'foo.feature', 1: 'foo.feature',
+                                   2: 'bar.feature', 3: 'bar.feature'})
+
+    def test_build_job_groups_by_tag_prefix(self):
+        r = self.make_affinity_runner('tag:browser_')
+        eq_(r.build_job_groups(), {0: u'@browser_a', 1: 'foo.feature',
+                                   2: u'@browser_a', 3: 'bar.feature'})
+
+    def test_switch_feature_runs_feature_hooks_once(self):
+        r = self.make_affinity_runner('feature')
+        r.context = Mock()
+        r.run_hook = Mock()
+        foo, bar = r.joblist[0].feature, r.joblist[2].feature
+        for job in r.joblist:
+            r.switch_feature(job.feature)
+        r.switch_feature(None)
+
+        eq_([args[0][::2] for args in r.run_hook.call_args_list], [
+            ('before_feature', foo), ('after_feature', foo),
+            ('before_feature', bar), ('after_feature', bar),
+        ])
+
+    def test_replay_feature_replays_scenario_jobs_in_file_order(self):
+        r = self.make_affinity_runner('feature')
+        formatter = Mock()
+        r.formatters = [formatter]
+        one, two = r.joblist[0:2]
+        record = dict(events=[['scenario', 0]])
+        r.replay_feature(one.feature, [(two, record), (one, record)])
+
+        eq_(formatter.method_calls, [
+            ('uri', ('foo.feature',), {}),
+            ('feature', (one.feature,), {}),
+            ('scenario', (one,), {}),
+            ('scenario', (two,), {}),
+            ('eof', (), {}),
+        ])
+
+    def test_replay_in_order_waits_for_features_before(self):
+        r = self.make_affinity_runner('feature')
+        foo, bar = r.joblist[0].feature, r.joblist[2].feature
+        r.features = [foo, bar]
+        r.joblist.reverse()
+        r.multiproc_replay_order = r.build_replay_order()
+        r.multiproc_replays = {}
+        r.replay_feature = Mock()
+        record = dict(events=[['scenario', 0]])
+        r.replay_in_order(bar, [(r.joblist[0], record)])
+        eq_(r.replay_feature.call_count, 0)
+        r.replay_in_order(foo, [(r.joblist[3], record)])
+
+        eq_([args[0][0] for args in r.replay_feature.call_args_list],
+            [foo, bar])
+
+    def make_timeout_record(self, position):
+        r = self.make_affinity_runner('feature')
+        feature = r.joblist[0].feature
+        for scenario in feature.scenarios:
+            scenario.steps = [
+                model.Step('foo.feature', 4, u'Given', u'given', u'alice'),
+                model.Step('foo.feature', 5, u'When', u'when', u'bob'),
+                model.Step('foo.feature', 6, u'Then', u'then', u'charly'),
+            ]
+        record = r.make_timeout_record(2, feature, u'TIMEOUT: 60s', position)
+        jobrecord.apply_record(feature, record, jobrecord.OutputStore())
+        return feature
+
+    def test_timeout_record_fails_step_that_hung(self):
+        feature = self.make_timeout_record((1, 1, False))
+
+        one, two = feature.scenarios
+        eq_((feature.status, one.status, two.status),
+            ('failed', 'skipped', 'failed'))
+        eq_([step.status for step in two.steps],
+            ['passed', 'failed', 'skipped'])
+        eq_(two.steps[1].error_message, u'TIMEOUT: 60s')
+        eq_(two.steps[1].exception.type_name, 'Timeout')
+
+    def test_timeout_record_fails_next_step_after_hook_hung(self):
+        feature = self.make_timeout_record((0, 0, True))
+        eq_([step.status for step in feature.scenarios[0].steps],
+            ['passed', 'failed', 'skipped'])
+        feature = self.make_timeout_record((0, 2, True))
+        eq_([step.status for step in feature.scenarios[0].steps],
+            ['passed', 'passed', 'failed'])
+
+    def test_timeout_record_without_progress_fails_first_step(self):
+        feature = self.make_timeout_record(None)
+        one, two = feature.scenarios
+        eq_((one.status, two.status), ('failed', 'untested'))
+        eq_([step.status for step in one.steps],
+            ['failed', 'skipped', 'skipped'])
+
+    def test_step_progress_ends_before_slow_hook_after_step(self):
+        r = self.make_affinity_runner('feature')
+        scenario = r.joblist[0]
+        scenario.steps = [
+            model.Step('foo.feature', 4, u'Given', u'given', u'I pass')]
+        step = scenario.steps[0]
+        r.config.step_timeout = 2.0
+        r.config.scenario_timeout = None
+        r.config.dry_run = False
+        r.progress_channel = Mock()
+        r.progress_job = scenario
+        sent_before_hooks = []
+        def slow_hook(context, *args):
+            sent_before_hooks.append(
+                [call[0][1] for call in r.progress_channel.send.call_args_list])
+        r.hooks = {'after_step': slow_hook, 'after_scenario': slow_hook}
+        r.context = runner.Context(r)
+        r.run_hook('before_scenario', r.context, scenario)
+        r.run_hook('before_step', r.context, step)
+        r.run_hook('after_step', r.context, step)
+        r.run_hook('after_scenario', r.context, scenario)
+
+        progress = [['scenario', u'one', 0.0, 0], ['step', u'I pass', 2.0, 0],
+                    ['step_done', 0]]
+        eq_(sent_before_hooks, [progress, progress])
+
+    def test_run_job_retries_failed_job(self):
+        r = self.make_affinity_runner('feature')
+        r.config.retry = 2
+        one = r.joblist[0]
+        one.steps = [model.Step('foo.feature', 4, u'Given', u'given', u'alice')]
+        statuses = ['failed', 'passed']
+
+        def run(runner):
+            eq_(one.steps[0].status, 'untested')
+            runner.formatters[0].scenario(one)
+            one.steps[0].status = statuses.pop(0)
+        one.run = run
+        record = r.run_job(1, one)
+
+        eq_(record['attempts'], 2)
+        eq_(record['scenarios'][0][:2], ['p', 'p'])
+        eq_(statuses, [])
+
+    def test_run_job_retries_with_limit_of_retry_tag(self):
+        r = self.make_affinity_runner('feature')
+        r.config.retry = None
+        one, two = r.joblist[0:2]
+        one.tags.append(u'retry:1')
+        for job in (one, two):
+            job.steps = [model.Step('foo.feature', 4, u'Given', u'given',
+                                    u'alice')]
+            job.run = lambda runner, job=job: self.fail_job(runner, job)
+
+        eq_(r.run_job(1, one)['attempts'], 2)
+        eq_(r.run_job(1, two)['attempts'], 1)
+
+    @staticmethod
+    def fail_job(runner, job):
+        runner.formatters[0].scenario(job)
+        job.steps[0].status = 'failed'
+
 
 class TestRunWithPaths(object):
     def setUp(self):
@@ -565,6 +901,9 @@ class TestRunWithPaths(object):
         self.config.logging_filter = None
         self.config.outputs = [ Mock(), StreamOpener(stream=sys.stdout) ]
         self.config.format = [ "plain", "progress" ]
+        self.config.shard = None
+        self.config.fork_server = False
+        self.config.preload = None
         self.runner = runner.Runner(self.config)
         self.load_hooks = self.runner.load_hooks = Mock()
         self.load_step_definitions = self.runner.load_step_definitions = Mock()
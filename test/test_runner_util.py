@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+from mock import Mock
+from nose.tools import *
+
+from behave import parser
+from behave.runner_util import keep_scenarios, parse_shard, \
+    partition_by_duration, select_scenarios
+from behave.tag_expression import TagExpression
+
+FEATURE_TEXT = u"""
+Feature: Alice
+  Scenario: Bob
+    Given a step
+
+  @slow
+  Scenario: Charly
+    Given a step
+
+  Scenario Outline: Dora
+    Given a step with <name>
+
+    Examples:
+      | name |
+      | one  |
+      | two  |
+"""
+
+
+class TestShards(object):
+
+    def test_parse_shard_returns_zero_based_index(self):
+        eq_(parse_shard("2/4"), (1, 4))
+        eq_(parse_shard("1/1"), (0, 1))
+
+    def test_parse_shard_rejects_invalid_shards(self):
+        for text in ("2", "0/4", "5/4", "a/b", "1/2/3", "-1/2"):
+            assert_raises(ValueError, parse_shard, text)
+
+    def test_partition_balances_total_durations(self):
+        partitions = partition_by_duration([1.0, 5.0, 2.0, 2.0, 1.0, 1.0], 2)
+        eq_(partitions, [1, 0, 1, 1, 0, 1])
+
+    def test_partition_without_durations_balances_counts(self):
+        partitions = partition_by_duration([1.0] * 7, 3)
+        eq_(partitions, [0, 1, 2, 0, 1, 2, 0])
+
+    def test_shards_cover_all_items_once(self):
+        estimates = [3.0, 0.5, 7.0, 1.0, 1.0, 2.5, 4.0]
+        partitions = partition_by_duration(estimates, 3)
+        eq_(partitions, partition_by_duration(estimates, 3))
+        eq_(sorted(set(partitions)), [0, 1, 2])
+        eq_(len(partitions), len(estimates))
+
+
+class TestSelectScenarios(object):
+
+    def setUp(self):
+        self.feature = parser.parse_feature(FEATURE_TEXT,
+                                            filename="alice.feature")
+        self.config = Mock(tags=TagExpression([]), name=None)
+
+    def test_select_scenarios_expands_outlines(self):
+        names = [scenario.name
+                 for scenario in select_scenarios(self.feature, self.config)]
+        eq_(names, [u"Bob", u"Charly", u"Dora", u"Dora"])
+
+    def test_select_scenarios_filters_by_tags_and_name(self):
+        self.config.tags = TagExpression(["~@slow"])
+        self.config.name = ["Dora"]
+        self.config.name_re = re.compile("Dora")
+        names = [scenario.name
+                 for scenario in select_scenarios(self.feature, self.config)]
+        eq_(names, [u"Dora", u"Dora"])
+
+    def test_keep_scenarios_removes_other_scenarios(self):
+        bob, charly, outline = self.feature.scenarios
+        kept = [bob, outline.scenarios[1]]
+        eq_(keep_scenarios([self.feature], kept), [self.feature])
+        eq_(self.feature.scenarios, [bob, outline])
+        eq_(self.feature.walk_scenarios(), kept)
+
+    def test_keep_scenarios_removes_empty_features(self):
+        eq_(keep_scenarios([self.feature], []), [])
@@ -2,7 +2,7 @@ from __future__ import with_statement
 
 from mock import Mock, patch
 from nose.tools import *
-from behave import step_registry
+from behave import matchers, step_registry
 
 class TestStepRegistry(object):
     def test_add_step_definition_adds_to_lowercased_keyword(self):
@@ -76,6 +76,56 @@ class TestStepRegistry(object):
         for mock in step_defs[6:]:
             eq_(mock.match.call_count, 0)
 
+    def make_step(self, step_type, name):
+        step = Mock()
+        step.step_type = step_type
+        step.name = name
+        return step
+
+    def test_find_match_tries_only_candidates_of_step_name(self):
+        registry = step_registry.StepRegistry()
+        definitions = [matchers.ParseMatcher(None, 'the user {name} logs in'),
+                       matchers.ParseMatcher(None, 'the admin logs in'),
+                       matchers.RegexMatcher(None, 'a (?P<name>.+) logs in'),
+                       matchers.ParseMatcher(None, '{name} logs out')]
+        registry.steps['when'] = definitions[:3]
+        registry.steps['step'] = definitions[3:]
+        index = registry.get_index('when')
+
+        eq_(index.candidates(u'The user Bob logs in'),
+            [definitions[0], definitions[3]])
+        eq_(index.candidates(u'the admin logs in'),
+            [definitions[1], definitions[3]])
+        eq_(index.candidates(u'Bob logs out'), [definitions[3]])
+
+    def test_find_match_keeps_first_match_wins_order(self):
+        registry = step_registry.StepRegistry()
+        first = matchers.ParseMatcher(lambda context, who: None,
+                                      '{who} logs in')
+        second = matchers.ParseMatcher(lambda context: None,
+                                       'the user logs in')
+        registry.steps['given'] = [first, second]
+
+        step = self.make_step('given', u'the user logs in')
+        eq_(registry.find_match(step).func, first.func)
+        eq_(registry.find_step_definition(step), first)
+
+    def test_index_is_rebuilt_when_step_definitions_change(self):
+        registry = step_registry.StepRegistry()
+        step = self.make_step('then', u'the user logs in')
+        eq_(registry.find_match(step), None)
+
+        func = lambda context: None
+        registry.add_step_definition('then', 'the user logs in', func)
+        eq_(registry.find_match(step).func, func)
+
+        # -- IN-PLACE CHANGE: Same list, same length.
+        other_func = lambda context: None
+        registry.steps['then'][0] = matchers.get_matcher(other_func,
+                                                         'the user logs out')
+        registry.steps_changed()
+        eq_(registry.find_match(step), None)
+
     @patch.object(step_registry.registry, 'add_step_definition')
     def test_make_step_decorator_ends_up_adding_a_step_definition(self, add_step_definition):
         step_type = object()
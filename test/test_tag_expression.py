@@ -1,6 +1,6 @@
 from nose import tools
 
-from behave.tag_expression import TagExpression
+from behave.tag_expression import TagExpression, split_tag_limit, get_tag_limit
 
 class TestTagExpressionNoTags(object):
     def setUp(self):
@@ -91,3 +91,17 @@ class TestTagExpressionTagLimits(object):
         e = TagExpression(['todo:3', '-todo:3'])
         tools.eq_(e.limits, {'todo': 3})
 
+class TestTagLimitHelpers(object):
+    def test_split_tag_with_limit(self):
+        tools.eq_(split_tag_limit('timeout:120'), ('timeout', 120))
+
+    def test_split_plain_tag(self):
+        tools.eq_(split_tag_limit('slow'), ('slow', None))
+
+    def test_get_tag_limit_of_first_matching_tag(self):
+        tags = ['slow', 'timeout:120', 'timeout:5']
+        tools.eq_(get_tag_limit(tags, 'timeout'), 120)
+
+    def test_get_tag_limit_uses_default(self):
+        tools.eq_(get_tag_limit(['slow', 'timeouts:3'], 'timeout', 10), 10)
+        tools.eq_(get_tag_limit(['timeout:never'], 'timeout', 10), 10)
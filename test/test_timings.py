@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from behave.model import Feature, Scenario, ScenarioOutline, Examples, Table
+from behave.model import Step
+from behave.timings import TimingDatabase, TimingStatistics, \
+    collect_timings, make_timing_key
+
+
+def make_feature(filename, *scenarios):
+    feature = Feature(filename, 1, u"Feature", u"Alice")
+    for scenario in scenarios:
+        feature.add_scenario(scenario)
+    return feature
+
+
+def make_scenario(filename, line, name):
+    return Scenario(filename, line, u"Scenario", name)
+
+
+class TestMakeTimingKey(object):
+
+    def test_uses_filename_line_and_name(self):
+        scenario = make_scenario("foo.feature", 3, u"Bob")
+        eq_(make_timing_key(scenario), u"foo.feature:3:Bob")
+
+    def test_uses_row_line_for_scenario_outline_scenarios(self):
+        table = Table([u"x"], 0)
+        table.add_row([u"1"], 10)
+        table.add_row([u"2"], 11)
+        outline = ScenarioOutline("foo.feature", 5, u"Scenario Outline",
+                                  u"Charly", examples=[
+                                    Examples("foo.feature", 9, u"Examples",
+                                             u"", table)])
+        keys = [make_timing_key(scenario) for scenario in outline.scenarios]
+        eq_(keys, [u"foo.feature:10:Charly", u"foo.feature:11:Charly"])
+
+
+class TestCollectTimings(object):
+
+    def test_collects_scenario_and_steps_that_were_run(self):
+        step1 = Step("foo.feature", 4, u"Given", u"given", u"alice")
+        step2 = Step("foo.feature", 5, u"When", u"when", u"bob")
+        step1.status, step1.duration = "passed", 1.0
+        step2.status, step2.duration = "failed", 2.0
+        scenario = Scenario("foo.feature", 3, u"Scenario", u"Charly",
+                            steps=[step1, step2])
+        eq_(collect_timings(scenario), [
+            (u"foo.feature:3:Charly", "scenario", 3.0),
+            (u"foo.feature:4:alice", "step", 1.0),
+            (u"foo.feature:5:bob", "step", 2.0),
+        ])
+
+    def test_skipped_scenario_is_not_collected(self):
+        step = Step("foo.feature", 4, u"Given", u"given", u"alice")
+        scenario = Scenario("foo.feature", 3, u"Scenario", u"Bob",
+                            steps=[step])
+        scenario.mark_skipped()
+        eq_(collect_timings(scenario), [])
+
+
+class TestTimingStatistics(object):
+
+    def test_rolling_statistics(self):
+        statistics = TimingStatistics(u"foo.feature:3:Bob", "scenario")
+        for duration in (2.0, 4.0, 6.0):
+            statistics.add(duration)
+        eq_(statistics.runs, 3)
+        eq_(statistics.last, 6.0)
+        eq_(statistics.minimum, 2.0)
+        eq_(statistics.maximum, 6.0)
+        assert_almost_equal(statistics.mean, 4.0)
+        assert_almost_equal(statistics.stddev, 2.0)
+        assert_almost_equal(statistics.expected, 3.62)
+
+
+class TestTimingDatabase(object):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "timings.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_open_without_filename_returns_none(self):
+        eq_(TimingDatabase.open(""), None)
+        eq_(TimingDatabase.open(None), None)
+
+    def test_recorded_durations_are_available_in_next_run(self):
+        scenario = make_scenario("foo.feature", 3, u"Bob")
+        timings = TimingDatabase.open(self.filename)
+        timings.record(scenario, 1.5)
+        timings.flush()
+
+        timings = TimingDatabase.open(self.filename)
+        eq_(timings.estimate_duration(scenario), 1.5)
+
+    def test_sort_longest_first(self):
+        short = make_scenario("foo.feature", 3, u"short")
+        medium = make_scenario("foo.feature", 6, u"medium")
+        unknown = make_scenario("foo.feature", 9, u"unknown")
+        serial = make_feature("bar.feature",
+                              make_scenario("bar.feature", 3, u"one"),
+                              make_scenario("bar.feature", 6, u"two"))
+        timings = TimingDatabase.open(self.filename)
+        timings.record(short, 1.0)
+        timings.record(medium, 2.0)
+        for scenario in serial.scenarios:
+            timings.record(scenario, 5.0)
+        timings.flush()
+
+        jobs = timings.sort_longest_first([short, unknown, medium, serial])
+        eq_(jobs, [serial, unknown, medium, short])
+
+    def test_estimate_durations_uses_average_for_unknown_jobs(self):
+        short = make_scenario("foo.feature", 3, u"short")
+        medium = make_scenario("foo.feature", 6, u"medium")
+        unknown = make_scenario("foo.feature", 9, u"unknown")
+        timings = TimingDatabase.open(self.filename)
+        timings.record(short, 1.0)
+        timings.record(medium, 2.0)
+        timings.flush()
+
+        eq_(timings.estimate_durations([short, unknown, medium]),
+            [1.0, 1.5, 2.0])
+
+    def test_statistics_are_updated_by_each_run(self):
+        scenario = make_scenario("foo.feature", 3, u"Bob")
+        for duration in (1.0, 3.0):
+            timings = TimingDatabase.open(self.filename)
+            timings.record(scenario, duration)
+            timings.flush()
+
+        timings = TimingDatabase.open(self.filename)
+        statistics = timings.get_statistics(make_timing_key(scenario))
+        eq_(statistics.runs, 2)
+        assert_almost_equal(statistics.mean, 2.0)
+
+    def test_concurrent_runs_keep_each_others_updates(self):
+        scenario = make_scenario("foo.feature", 3, u"Bob")
+        first = TimingDatabase.open(self.filename)
+        second = TimingDatabase.open(self.filename)
+        first.load()
+        second.load()   # -- Before the first run writes its durations.
+        first.record(scenario, 1.0)
+        second.record(scenario, 3.0)
+        first.flush()
+        second.flush()
+
+        timings = TimingDatabase.open(self.filename)
+        statistics = timings.get_statistics(make_timing_key(scenario))
+        eq_(statistics.runs, 2)
+        assert_almost_equal(statistics.mean, 2.0)
+        eq_(second.get_statistics(make_timing_key(scenario)).runs, 2)
+
+    def test_slowest_selects_by_type(self):
+        timings = TimingDatabase.open(self.filename)
+        timings.record_all([(u"a", "scenario", 1.0), (u"b", "step", 5.0),
+                            (u"c", "scenario", 3.0)])
+        timings.flush()
+        keys = [statistics.key for statistics in timings.slowest("scenario")]
+        eq_(keys, [u"c", u"a"])